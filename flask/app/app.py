@@ -1,50 +1,213 @@
-from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Blueprint, Flask, current_app, request, jsonify, send_file
 from sqlalchemy import text
 import os
 import sys
 import traceback
 import time
 import logging
+import click
 from datetime import datetime, timedelta
 from sqlalchemy.exc import SQLAlchemyError
-from models import db, DimDate, DimCompany, FactMarketMetrics
-import pytest
+from werkzeug.datastructures import MultiDict
 # Import models
 from models import db, DimDate, DimCompany, FactMarketMetrics
+from queries import (
+    parse_date_window, earliest_date, market_query, stock_query, stocks_query, row_converter,
+    encode_cursor, decode_cursor, seek_after, group_by_symbol, parse_fields, MARKET_FIELDS, STOCK_FIELDS
+)
+from streaming import wants_ndjson, ndjson_response
+from columnar import columnar_format, columnar_response, ColumnarUnavailable
+from cache import response_cache
+from watermark import bump_data_version, data_version
+from compression import response_compression
+from rollups import GRAINS, refresh_rollups, rollups_stale, rollup_query, format_rollup_row
+from latest import LATEST_FIELDS, refresh_latest, latest_stale, latest_query
+from provisioning import ensure_indexes
+from partitions import BACKFILL_BATCH_SIZE, ensure_trade_datetime, backfill_trade_datetime, ensure_partitions, convert_to_partitioned
+from explain import EXPLAIN_BUILDERS, explain_endpoint
+from dimensions import dimension_cache, cached_fact_rows
+from schema_cache import schema_cache
+from metrics import request_metrics, PROMETHEUS_MIMETYPE
+from ingest import IngestError, ingest_format, read_records, ingest_records
+from serialization import FastJSONProvider, RowEncoder, rows_response
+from exports import EXPORT_FORMATS, ExportError, export_jobs
+from screener import ScreenerUnavailable, company_screener, parse_screen
+from indicators import INDICATOR_FIELDS, IndicatorsUnavailable, parse_indicators, compute_indicators
+from series_store import SeriesStoreUnavailable, series_store
+
+# Database URL create_app() connects to by default - use SQLite as fallback
+database_url = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///app.db')
+
+# Routes and CLI commands, registered on the app by create_app()
+api = Blueprint('api', __name__, cli_group=None)
 
-# Print startup message for debugging
-print("Starting Flask application...", file=sys.stderr)
 
-# Initialize Flask app
-app = Flask(__name__)
+def create_app(config=None):
+    """Build a configured app: settings from the environment, then ``config`` overrides.
+
+    Startup provisioning (indexes, partitions) runs here, once per process
+    that builds the app; under gunicorn with ``preload_app`` that is the
+    master, before workers are forked (see gunicorn.conf.py). Importing
+    this module builds nothing: the served instance lives in wsgi.py.
+    Extension state (caches, metrics, stores) is kept per app in
+    ``app.extensions``, so apps built side by side stay independent.
+    """
+    # Print startup message for debugging
+    print("Starting Flask application...", file=sys.stderr)
+
+    # Initialize Flask app
+    app = Flask(__name__)
+
+    # Database configuration - use SQLite as fallback
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # Response cache configuration (CACHE_BACKEND: memory, redis or none)
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_TTL_SECONDS'] = float(os.environ.get('CACHE_TTL_SECONDS', 300))
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+    app.config['CACHE_WATERMARK_INTERVAL_SECONDS'] = float(os.environ.get('CACHE_WATERMARK_INTERVAL_SECONDS', 1))
+
+    # Single-flight: identical concurrent misses share one view execution (across workers with the redis backend)
+    app.config['CACHE_SINGLE_FLIGHT'] = os.environ.get('CACHE_SINGLE_FLIGHT', 'true').lower() == 'true'
+    app.config['CACHE_SINGLE_FLIGHT_TIMEOUT_SECONDS'] = float(os.environ.get('CACHE_SINGLE_FLIGHT_TIMEOUT_SECONDS', 30))
+
+    # Conditional GET: strong ETags from the query parameters and the fact-table watermark (304 on If-None-Match)
+    app.config['ETAGS_ENABLED'] = os.environ.get('ETAGS_ENABLED', 'true').lower() == 'true'
+
+    # gzip/zstd response compression negotiated from Accept-Encoding (buffered bodies below the minimum are sent as is)
+    app.config['COMPRESSION_ENABLED'] = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    app.config['COMPRESSION_MIN_BYTES'] = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+    app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    app.config['COMPRESSION_ZSTD_LEVEL'] = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+
+    # Bearer token /admin/explain requires; the endpoint answers 404 while it is unset
+    app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
+    # In-memory dim_company/dim_date cache used for ticker lookups
+    app.config['DIMENSION_CACHE_ENABLED'] = os.environ.get('DIMENSION_CACHE_ENABLED', 'true').lower() == 'true'
+    app.config['DIMENSION_CACHE_CHECK_SECONDS'] = float(os.environ.get('DIMENSION_CACHE_CHECK_SECONDS', 30))
+
+    # Longest the in-memory screener copy of dim_company is reused before fundamentals are re-read
+    app.config['SCREENER_REFRESH_SECONDS'] = float(os.environ.get('SCREENER_REFRESH_SECONDS', 300))
+
+    # Maximum number of tickers accepted by POST /api/ml-model/stocks
+    app.config['BATCH_MAX_TICKERS'] = int(os.environ.get('BATCH_MAX_TICKERS', 1000))
+
+    # Fold newly loaded facts into the OHLCV rollups before serving /api/market/rollup
+    app.config['ROLLUP_REFRESH_ON_READ'] = os.environ.get('ROLLUP_REFRESH_ON_READ', 'true').lower() == 'true'
+    # Refresh transactions a stale /api/market/rollup read may run; `flask rollup-refresh` catches up the rest
+    app.config['ROLLUP_REFRESH_READ_BATCHES'] = int(os.environ.get('ROLLUP_REFRESH_READ_BATCHES', 1))
+
+    # Latest-quote snapshot behind /api/market/latest: fold new facts in after each ingest, and on read when stale
+    app.config['LATEST_REFRESH_ON_INGEST'] = os.environ.get('LATEST_REFRESH_ON_INGEST', 'true').lower() == 'true'
+    app.config['LATEST_REFRESH_ON_READ'] = os.environ.get('LATEST_REFRESH_ON_READ', 'true').lower() == 'true'
+    # Refresh transactions a stale /api/market/latest read may run; `flask latest-refresh` catches up the rest
+    app.config['LATEST_REFRESH_READ_BATCHES'] = int(os.environ.get('LATEST_REFRESH_READ_BATCHES', 1))
+    # How long the refreshes keep re-reading fact ids they skipped because their load had not committed yet
+    app.config['REFRESH_LATE_COMMIT_SECONDS'] = int(os.environ.get('REFRESH_LATE_COMMIT_SECONDS', 600))
+
+    # Create missing star-schema indexes (and fact_market_metrics.trade_datetime) when the app starts
+    app.config['PROVISION_INDEXES_ON_STARTUP'] = os.environ.get('PROVISION_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+    # Monthly fact partitions (PostgreSQL, after `flask partition-convert`): months created ahead,
+    # months kept attached (unset = keep all), and whether startup runs the maintenance
+    app.config['PARTITION_MONTHS_AHEAD'] = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+    app.config['PARTITION_RETENTION_MONTHS'] = int(os.environ['PARTITION_RETENTION_MONTHS']) if os.environ.get('PARTITION_RETENTION_MONTHS') else None
+    app.config['PARTITION_MAINTENANCE_ON_STARTUP'] = os.environ.get('PARTITION_MAINTENANCE_ON_STARTUP', 'true').lower() == 'true'
+
+    # Bulk ingestion: rows per transaction, and the bearer token POST /api/ingest requires (unset = open)
+    app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', 50000))
+    app.config['INGEST_TOKEN'] = os.environ.get('INGEST_TOKEN')
+
+    # How often /schema and /tables re-check the migration stamp (and refresh row estimates)
+    app.config['SCHEMA_CACHE_CHECK_SECONDS'] = float(os.environ.get('SCHEMA_CACHE_CHECK_SECONDS', 60))
+
+    # JSON encoder behind jsonify() and the row encoders: auto (orjson when installed), orjson or json
+    app.config['JSON_ENCODER'] = os.environ.get('JSON_ENCODER', 'auto')
+
+    # Background exports: directory for result files, writer threads per process, and how long files are kept
+    app.config['EXPORT_DIR'] = os.environ.get('EXPORT_DIR', '/app/exports')
+    app.config['EXPORT_WORKERS'] = int(os.environ.get('EXPORT_WORKERS', 2))
+    app.config['EXPORT_TTL_SECONDS'] = float(os.environ.get('EXPORT_TTL_SECONDS', 86400))
+
+    # Memory-mapped per-symbol price history for /api/ml-model/stock(s) (empty = disabled)
+    app.config['SERIES_STORE_DIR'] = os.environ.get('SERIES_STORE_DIR', '')
+    app.config['SERIES_STORE_REFRESH_ON_INGEST'] = os.environ.get('SERIES_STORE_REFRESH_ON_INGEST', 'true').lower() == 'true'
+
+    # Per-endpoint latency/stage histograms exposed at /metrics
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+    # Application log file (empty = log to stdout only)
+    app.config['LOG_FILE'] = os.environ.get('LOG_FILE', '/app/logs/api.log')
+
+    if config:
+        app.config.update(config)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Connection pool of the sync engine, which serves every buffered JSON response (WSGI and ASGI alike)
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_pre_ping': True,
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 30)),
+        })
+    app.json = FastJSONProvider(app)
+
+    # Initialize SQLAlchemy with app
+    db.init_app(app)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        # `flask db ...` needs Flask-Migrate; serving processes skip importing Alembic
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    response_cache.init_app(app)
+    dimension_cache.init_app(app)
+    company_screener.init_app(app)
+    schema_cache.init_app(app)
+    request_metrics.init_app(app)
+    response_compression.init_app(app)
+    export_jobs.init_app(app)
+    series_store.init_app(app)
+    handlers = [logging.StreamHandler(sys.stdout)]  # Print logs to console
+    if app.config['LOG_FILE']:
+        handlers.insert(0, logging.FileHandler(app.config['LOG_FILE'], mode='a'))  # Append logs to file
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=handlers
+    )
+    app.register_blueprint(api)
+
+    # Provision the trade_datetime column, its fill-in trigger and the indexes the queries below rely on
+    # (catalog lookups only once they exist; existing rows are back-filled by `flask trade-datetime-backfill`)
+    if app.config['PROVISION_INDEXES_ON_STARTUP']:
+        with app.app_context():
+            try:
+                ensure_trade_datetime()
+                created = ensure_indexes()
+                if created:
+                    logging.info(f"Provisioned indexes: {', '.join(created)}")
+            except SQLAlchemyError as e:
+                logging.warning(f"Index provisioning skipped: {e}")
+
+    # Create upcoming monthly partitions (and detach expired ones) when the fact table is partitioned
+    if app.config['PARTITION_MAINTENANCE_ON_STARTUP']:
+        with app.app_context():
+            try:
+                ensure_partitions(app.config['PARTITION_MONTHS_AHEAD'], app.config['PARTITION_RETENTION_MONTHS'])
+            except SQLAlchemyError as e:
+                logging.warning(f"Partition maintenance skipped: {e}")
+
+    return app
 
-# Database configuration - use SQLite as fallback
-database_url = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///app.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize SQLAlchemy with app
-db.init_app(app)
-migrate = Migrate(app, db)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("/app/logs/api.log", mode='a'),  # Append logs to file
-        logging.StreamHandler(sys.stdout)  # Print logs to console
-    ]
-)
 
 # Default route
-@app.route('/')
+@api.route('/')
 def home():
     db_status = "connected"
     try:
         # Try simple query to check connection
-        with app.app_context():
-            db.session.execute(text("SELECT 1"))
+        db.session.execute(text("SELECT 1"))
     except SQLAlchemyError as e:
         db_status = f"error: {str(e)}"
 
@@ -62,79 +225,28 @@ def log_request(endpoint, record_count, execution_time):
     logging.info(f"API: {endpoint} | Records Retrieved: {record_count} | Execution Time: {execution_time:.4f} seconds")
 
 # Route to view all tables
-@app.route('/tables')
+@api.route('/tables')
 def view_tables():
     try:
-        # Adjust query for SQLite compatibility
-        if "sqlite" in database_url:
-            query = text("SELECT name FROM sqlite_master WHERE type='table'")
-        else:
-            query = text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' ORDER BY table_name")
-
-        # Execute with explicit connection
-        with db.engine.connect() as conn:
-            result = conn.execute(query)
-            tables = [row[0] for row in result]
-
-        return jsonify({"tables": tables})
+        return jsonify(schema_cache.tables())
     except SQLAlchemyError as e:
         print(f"Error in view_tables: {e}", file=sys.stderr)
         print(traceback.format_exc(), file=sys.stderr)
         return jsonify({"error": str(e)}), 500
 
 
-
-# Route to get schema structure
-@app.route('/schema')
+# Route to get schema structure (columns, indexes and row estimates, cached per migration)
+@api.route('/schema')
 def get_schema():
     try:
-        schema_info = {}
-        
-        # Get all tables
-        if "sqlite" in database_url:
-            tables_query = text("SELECT name FROM sqlite_master WHERE type='table'")
-        else:
-            tables_query = text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' ORDER BY table_name")
-            
-        with db.engine.connect() as conn:
-            tables_result = conn.execute(tables_query)
-            tables = [row[0] for row in tables_result]
-            
-            # For each table, get column information
-            for table in tables:
-                if "sqlite" in database_url:
-                    # SQLite approach
-                    columns_query = text(f"PRAGMA table_info({table})")
-                    columns_result = conn.execute(columns_query)
-                    columns = [{"name": row[1], "type": row[2], "nullable": not row[3], "primary_key": bool(row[5])} 
-                              for row in columns_result]
-                else:
-                    # PostgreSQL/MySQL approach
-                    columns_query = text(f"""
-                        SELECT column_name, data_type, is_nullable, 
-                               CASE WHEN column_name IN (
-                                   SELECT column_name FROM information_schema.key_column_usage
-                                   WHERE table_name = '{table}' AND constraint_name LIKE '%pkey%'
-                               ) THEN TRUE ELSE FALSE END as is_primary
-                        FROM information_schema.columns
-                        WHERE table_name = '{table}'
-                        ORDER BY ordinal_position
-                    """)
-                    columns_result = conn.execute(columns_query)
-                    columns = [{"name": row[0], "type": row[1], 
-                               "nullable": row[2] == "YES", "primary_key": row[3]} 
-                              for row in columns_result]
-                
-                schema_info[table] = columns
-                
-        return jsonify({"schema": schema_info})
+        return jsonify(schema_cache.schema())
     except SQLAlchemyError as e:
         print(f"Error in get_schema: {e}", file=sys.stderr)
         print(traceback.format_exc(), file=sys.stderr)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/dim_date', methods=['GET'])
+@api.route('/api/dim_date', methods=['GET'])
 def get_dim_date():
     start_time = time.time()
     try:
@@ -156,7 +268,7 @@ def get_dim_date():
 # =============================
 # 2️⃣ GET DIM EXCHANGE
 # =============================
-@app.route('/api/dim_exchange', methods=['GET'])
+@api.route('/api/dim_exchange', methods=['GET'])
 def get_dim_exchange():
     start_time = time.time()
     try:
@@ -178,7 +290,7 @@ def get_dim_exchange():
 # =============================
 # 3️⃣ GET DIM COMMODITY
 # =============================
-@app.route('/api/dim_commodity', methods=['GET'])
+@api.route('/api/dim_commodity', methods=['GET'])
 def get_dim_commodity():
     start_time = time.time()
     try:
@@ -222,7 +334,7 @@ def get_dim_commodity():
 # =============================
 # 4️⃣ GET DIM COMPANY
 # =============================
-@app.route('/api/dim_company', methods=['GET'])
+@api.route('/api/dim_company', methods=['GET'])
 def get_dim_company():
     start_time = time.time()
     try:
@@ -231,7 +343,11 @@ def get_dim_company():
         if not ticker:
             return jsonify({"error": "Ticker symbol is required"}), 400
 
-        results = DimCompany.query.filter(DimCompany.symbol == ticker).all()
+        if dimension_cache.enabled:
+            company = dimension_cache.company_by_symbol(ticker)
+            results = [company] if company else []
+        else:
+            results = DimCompany.query.filter(DimCompany.symbol == ticker).all()
         record_count = len(results)
 
         formatted_results = [{"symbol": row.symbol, "company_name": row.company_name, "sector": row.sector, "industry": row.industry} for row in results]
@@ -247,15 +363,254 @@ def get_dim_company():
         return jsonify({"error": str(e), "metadata": {"execution_time_seconds": execution_time}}), 500
 
 
+# Route to inspect the response cache
+@api.route('/api/cache/stats')
+def get_cache_stats():
+    return jsonify(response_cache.stats())
+
+
+# Prometheus scrape endpoint
+@api.route('/metrics')
+def get_metrics():
+    return current_app.response_class(request_metrics.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+# Route to show the query plan of an endpoint's generated SQL
+@api.route('/admin/explain')
+def admin_explain():
+    endpoint = request.args.get('endpoint')
+    analyze = request.args.get('analyze', 'false').lower() == 'true'
+
+    # Disabled unless ADMIN_TOKEN is set: plans expose the schema, and analyze=true runs the query
+    token = current_app.config['ADMIN_TOKEN']
+    if not token:
+        return jsonify({"error": "Not found"}), 404
+    if request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    if endpoint not in EXPLAIN_BUILDERS:
+        return jsonify({"error": "Unknown or missing endpoint", "endpoints": sorted(EXPLAIN_BUILDERS)}), 400
+
+    # Every other query parameter is passed through to the endpoint's query builder
+    args = MultiDict([(k, v) for k, v in request.args.items(multi=True) if k not in ('endpoint', 'analyze')])
+    try:
+        sql, plan = explain_endpoint(endpoint, args, analyze=analyze)
+        return jsonify({"endpoint": endpoint, "analyze": analyze, "sql": sql, "plan": plan})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SQLAlchemyError as e:
+        logging.error(f"ERROR: /admin/explain | Endpoint: {endpoint} | Exception: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@api.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create any star-schema index declared in models.py that the database lacks."""
+    created = ensure_indexes()
+    click.echo(f"Created: {', '.join(created)}" if created else "All indexes present")
+
+
+@api.cli.command('partition-convert')
+def partition_convert_command():
+    """Rebuild fact_market_metrics as a monthly range-partitioned table (PostgreSQL)."""
+    start_time = time.time()
+    try:
+        created = convert_to_partitioned(current_app.config['PARTITION_MONTHS_AHEAD'])
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Created {len(created)} monthly partitions in {time.time() - start_time:.2f} seconds")
+
+
+@api.cli.command('trade-datetime-backfill')
+@click.option('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, show_default=True, help='Fact keys per UPDATE.')
+def trade_datetime_backfill_command(batch_size):
+    """Copy dim_date.datetime into facts whose trade_datetime is NULL."""
+    start_time = time.time()
+    ensure_trade_datetime()
+    updated = backfill_trade_datetime(batch_size)
+    click.echo(f"Back-filled {updated} fact rows in {time.time() - start_time:.2f} seconds")
+
+
+@api.cli.command('partition-maintain')
+@click.option('--months-ahead', type=int, help='Defaults to PARTITION_MONTHS_AHEAD.')
+@click.option('--retention-months', type=int, help='Detach partitions older than this (defaults to PARTITION_RETENTION_MONTHS).')
+def partition_maintain_command(months_ahead, retention_months):
+    """Create upcoming monthly fact partitions and detach expired ones."""
+    result = ensure_partitions(
+        months_ahead if months_ahead is not None else current_app.config['PARTITION_MONTHS_AHEAD'],
+        retention_months if retention_months is not None else current_app.config['PARTITION_RETENTION_MONTHS']
+    )
+    click.echo(
+        f"Created: {', '.join(result['created']) or 'none'} ({result['moved_rows']} rows moved from the default partition); "
+        f"detached: {', '.join(result['detached']) or 'none'}"
+    )
+
+
 # Route to get market data
-@app.route('/api/market')
+@api.route('/api/market')
+@response_cache.conditional('/api/market')
+@response_cache.cached('/api/market')
 def get_market_data():
+    start_time = time.time()
+    try:
+        country = request.args.get('country', 'US')
+        from_datetime, to_datetime = parse_date_window(request.args)
+        try:
+            fields = parse_fields(request.args.get('fields'), MARKET_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query = market_query(country, from_datetime, to_datetime, fields=fields)
+
+        if wants_ndjson(request):
+            return ndjson_response(
+                query, fields,
+                on_complete=lambda count, _: log_request("/api/market?format=ndjson", count, time.time() - start_time)
+            )
+
+        results = request_metrics.fetch_rows(query)
+
+        execution_time = time.time() - start_time
+        log_request("/api/market", len(results), execution_time)
+
+        # Rows are encoded straight to JSON bytes, company attributes once per symbol
+        with request_metrics.stage('serialize'):
+            return rows_response(RowEncoder(fields).encode_array(results), {
+                'metadata': {
+                    'record_count': len(results),
+                    'execution_time_seconds': execution_time
+                }
+            })
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        print(f"Error in get_market_data: {e}", file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+# Route to get pre-aggregated OHLCV rollups
+@api.route('/api/market/rollup', methods=['GET'])
+@response_cache.conditional('/api/market/rollup')
+@response_cache.cached('/api/market/rollup')
+def get_market_rollup():
+    start_time = time.time()
+    try:
+        grain = request.args.get('grain', 'day').lower()
+        country = request.args.get('country', 'US')
+        symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+
+        if grain not in GRAINS:
+            return jsonify({"error": f"grain must be one of: {', '.join(GRAINS)}"}), 400
+
+        from_datetime, to_datetime = parse_date_window(request.args, default_days='365')
+
+        if current_app.config['ROLLUP_REFRESH_ON_READ'] and rollups_stale():
+            refresh_rollups(max_batches=current_app.config['ROLLUP_REFRESH_READ_BATCHES'])
+
+        results = request_metrics.fetch_rows(rollup_query(grain, symbols, country, from_datetime, to_datetime).statement)
+        with request_metrics.stage('transform'):
+            formatted_results = [format_rollup_row(rollup, symbol) for rollup, symbol in results]
+
+        execution_time = time.time() - start_time
+        log_request(f"/api/market/rollup?grain={grain}", len(formatted_results), execution_time)
+
+        return jsonify({
+            'grain': grain,
+            'from': from_datetime.strftime('%Y-%m-%d'),
+            'to': to_datetime.strftime('%Y-%m-%d'),
+            'data': formatted_results,
+            'metadata': {
+                'record_count': len(formatted_results),
+                'execution_time_seconds': round(execution_time, 4)
+            }
+        })
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        logging.error(f"ERROR: /api/market/rollup | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+
+@api.cli.command('rollup-refresh')
+@click.option('--rebuild', is_flag=True, help='Drop and recompute every rollup from the fact table.')
+def rollup_refresh_command(rebuild):
+    """Fold newly loaded facts into the OHLCV rollup tables."""
+    start_time = time.time()
+    processed = refresh_rollups(rebuild=rebuild)
+    click.echo(f"Rolled up {processed} fact rows in {time.time() - start_time:.2f} seconds")
+
+# Route to get the latest quote of every company
+@api.route('/api/market/latest', methods=['GET'])
+@response_cache.conditional('/api/market/latest')
+@response_cache.cached('/api/market/latest')
+def get_market_latest():
+    start_time = time.time()
+    try:
+        country = request.args.get('country', 'US')
+        sectors = [s.strip() for s in request.args.get('sector', '').split(',') if s.strip()]
+        symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+
+        if current_app.config['LATEST_REFRESH_ON_READ'] and latest_stale():
+            refresh_latest(max_batches=current_app.config['LATEST_REFRESH_READ_BATCHES'])
+
+        results = request_metrics.fetch_rows(latest_query(country, sectors, symbols))
+
+        execution_time = time.time() - start_time
+        log_request("/api/market/latest", len(results), execution_time)
+
+        with request_metrics.stage('serialize'):
+            return rows_response(RowEncoder(LATEST_FIELDS).encode_array(results), {
+                'metadata': {
+                    'record_count': len(results),
+                    'execution_time_seconds': round(execution_time, 4)
+                }
+            })
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        logging.error(f"ERROR: /api/market/latest | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+
+@api.cli.command('latest-refresh')
+@click.option('--rebuild', is_flag=True, help='Drop and recompute the snapshot from the fact table.')
+def latest_refresh_command(rebuild):
+    """Fold newly loaded facts into the latest-quote snapshot."""
+    start_time = time.time()
+    processed = refresh_latest(rebuild=rebuild)
+    click.echo(f"Scanned {processed} fact rows in {time.time() - start_time:.2f} seconds")
+
+
+@api.cli.command('series-store-refresh')
+@click.option('--rebuild', is_flag=True, help='Delete the store and rewrite it from the fact table.')
+def series_store_refresh_command(rebuild):
+    """Append closed price history to the memory-mapped series store (SERIES_STORE_DIR)."""
+    if not series_store.enabled:
+        raise click.ClickException("SERIES_STORE_DIR is not set")
+    start_time = time.time()
+    merged = series_store.refresh(rebuild=rebuild)
+    click.echo(f"Merged {merged} fact rows in {time.time() - start_time:.2f} seconds")
+
+# Route to get stock data
+@api.route('/api/stock/<ticker>', methods=['GET'])
+def get_stock_data(ticker):
     start_time = time.time()
     try:
         days = request.args.get('days', '60')
         to_date = request.args.get('to', datetime.now().strftime('%Y-%m-%d'))
         from_date = request.args.get('from', None)
-        country = request.args.get('country', 'US')
+
+        company = DimCompany.query.filter_by(symbol=ticker).first()
+        if company is None:
+            return jsonify({"error": f"Company not found: {ticker}"}), 404
 
         try:
             to_datetime = datetime.strptime(to_date, '%Y-%m-%d')
@@ -276,27 +631,19 @@ def get_market_data():
             except ValueError:
                 from_datetime = to_datetime - timedelta(days=60)
 
-        query = db.session.query(
-            FactMarketMetrics, DimDate, DimCompany
+        results = db.session.query(
+            FactMarketMetrics, DimDate
         ).join(
             DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
-        ).join(
-            DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
         ).filter(
-            DimCompany.country == country,
+            FactMarketMetrics.fk_company_id == company.sk_company_id,
             DimDate.datetime.between(from_datetime, to_datetime)
         ).order_by(
-            DimCompany.symbol, DimDate.datetime
-        )
-
-        results = query.all()
+            DimDate.datetime
+        ).all()
 
         formatted_results = [
             {
-                'symbol': company.symbol,
-                'company_name': company.company_name,
-                'sector': company.sector,
-                'industry': company.industry,
                 'date': date.date,
                 'datetime': date.datetime.isoformat() if date.datetime else None,
                 'current_price': float(metric.current_price) if metric.current_price else None,
@@ -307,80 +654,90 @@ def get_market_data():
                 'day_high': float(metric.day_high) if metric.day_high else None,
                 'market_cap': float(metric.market_cap) if metric.market_cap else None
             }
-            for metric, date, company in results
+            for metric, date in results
         ]
 
         execution_time = time.time() - start_time
+        logging.info(f"API: /api/stock/{ticker} | Records Retrieved: {len(formatted_results)} | Execution Time: {execution_time:.4f} seconds")
 
         return jsonify({
+            'company': {
+                'symbol': company.symbol,
+                'company_name': company.company_name,
+                'sector': company.sector,
+                'industry': company.industry,
+                'country': company.country
+            },
+            'from': from_datetime.strftime('%Y-%m-%d'),
+            'to': to_datetime.strftime('%Y-%m-%d'),
             'data': formatted_results,
             'metadata': {
                 'record_count': len(formatted_results),
-                'execution_time_seconds': execution_time
+                'execution_time_seconds': round(execution_time, 4)
             }
         })
     except SQLAlchemyError as e:
         execution_time = time.time() - start_time
-        print(f"Error in get_market_data: {e}", file=sys.stderr)
+        logging.error(f"Error fetching data for {ticker}: {e} | Execution Time: {execution_time:.4f} seconds")
         print(traceback.format_exc(), file=sys.stderr)
         return jsonify({
             "error": str(e),
             'metadata': {'execution_time_seconds': execution_time}
         }), 500
 
-# Route to get stock data 
-
-@app.route('/api/ml-model', methods=['GET'])
+@api.route('/api/ml-model', methods=['GET'])
+@response_cache.conditional('/api/ml-model')
+@response_cache.cached('/api/ml-model')
 def get_ml_model_data():
     start_time = time.time()  # Start execution timer
 
     try:
         # ✅ Get Query Parameters
-        days = request.args.get('days', '60')  # Default: 60 days
-        to_date = request.args.get('to', datetime.now().strftime('%Y-%m-%d'))
-        from_date = request.args.get('from', None)
         country = request.args.get('country', 'US')
-        limit = request.args.get('limit', 100)  # Default: 100 records
-        offset = request.args.get('offset', 0)  # Default: start from 0
+        limit = request.args.get('limit', 100, type=int)  # Default: 100 records
+        offset = request.args.get('offset', 0, type=int)  # Default: start from 0
+        cursor = request.args.get('cursor')  # Keyset pagination token from a previous page
 
-        # ✅ Convert 'to' Date or Set Default (today)
+        # ✅ Resolve the date window ('days=all' starts at the oldest DimDate)
+        from_datetime, to_datetime = parse_date_window(request.args, earliest=earliest_date)
+
+        # ✅ Projection: only the requested columns are selected (and only their tables joined)
         try:
-            to_datetime = datetime.strptime(to_date, '%Y-%m-%d')
-        except ValueError:
-            to_datetime = datetime.now()
+            fields = parse_fields(request.args.get('fields'), MARKET_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # ✅ Determine 'from' Date Based on 'days' or Set Default
-        if from_date is None:
-            if days.lower() == 'all':
-                oldest_record = DimDate.query.order_by(DimDate.datetime.asc()).first()
-                from_datetime = oldest_record.datetime if oldest_record else datetime(1900, 1, 1)
-            else:
-                try:
-                    from_datetime = to_datetime - timedelta(days=int(days))
-                except ValueError:
-                    from_datetime = to_datetime - timedelta(days=60)
-        else:
-            try:
-                from_datetime = datetime.strptime(from_date, '%Y-%m-%d')
-            except ValueError:
-                from_datetime = to_datetime - timedelta(days=60)
+        query = market_query(country, from_datetime, to_datetime, fields=fields)
 
-        # ✅ Optimize Query Performance
-        query = db.session.query(
-            FactMarketMetrics, DimDate, DimCompany
-        ).join(
-            DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
-        ).join(
-            DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
-        ).filter(
-            DimCompany.country == country,
-            DimDate.datetime.between(from_datetime, to_datetime)
-        ).order_by(
-            DimCompany.symbol, DimDate.datetime
-        ).limit(limit).offset(offset)  # ✅ Implement Pagination
+        # ✅ Keyset pagination: seek past the cursor row instead of scanning an OFFSET
+        if cursor:
+            try:
+                query = seek_after(query, decode_cursor(cursor))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            offset = 0
+
+        # ✅ NDJSON / Arrow / Parquet exports: unbounded unless limit/offset are passed explicitly
+        fmt = columnar_format(request)
+        if fmt or wants_ndjson(request):
+            if 'limit' in request.args:
+                query = query.limit(limit)
+            if 'offset' in request.args:
+                query = query.offset(offset)
+            if fmt:
+                return columnar_response(
+                    query, fmt, fields=fields,
+                    on_complete=lambda count: log_request(f"/api/ml-model?format={fmt}", count, time.time() - start_time)
+                )
+            return ndjson_response(
+                query, fields,
+                on_complete=lambda count, _: log_request("/api/ml-model?format=ndjson", count, time.time() - start_time)
+            )
+
+        query = query.limit(limit).offset(offset)  # ✅ Implement Pagination
 
         # ✅ Fetch Query Results
-        results = query.all()
+        results = request_metrics.fetch_rows(query)
         record_count = len(results)  # Number of records retrieved
 
         # ✅ Handle No Data Found
@@ -392,43 +749,31 @@ def get_ml_model_data():
                 "metadata": {"record_count": 0, "execution_time_seconds": round(execution_time, 4)}
             }), 404
 
-        # ✅ Format Response Data
-        formatted_results = [
-            {
-                'symbol': company.symbol,
-                'company_name': company.company_name,
-                'sector': company.sector,
-                'industry': company.industry,
-                'date': date.date,
-                'datetime': date.datetime.isoformat() if date.datetime else None,
-                'current_price': float(metric.current_price) if metric.current_price else None,
-                'change': float(metric.change) if metric.change else None,
-                'change_percentage': float(metric.change_percentage) if metric.change_percentage else None,
-                'volume': metric.volume,
-                'day_low': float(metric.day_low) if metric.day_low else None,
-                'day_high': float(metric.day_high) if metric.day_high else None,
-                'market_cap': float(metric.market_cap) if metric.market_cap else None
-            }
-            for metric, date, company in results
-        ]
+        # ✅ Cursor for the next page, only when this page came back full
+        next_cursor = encode_cursor(results[-1]) if record_count == limit else None
 
         execution_time = time.time() - start_time  # ✅ Calculate Execution Time
 
         # ✅ Log API request details
         logging.info(f"API: /api/ml-model | Country: {country} | Records: {record_count} | Execution Time: {execution_time:.4f} seconds")
 
-        return jsonify({
-            'from': from_datetime.strftime('%Y-%m-%d'),
-            'to': to_datetime.strftime('%Y-%m-%d'),
-            'country': country,
-            'data': formatted_results,
-            'metadata': {
-                'record_count': record_count,
-                'execution_time_seconds': round(execution_time, 4),
-                'limit': limit,
-                'offset': offset
-            }
-        })
+        # ✅ Encode rows straight to JSON bytes, company attributes once per symbol
+        with request_metrics.stage('serialize'):
+            return rows_response(RowEncoder(fields).encode_array(results), {
+                'from': from_datetime.strftime('%Y-%m-%d'),
+                'to': to_datetime.strftime('%Y-%m-%d'),
+                'country': country,
+                'metadata': {
+                    'record_count': record_count,
+                    'execution_time_seconds': round(execution_time, 4),
+                    'limit': limit,
+                    'offset': offset,
+                    'next_cursor': next_cursor
+                }
+            })
+
+    except ColumnarUnavailable as e:
+        return jsonify({"error": str(e)}), 501
 
     except SQLAlchemyError as e:
         execution_time = time.time() - start_time
@@ -441,101 +786,311 @@ def get_ml_model_data():
         }), 500
 
 
-@app.route('/api/ml-model/stock', methods=['GET'])
+@api.route('/api/ml-model/stock', methods=['GET'])
+@response_cache.conditional('/api/ml-model/stock')
+@response_cache.cached('/api/ml-model/stock')
 def get_single_stock_ml_data():
     start_time = time.time()  # Start tracking execution time
 
     try:
         # Get query parameters
         ticker = request.args.get('ticker')  # Required
-        days = request.args.get('days', '60')  # Default 60 days
-        to_date = request.args.get('to', datetime.now().strftime('%Y-%m-%d'))
-        from_date = request.args.get('from', None)
 
         # Ensure ticker is provided
         if not ticker:
             return jsonify({"error": "Ticker symbol is required"}), 400
 
-        # Convert 'to' date or set default (today)
+        # Determine the date window ('days=all' starts at the oldest DimDate)
+        from_datetime, to_datetime = parse_date_window(request.args, earliest=earliest_date)
         try:
-            to_datetime = datetime.strptime(to_date, '%Y-%m-%d')
-        except ValueError:
-            to_datetime = datetime.now()
+            fields = parse_fields(request.args.get('fields'), STOCK_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Determine 'from' date based on 'days' or set default
-        if from_date is None:
-            if days.lower() == 'all':
-                oldest_record = DimDate.query.order_by(DimDate.datetime.asc()).first()
-                from_datetime = oldest_record.datetime if oldest_record else datetime(1900, 1, 1)
+        # Query market data for the specified stock
+        query = stock_query(ticker, from_datetime, to_datetime, fields=fields)
+
+        fmt = columnar_format(request)
+        if fmt:
+            return columnar_response(
+                query, fmt, fields=fields,
+                on_complete=lambda count: log_request(f"/api/ml-model/stock?format={fmt}", count, time.time() - start_time)
+            )
+
+        # Fetch query results (fact columns only when the dimension cache can supply the rest)
+        if dimension_cache.enabled:
+            company = dimension_cache.company_by_symbol(ticker)
+            if series_store.enabled and fields == STOCK_FIELDS:
+                formatted_results = series_store.fact_rows([company] if company else [], from_datetime, to_datetime)
             else:
-                try:
-                    from_datetime = to_datetime - timedelta(days=int(days))
-                except ValueError:
-                    from_datetime = to_datetime - timedelta(days=60)
+                formatted_results = cached_fact_rows([company] if company else [], from_datetime, to_datetime, fields=fields)
         else:
-            try:
-                from_datetime = datetime.strptime(from_date, '%Y-%m-%d')
-            except ValueError:
-                from_datetime = to_datetime - timedelta(days=60)
-
-        # Query market data for the specified stock
-        query = db.session.query(
-            FactMarketMetrics, DimDate, DimCompany
-        ).join(
-            DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
-        ).join(
-            DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
-        ).filter(
-            DimCompany.symbol == ticker,
-            DimDate.datetime.between(from_datetime, to_datetime)
-        ).order_by(
-            DimDate.datetime
-        )
-
-        # Fetch query results
-        results = query.all()
-        record_count = len(results)  # Get number of records retrieved
-
-        # Format response data
-        formatted_results = [
-            {
-                'symbol': company.symbol,
-                'company_name': company.company_name,
-                'sector': company.sector,
-                'industry': company.industry,
-                'country': company.country,
-                'date': date.date,
-                'datetime': date.datetime.isoformat() if date.datetime else None,
-                'current_price': float(metric.current_price) if metric.current_price else None,
-                'change': float(metric.change) if metric.change else None,
-                'change_percentage': float(metric.change_percentage) if metric.change_percentage else None,
-                'volume': metric.volume,
-                'day_low': float(metric.day_low) if metric.day_low else None,
-                'day_high': float(metric.day_high) if metric.day_high else None,
-                'market_cap': float(metric.market_cap) if metric.market_cap else None
-            }
-            for metric, date, company in results
-        ]
+            results = request_metrics.fetch_rows(query)
+            with request_metrics.stage('transform'):
+                convert = row_converter(fields)
+                formatted_results = [convert(row) for row in results]
+        record_count = len(formatted_results)  # Get number of records retrieved
 
         execution_time = time.time() - start_time  # Calculate execution time
 
         # ✅ Log number of records retrieved and retrieval time
         logging.info(f"Ticker: {ticker} | Records Retrieved: {record_count} | Execution Time: {execution_time:.4f} seconds")
 
+        with request_metrics.stage('serialize'):
+            return jsonify({
+                'ticker': ticker,
+                'from': from_datetime.strftime('%Y-%m-%d'),
+                'to': to_datetime.strftime('%Y-%m-%d'),
+                'data': formatted_results,
+                'metadata': {
+                    'record_count': record_count,
+                    'execution_time_seconds': round(execution_time, 4)
+                }
+            })
+
+    except (ColumnarUnavailable, SeriesStoreUnavailable) as e:
+        return jsonify({"error": str(e)}), 501
+
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        logging.error(f"Error fetching data for {ticker}: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+
         return jsonify({
-            'ticker': ticker,
-            'from': from_datetime.strftime('%Y-%m-%d'),
-            'to': to_datetime.strftime('%Y-%m-%d'),
-            'data': formatted_results,
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+@api.cli.command('data-version-bump')
+def data_version_bump_command():
+    """Invalidate cached responses after facts were changed outside the API."""
+    bump_data_version()
+    db.session.commit()
+    click.echo(f"data_version is now {data_version()}")
+
+
+@api.route('/api/ml-model/stocks', methods=['POST'])
+def get_multi_stock_ml_data():
+    start_time = time.time()  # Start tracking execution time
+
+    try:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({"error": "Body must be a JSON object with a non-empty 'tickers' list"}), 400
+        tickers = body.get('tickers')
+
+        # Ensure a list of tickers is provided
+        if not isinstance(tickers, list) or not tickers or not all(isinstance(t, str) for t in tickers):
+            return jsonify({"error": "Body must contain a non-empty 'tickers' list"}), 400
+        tickers = list(dict.fromkeys(t.strip() for t in tickers if t.strip()))
+        if len(tickers) > current_app.config['BATCH_MAX_TICKERS']:
+            return jsonify({"error": f"At most {current_app.config['BATCH_MAX_TICKERS']} tickers per request"}), 400
+
+        # Shared date window: body values take precedence over query parameters
+        window = {**request.args.to_dict(), **{k: str(body[k]) for k in ('days', 'from', 'to') if k in body}}
+        from_datetime, to_datetime = parse_date_window(window, earliest=earliest_date)
+
+        # One query for every ticker, grouped per symbol in Python
+        if dimension_cache.enabled:
+            companies = [c for c in map(dimension_cache.company_by_symbol, tickers) if c is not None]
+            fetch = series_store.fact_rows if series_store.enabled else cached_fact_rows
+            results = fetch(companies, from_datetime, to_datetime)
+        else:
+            rows = request_metrics.fetch_rows(stocks_query(tickers, from_datetime, to_datetime))
+            with request_metrics.stage('transform'):
+                convert = row_converter(STOCK_FIELDS)
+                results = [convert(row) for row in rows]
+        with request_metrics.stage('transform'):
+            grouped = group_by_symbol(results)
+
+        execution_time = time.time() - start_time
+        logging.info(f"API: /api/ml-model/stocks | Tickers: {len(tickers)} | Records Retrieved: {len(results)} | Execution Time: {execution_time:.4f} seconds")
+
+        with request_metrics.stage('serialize'):
+            return jsonify({
+                'from': from_datetime.strftime('%Y-%m-%d'),
+                'to': to_datetime.strftime('%Y-%m-%d'),
+                'data': grouped,
+                'missing': [t for t in tickers if t not in grouped],
+                'metadata': {
+                    'ticker_count': len(tickers),
+                    'record_count': len(results),
+                    'execution_time_seconds': round(execution_time, 4)
+                }
+            })
+
+    except SeriesStoreUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        logging.error(f"ERROR: /api/ml-model/stocks | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+@api.route('/api/ml-model/indicators', methods=['GET'])
+@response_cache.conditional('/api/ml-model/indicators')
+@response_cache.cached('/api/ml-model/indicators')
+def get_ml_model_indicators():
+    start_time = time.time()
+
+    try:
+        # One ticker (?ticker=) or a comma-separated batch (?tickers=)
+        tickers = [t.strip() for t in request.args.get('tickers', request.args.get('ticker', '')).split(',') if t.strip()]
+        if not tickers:
+            return jsonify({"error": "Ticker symbol is required"}), 400
+        if len(tickers) > current_app.config['BATCH_MAX_TICKERS']:
+            return jsonify({"error": f"At most {current_app.config['BATCH_MAX_TICKERS']} tickers per request"}), 400
+
+        try:
+            indicators = parse_indicators(request.args.get('indicators'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        from_datetime, to_datetime = parse_date_window(request.args, earliest=earliest_date)
+
+        # Only the price/volume columns the kernels need, ordered by symbol and time
+        rows = request_metrics.fetch_rows(stocks_query(tickers, from_datetime, to_datetime, fields=INDICATOR_FIELDS))
+        with request_metrics.stage('transform'):
+            series = compute_indicators(rows, indicators)
+
+        execution_time = time.time() - start_time
+        log_request(f"/api/ml-model/indicators?tickers={','.join(tickers)}", len(rows), execution_time)
+
+        with request_metrics.stage('serialize'):
+            return jsonify({
+                'from': from_datetime.strftime('%Y-%m-%d'),
+                'to': to_datetime.strftime('%Y-%m-%d'),
+                'indicators': [output_name for output_name, _, _ in indicators],
+                'data': series,
+                'missing': [t for t in tickers if t not in series],
+                'metadata': {
+                    'ticker_count': len(tickers),
+                    'record_count': len(rows),
+                    'execution_time_seconds': round(execution_time, 4)
+                }
+            })
+
+    except IndicatorsUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+
+    except SQLAlchemyError as e:
+        execution_time = time.time() - start_time
+        logging.error(f"ERROR: /api/ml-model/indicators | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+
+def refresh_after_ingest(summary):
+    """Bring the derived tables in line with a load, a partial one included."""
+    if not summary['inserted']:
+        return
+    if current_app.config['LATEST_REFRESH_ON_INGEST']:
+        refresh_latest()
+    if series_store.enabled and current_app.config['SERIES_STORE_REFRESH_ON_INGEST']:
+        series_store.refresh()
+
+
+def export_status(job):
+    status = {key: value for key, value in job.items() if key != 'updated_at'}
+    status['status_url'] = f"/api/exports/{job['id']}"
+    status['download_url'] = f"/api/exports/{job['id']}/download" if job['status'] == 'done' else None
+    return status
+
+
+# Route to queue a full-result export of /api/market, /api/ml-model or /api/ml-model/stock
+@api.route('/api/exports', methods=['POST'])
+def create_export():
+    try:
+        # Filters come from the query string and/or a JSON body (body values take precedence)
+        body = request.get_json(silent=True)
+        if body is None:
+            body = {}
+        elif not isinstance(body, dict):
+            return jsonify({"error": "Body must be a JSON object"}), 400
+        params = {**request.args.to_dict(), **{k: str(v) for k, v in body.items()}}
+        endpoint = params.pop('endpoint', '/api/market')
+        fmt = params.pop('format', 'ndjson').lower()
+        job = export_jobs.submit(endpoint, params, fmt)
+        return jsonify(export_status(job)), 200 if job['status'] == 'done' else 202
+
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    except ColumnarUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+
+    except SQLAlchemyError as e:
+        logging.error(f"ERROR: /api/exports | Exception: {e}")
+        print(traceback.format_exc(), file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/api/exports/<job_id>', methods=['GET'])
+def get_export(job_id):
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired export"}), 404
+    return jsonify(export_status(job))
+
+
+# Finished export file; Range requests (resumable downloads) and If-Range are handled by send_file
+@api.route('/api/exports/<job_id>/download', methods=['GET'])
+def download_export(job_id):
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired export"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": f"Export is {job['status']}", **export_status(job)}), 409
+    suffix, mimetype = EXPORT_FORMATS[job['format']]
+    name = job['endpoint'].strip('/').replace('/', '_').replace('api_', '', 1)
+    return send_file(
+        export_jobs.file_path(job), mimetype=mimetype, as_attachment=True,
+        download_name=f"{name}{suffix}", conditional=True, etag=job['id'], max_age=0
+    )
+
+
+# Route to screen companies on their fundamentals
+@api.route('/api/screener', methods=['GET'])
+def get_screener():
+    start_time = time.time()
+    try:
+        try:
+            categories, ranges, sort, descending, limit = parse_screen(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with request_metrics.stage('transform'):
+            results, matched, universe = company_screener.screen(categories, ranges, sort, descending, limit)
+
+        execution_time = time.time() - start_time
+        log_request("/api/screener", len(results), execution_time)
+
+        return jsonify({
+            'sort': f"-{sort}" if descending else sort,
+            'data': results,
             'metadata': {
-                'record_count': record_count,
+                'record_count': len(results),
+                'matched': matched,
+                'universe': universe,
                 'execution_time_seconds': round(execution_time, 4)
             }
         })
 
+    except ScreenerUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+
     except SQLAlchemyError as e:
         execution_time = time.time() - start_time
-        logging.error(f"Error fetching data for {ticker}: {e} | Execution Time: {execution_time:.4f} seconds")
+        logging.error(f"ERROR: /api/screener | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
         print(traceback.format_exc(), file=sys.stderr)
 
         return jsonify({
@@ -543,15 +1098,83 @@ def get_single_stock_ml_data():
             'metadata': {'execution_time_seconds': execution_time}
         }), 500
 
-# Run the app
-if _name_ == '_main_':
-    print("Running tests before starting server...", file=sys.stderr)
-    
-    exit_code = pytest.main(["-v", "test_stock.py"]) 
-    if exit_code != 0:
-        print("❌ Tests failed. Server will not start.", file=sys.stderr)
-        exit(exit_code)
-    
-    print("✅ Tests passed. Starting Flask server...", file=sys.stderr)
-    app.run(host='0.0.0.0', port=5000, debug=False)
 
+@api.route('/api/ingest/market-metrics', methods=['POST'])
+def ingest_market_metrics():
+    start_time = time.time()
+
+    token = current_app.config['INGEST_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        fmt = ingest_format(request.content_type, requested=request.args.get('format'))
+        summary = ingest_records(read_records(request.stream, fmt), batch_size=current_app.config['INGEST_BATCH_SIZE'])
+        refresh_after_ingest(summary)
+
+        execution_time = time.time() - start_time
+        log_request(f"/api/ingest/market-metrics?format={fmt}", summary['inserted'], execution_time)
+
+        return jsonify({
+            **summary,
+            'metadata': {
+                'format': fmt,
+                'execution_time_seconds': round(execution_time, 4),
+                'rows_per_second': round(summary['inserted'] / execution_time) if execution_time else None
+            }
+        })
+
+    except ColumnarUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+
+    except IngestError as e:
+        db.session.rollback()
+        if e.summary is None:
+            return jsonify({"error": str(e)}), 400
+        # Earlier chunks were committed before the error: report them and refresh what depends on them
+        refresh_after_ingest(e.summary)
+        return jsonify({"error": str(e), "partial": True, **e.summary}), 400
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        execution_time = time.time() - start_time
+        logging.error(f"ERROR: /api/ingest/market-metrics | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+        print(traceback.format_exc(), file=sys.stderr)
+
+        return jsonify({
+            "error": str(e),
+            'metadata': {'execution_time_seconds': execution_time}
+        }), 500
+
+
+@api.cli.command('ingest')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson', 'parquet']), help='Defaults to the file extension.')
+def ingest_command(path, fmt):
+    """Bulk load market metrics from a CSV, NDJSON or Parquet file."""
+    start_time = time.time()
+    fmt = ingest_format(filename=path, requested=fmt)
+    with open(path, 'rb') as f:
+        try:
+            summary = ingest_records(read_records(f, fmt), batch_size=current_app.config['INGEST_BATCH_SIZE'])
+        except IngestError as e:
+            db.session.rollback()
+            if e.summary is None:
+                raise click.ClickException(str(e))
+            refresh_after_ingest(e.summary)
+            raise click.ClickException(
+                f"{e} - the first {e.summary['committed_records']} records ({e.summary['inserted']} rows) were loaded"
+            )
+    refresh_after_ingest(summary)
+    elapsed = time.time() - start_time
+    click.echo(
+        f"Inserted {summary['inserted']} rows ({summary['replaced']} replaced, {summary['rejected']} rejected, "
+        f"{summary['dates_created']} dates created) in {elapsed:.2f} seconds"
+    )
+    for error in summary['errors']:
+        click.echo(f"  rejected {error}", err=True)
+
+
+# Development server; in production run `gunicorn -c gunicorn.conf.py` (which serves wsgi:app)
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,244 @@
+"""ASGI serving mode.
+
+NDJSON streams of /api/market and /api/ml-model, the longest-running
+requests, run on an asyncio SQLAlchemy engine so one process can
+multiplex many of them. Every other request, the buffered JSON of those
+routes included, goes to the regular Flask app mounted as WSGI, so it
+gets the response cache, single-flight, ETags and /metrics exactly as
+under gunicorn. The streams take their ETag (and 304) from the Flask
+app's response cache, negotiate zstd/gzip like its compression and are
+counted in its /metrics, like Flask's own NDJSON responses, which are
+never cached either.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import contextlib
+import logging
+import os
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from flask import request as flask_request
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.test import EnvironBuilder
+
+from app import create_app
+from cache import response_cache
+from compression import response_compression
+from metrics import request_metrics
+from models import db, DimDate
+from queries import parse_date_window, parse_fields, market_query, decode_cursor, seek_after, MARKET_FIELDS
+from serialization import RowEncoder, encoder
+from streaming import NDJSON_MIMETYPE, STREAM_BATCH_SIZE
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# The Flask app behind the other routes; the async engine connects to the same database
+flask_app = create_app()
+
+
+def async_database_url(url):
+    """Map a sync SQLAlchemy URL onto its asyncio driver (asyncpg / aiosqlite)."""
+    scheme, sep, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def create_engine_from_env():
+    # The URL Flask-SQLAlchemy resolved, so a relative SQLite path points into the instance folder
+    with flask_app.app_context():
+        sync_url = db.engine.url.render_as_string(hide_password=False)
+    url = os.environ.get('ASYNC_DATABASE_URI', async_database_url(sync_url))
+    statement_timeout_ms = int(os.environ.get('ASYNC_STATEMENT_TIMEOUT_MS', 0))
+    options = {'pool_pre_ping': True}
+    connect_args = {}
+
+    if not url.startswith('sqlite'):
+        options.update(
+            pool_size=int(os.environ.get('ASYNC_POOL_SIZE', 20)),
+            max_overflow=int(os.environ.get('ASYNC_MAX_OVERFLOW', 10)),
+            pool_timeout=float(os.environ.get('ASYNC_POOL_TIMEOUT_SECONDS', 30)),
+        )
+    if statement_timeout_ms and url.startswith('postgresql+asyncpg'):
+        connect_args['server_settings'] = {'statement_timeout': str(statement_timeout_ms)}
+
+    return create_async_engine(url, connect_args=connect_args, **options)
+
+
+engine = create_engine_from_env()
+
+# Same row encoder the Flask app was configured with (JSON_ENCODER)
+dumps_rows = encoder(flask_app.config['JSON_ENCODER'], str_keys=True)
+
+
+def _log(endpoint, record_count, start_time):
+    logging.info(f"API: {endpoint} | Records Retrieved: {record_count} | Execution Time: {time.time() - start_time:.4f} seconds")
+
+
+async def _earliest_datetime(conn):
+    oldest = await conn.scalar(select(func.min(DimDate.datetime)))
+    return oldest or datetime(1900, 1, 1)
+
+
+def _negotiate(request, endpoint):
+    """(etag, matched, compressor) of an NDJSON stream, negotiated by the Flask app's extensions.
+
+    Runs in a worker thread: the watermark lookup uses the synchronous
+    session. ``compressor`` is None when the body goes out uncompressed.
+    """
+    environ = EnvironBuilder(
+        path=request.url.path, query_string=request.url.query, headers=list(request.headers.items())
+    ).get_environ()
+    with flask_app.request_context(environ):
+        etag, matched = response_cache.revalidate(endpoint, flask_request)
+        encoding = None
+        if response_compression.enabled:
+            encoding = response_compression.negotiate(flask_request.accept_encodings)
+        compressor = response_compression.stream(encoding) if encoding else None
+        return etag, matched, compressor
+
+
+def _observe(endpoint, response, started_at):
+    """Count the response in the Flask app's /metrics, timed until it is returned (as Flask does)."""
+    with flask_app.app_context():
+        if request_metrics.enabled:
+            request_metrics.duration.observe((endpoint,), time.perf_counter() - started_at)
+            request_metrics.requests.inc((endpoint, 'GET', str(response.status_code)))
+    return response
+
+
+def _bad_request(endpoint, e, started_at):
+    return _observe(endpoint, JSONResponse({"error": str(e)}, status_code=400), started_at)
+
+
+def _error(endpoint, e, start_time, started_at):
+    execution_time = time.time() - start_time
+    logging.error(f"ERROR: {endpoint} | Exception: {e} | Execution Time: {execution_time:.4f} seconds")
+    return _observe(endpoint, JSONResponse(
+        {"error": str(e), 'metadata': {'execution_time_seconds': execution_time}}, status_code=500
+    ), started_at)
+
+
+async def _ndjson_stream(request, endpoint, statement, fields, start_time, started_at):
+    etag, matched, compressor = await run_in_threadpool(_negotiate, request, endpoint)
+    headers = {'Cache-Control': 'no-cache'} if etag else {}
+    if flask_app.config['COMPRESSION_ENABLED']:
+        headers['Vary'] = 'Accept-Encoding'
+    if matched is not None:
+        return _observe(endpoint, Response(status_code=304, headers={**headers, 'ETag': f'"{matched}"'}), started_at)
+    if compressor is not None:
+        headers['Content-Encoding'] = compressor.encoding
+    if etag:
+        headers['ETag'] = f'"{etag}-{compressor.encoding}"' if compressor else f'"{etag}"'
+    row_encoder = RowEncoder(fields, dumps=dumps_rows)
+
+    async def generate():
+        record_count = 0
+        async with engine.connect() as conn:
+            result = await conn.stream(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for batch in result.partitions():
+                record_count += len(batch)
+                lines = row_encoder.encode_lines(batch)
+                # One flushed block per batch, as Flask compresses its streams
+                yield compressor.compress(lines) + compressor.flush() if compressor else lines
+        if compressor:
+            yield compressor.finish()
+        _log(f"{endpoint}?format=ndjson", record_count, start_time)
+
+    return _observe(endpoint, StreamingResponse(generate(), media_type=NDJSON_MIMETYPE, headers=headers), started_at)
+
+
+async def market(request):
+    start_time, started_at = time.time(), time.perf_counter()
+    args = request.query_params
+    try:
+        fields = parse_fields(args.get('fields'), MARKET_FIELDS)
+    except ValueError as e:
+        return _bad_request('/api/market', e, started_at)
+    statement = market_query(args.get('country', 'US'), *parse_date_window(args), fields=fields)
+    return await _ndjson_stream(request, '/api/market', statement, fields, start_time, started_at)
+
+
+async def ml_model(request):
+    """NDJSON export of /api/ml-model: unbounded unless limit/offset are passed explicitly."""
+    start_time, started_at = time.time(), time.perf_counter()
+    args = request.query_params
+    try:
+        limit = int(args.get('limit', 100))
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        limit, offset = 100, 0
+    try:
+        fields = parse_fields(args.get('fields'), MARKET_FIELDS)
+    except ValueError as e:
+        return _bad_request('/api/ml-model', e, started_at)
+
+    try:
+        async with engine.connect() as conn:
+            earliest = await _earliest_datetime(conn) if args.get('days', '').lower() == 'all' else None
+    except SQLAlchemyError as e:
+        return _error('/api/ml-model', e, start_time, started_at)
+    from_datetime, to_datetime = parse_date_window(args, earliest=(lambda: earliest) if earliest else None)
+    statement = market_query(args.get('country', 'US'), from_datetime, to_datetime, fields=fields)
+    if args.get('cursor'):
+        try:
+            statement = seek_after(statement, decode_cursor(args['cursor']))
+        except ValueError as e:
+            return _bad_request('/api/ml-model', e, started_at)
+        offset = 0
+    if 'limit' in args:
+        statement = statement.limit(limit)
+    if 'offset' in args:
+        statement = statement.offset(offset)
+    return await _ndjson_stream(request, '/api/ml-model', statement, fields, start_time, started_at)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    yield
+    await engine.dispose()
+
+
+async_app = Starlette(
+    routes=[
+        Route('/api/market', market),
+        Route('/api/ml-model', ml_model),
+    ],
+    lifespan=lifespan,
+)
+wsgi_app = WSGIMiddleware(flask_app)
+ASYNC_PATHS = {route.path for route in async_app.routes}
+
+
+def wants_ndjson(scope):
+    """Same test as streaming.wants_ndjson, on an ASGI scope: ?format=ndjson, or NDJSON first in Accept."""
+    requested = parse_qs(scope.get('query_string', b'').decode()).get('format')
+    if requested:
+        return requested[0].lower() == 'ndjson'
+    accept = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'accept'), '')
+    return parse_accept_header(accept, MIMEAccept).best == NDJSON_MIMETYPE
+
+
+async def app(scope, receive, send):
+    """Dispatch NDJSON streams of the market routes to Starlette and everything else to Flask."""
+    if scope['type'] == 'lifespan':
+        await async_app(scope, receive, send)
+        return
+    if (scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and scope['path'] in ASYNC_PATHS
+            and wants_ndjson(scope)):
+        await async_app(scope, receive, send)
+        return
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1 @@
+"""Performance benchmarks for the Stock Market API. Run from flask/app, e.g. ``python -m benchmarks.load``."""
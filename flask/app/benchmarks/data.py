@@ -0,0 +1,178 @@
+"""Synthetic dim_company / dim_date / fact_market_metrics dataset for the benchmarks.
+
+    python -m benchmarks.data --database-url sqlite:////tmp/stockapi-bench.db --companies 2000 --years 2
+
+Dates are hourly rows over weekday trading hours; every company gets one
+fact per date with a random-walk price, so the fact table holds
+companies x dates rows. Generation is seeded and fully reproducible.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import Column, Integer, Table, func
+
+from models import db, DimDate, DimCompany, FactMarketMetrics
+
+# Tables fact_market_metrics references but models.py does not declare (init.sql creates them).
+EXTERNAL_DIMENSIONS = {
+    'dim_exchange': 'sk_exchange_id',
+    'dim_commodity': 'sk_commodity_id',
+    'dim_index': 'sk_index_id',
+    'dim_stock': 'sk_stock_id',
+    'dim_bond': 'sk_bond_id',
+}
+
+# Country mix of the generated companies (weights are relative).
+COUNTRIES = (('US', 60), ('GB', 10), ('DE', 8), ('JP', 8), ('IN', 7), ('CA', 7))
+SECTORS = (
+    'Technology', 'Healthcare', 'Financial Services', 'Consumer Cyclical', 'Industrials', 'Communication Services',
+    'Consumer Defensive', 'Energy', 'Basic Materials', 'Real Estate', 'Utilities'
+)
+INDUSTRIES_PER_SECTOR = 6
+
+# Trading hours covered by the hourly dim_date rows (weekdays only).
+TRADING_HOURS = range(9, 16)
+START = datetime(2020, 1, 1)
+
+# Rows per INSERT round-trip.
+INSERT_BATCH_SIZE = 50000
+
+
+def create_app(database_url):
+    """Bare Flask app bound to ``database_url``; the benchmarks never need the API's configuration."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def create_schema():
+    for name, key in EXTERNAL_DIMENSIONS.items():
+        if name not in db.metadata.tables:
+            Table(name, db.metadata, Column(key, Integer, primary_key=True))
+    db.create_all()
+
+
+def trading_hours(count, start=START):
+    """The first ``count`` weekday trading hours from ``start``."""
+    day = start
+    produced = 0
+    while produced < count:
+        if day.weekday() < 5:
+            for hour in TRADING_HOURS:
+                if produced == count:
+                    break
+                yield day.replace(hour=hour)
+                produced += 1
+        day += timedelta(days=1)
+
+
+def dates_for_years(years):
+    """Number of hourly dim_date rows covering ``years`` of trading days."""
+    return int(years * 261 * len(TRADING_HOURS))
+
+
+def company_rows(count, rng):
+    countries = [country for country, _ in COUNTRIES]
+    weights = [weight for _, weight in COUNTRIES]
+    rows = []
+    for i in range(1, count + 1):
+        sector = SECTORS[i % len(SECTORS)]
+        rows.append({
+            'sk_company_id': i, 'symbol': f"SYM{i:05d}", 'company_name': f"Company {i}",
+            'sector': sector, 'industry': f"{sector} {i % INDUSTRIES_PER_SECTOR + 1}",
+            'country': rng.choices(countries, weights)[0], 'currency': 'USD', 'is_actively_trading': True
+        })
+    return rows
+
+
+def date_rows(count, start=START):
+    rows = []
+    for i, dt in enumerate(trading_hours(count, start), start=1):
+        iso = dt.isocalendar()
+        rows.append({
+            'sk_date_id': i, 'datetime': dt, 'date': dt.strftime('%Y-%m-%d'), 'hour': dt.hour,
+            'day_of_week': dt.weekday(), 'day_name': dt.strftime('%A'), 'day_of_month': dt.day,
+            'day_of_year': dt.timetuple().tm_yday, 'week_of_year': iso[1], 'month': dt.month,
+            'month_name': dt.strftime('%B'), 'quarter': (dt.month - 1) // 3 + 1, 'year': dt.year,
+            'fiscal_year': dt.year, 'is_weekend': False
+        })
+    return rows
+
+
+def populate(companies, dates, seed=42, start=START):
+    """Insert ``companies`` companies, ``dates`` hourly dates and one fact per pair; returns the fact count."""
+    rng = random.Random(seed)
+    db.session.execute(DimCompany.__table__.insert(), company_rows(companies, rng))
+    db.session.execute(DimDate.__table__.insert(), date_rows(dates, start))
+
+    datetimes = list(trading_hours(dates, start))
+    facts = []
+    fact_id = 0
+    for company in range(1, companies + 1):
+        price = rng.lognormvariate(4, 1)
+        shares = rng.uniform(5e7, 5e9)
+        for date, trade_datetime in enumerate(datetimes, start=1):
+            fact_id += 1
+            previous = price
+            price = max(0.5, price * (1 + rng.gauss(0, 0.01)))
+            facts.append({
+                'sk_market_metrics_id': fact_id, 'fk_company_id': company, 'fk_date_id': date,
+                'trade_datetime': trade_datetime,
+                'current_price': round(price, 4), 'opening_price': round(previous, 4),
+                'change': round(price - previous, 4),
+                'change_percentage': round((price - previous) / previous * 100, 4),
+                'volume': int(rng.paretovariate(1.5) * 1e5),
+                'day_low': round(min(price, previous) * (1 - abs(rng.gauss(0, 0.003))), 4),
+                'day_high': round(max(price, previous) * (1 + abs(rng.gauss(0, 0.003))), 4),
+                'market_cap': round(price * shares, 2)
+            })
+            if len(facts) >= INSERT_BATCH_SIZE:
+                db.session.execute(FactMarketMetrics.__table__.insert(), facts)
+                facts = []
+    if facts:
+        db.session.execute(FactMarketMetrics.__table__.insert(), facts)
+    db.session.commit()
+    return fact_id
+
+
+def dataset_summary():
+    """Row counts and time range of the data currently in the database."""
+    first, last = db.session.query(func.min(DimDate.datetime), func.max(DimDate.datetime)).one()
+    return {
+        'companies': db.session.query(func.count(DimCompany.sk_company_id)).scalar(),
+        'dates': db.session.query(func.count(DimDate.sk_date_id)).scalar(),
+        'facts': db.session.query(func.count(FactMarketMetrics.sk_market_metrics_id)).scalar(),
+        'first_datetime': first.isoformat() if first else None,
+        'last_datetime': last.isoformat() if last else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/stockapi-bench.db')
+    parser.add_argument('--companies', type=int, default=500)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--dates', type=int, help='Number of hourly dim_date rows.')
+    size.add_argument('--years', type=float, default=1.0, help='Years of trading hours (default 1).')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    dates = args.dates if args.dates is not None else dates_for_years(args.years)
+    app = create_app(args.database_url)
+    with app.app_context():
+        create_schema()
+        start_time = time.perf_counter()
+        populate(args.companies, dates, seed=args.seed)
+        report = {**dataset_summary(), 'seconds': round(time.perf_counter() - start_time, 2)}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Latency and throughput of every API route under single-request and concurrent load.
+
+    python -m benchmarks.data --database-url sqlite:////tmp/stockapi-bench.db --companies 500 --years 1
+    python -m benchmarks.load --database-url sqlite:////tmp/stockapi-bench.db --requests 50 --concurrency 8
+
+By default app.py is imported and driven in-process through its test
+client, so peak RSS is the API's own. Pass --url to load a running
+server over HTTP instead (peak RSS is then the load generator's). The
+report is one JSON document; keep it next to the commit it measured.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from benchmarks.data import create_app, dataset_summary
+
+
+def scenarios(summary, window_days=30):
+    """(name, method, path, json body) for every route, with windows inside the generated data."""
+    last = datetime.fromisoformat(summary['last_datetime']) if summary['last_datetime'] else datetime.now()
+    to_date = (last + timedelta(days=1)).strftime('%Y-%m-%d')
+    from_date = (last - timedelta(days=window_days)).strftime('%Y-%m-%d')
+    window = f"from={from_date}&to={to_date}"
+    return [
+        ('home', 'GET', '/', None),
+        ('tables', 'GET', '/tables', None),
+        ('schema', 'GET', '/schema', None),
+        ('dim_date', 'GET', '/api/dim_date', None),
+        ('dim_exchange', 'GET', '/api/dim_exchange', None),
+        ('dim_commodity', 'GET', '/api/dim_commodity', None),
+        ('dim_company', 'GET', '/api/dim_company?ticker=SYM00001', None),
+        ('cache_stats', 'GET', '/api/cache/stats', None),
+        ('metrics', 'GET', '/metrics', None),
+        ('explain_market', 'GET', f'/admin/explain?endpoint=/api/market&country=US&{window}', None),
+        ('market', 'GET', f'/api/market?country=US&{window}', None),
+        ('market_ndjson', 'GET', f'/api/market?country=US&{window}&format=ndjson', None),
+        ('market_rollup', 'GET', f'/api/market/rollup?grain=day&country=US&{window}', None),
+        ('ml_model', 'GET', f'/api/ml-model?country=US&{window}&limit=1000', None),
+        ('ml_model_stock', 'GET', f'/api/ml-model/stock?ticker=SYM00001&{window}', None),
+        ('ml_model_stocks', 'POST', '/api/ml-model/stocks', {
+            'tickers': [f"SYM{i:05d}" for i in range(1, 51)], 'from': from_date, 'to': to_date
+        }),
+    ]
+
+
+def count_rows(body, content_type):
+    """Rows in a response: metadata.record_count for JSON, one per line for NDJSON."""
+    if 'ndjson' in content_type:
+        return body.count(b'\n')
+    if 'json' not in content_type:
+        return 0
+    try:
+        document = json.loads(body)
+    except ValueError:
+        return 0
+    metadata = document.get('metadata') if isinstance(document, dict) else None
+    record_count = metadata.get('record_count') if isinstance(metadata, dict) else None
+    return record_count if isinstance(record_count, int) else 0
+
+
+class InProcessClient:
+    """Drives app.py through Flask's test client; one client per thread."""
+
+    def __init__(self, database_url, cache):
+        os.environ['SQLALCHEMY_DATABASE_URI'] = database_url
+        os.environ['CACHE_BACKEND'] = 'memory' if cache else 'none'
+        from app import create_app
+        self.app = create_app()
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data, response.content_type or ''
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read(), response.headers.get('Content-Type', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Content-Type', '')
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def run(client, method, path, body, requests, concurrency):
+    """Issue ``requests`` calls with ``concurrency`` in flight and summarise latency and throughput."""
+    def one(_):
+        start = time.perf_counter()
+        status, data, content_type = client.request(method, path, body)
+        return time.perf_counter() - start, status, count_rows(data, content_type)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        results = [one(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _, _ in results)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    rows = sum(row_count for _, _, row_count in results)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'requests_per_second': round(requests / wall, 2) if wall else None,
+        'rows_per_request': rows // requests if requests else 0,
+        'rows_per_second': round(rows / wall) if wall else None,
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/stockapi-bench.db',
+                        help='Database populated by benchmarks.data (file-backed for SQLite).')
+    parser.add_argument('--url', help='Load a running server instead of importing app.py.')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route and mode.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--window-days', type=int, default=30)
+    parser.add_argument('--routes', help='Comma-separated scenario names (default: all).')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache on (off by default).')
+    parser.add_argument('--output', help='Also write the report to this file.')
+    args = parser.parse_args(argv)
+
+    with create_app(args.database_url).app_context():
+        summary = dataset_summary()
+
+    client = HttpClient(args.url) if args.url else InProcessClient(args.database_url, args.cache)
+    selected = set(args.routes.split(',')) if args.routes else None
+
+    routes = {}
+    for name, method, path, body in scenarios(summary, args.window_days):
+        if selected and name not in selected:
+            continue
+        client.request(method, path, body)  # warm-up: connections, dimension cache, rollups
+        routes[name] = {
+            'method': method,
+            'path': path,
+            'single': run(client, method, path, body, args.requests, 1),
+            'concurrent': run(client, method, path, body, args.requests, args.concurrency),
+        }
+
+    report = {
+        'benchmark': 'load',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'target': args.url or 'in-process',
+        'database': args.database_url.split('@')[-1],
+        'cache': args.cache,
+        'dataset': summary,
+        'routes': routes,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Rows/second of the ORM-entity market query versus the Core projection used by the endpoints.
+
+    python -m benchmarks.projection --companies 200 --dates 2000
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from benchmarks.data import create_app, create_schema, populate
+from models import db, DimDate, DimCompany, FactMarketMetrics
+from queries import market_query, row_converter, MARKET_FIELDS
+
+
+def orm_entities(from_datetime, to_datetime):
+    """The pre-projection implementation: three ORM entities per row, per-field float() conversion."""
+    results = db.session.query(
+        FactMarketMetrics, DimDate, DimCompany
+    ).join(
+        DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+    ).join(
+        DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
+    ).filter(
+        DimCompany.country == 'US',
+        DimDate.datetime.between(from_datetime, to_datetime)
+    ).order_by(
+        DimCompany.symbol, DimDate.datetime
+    ).all()
+    return [
+        {
+            'symbol': company.symbol,
+            'company_name': company.company_name,
+            'sector': company.sector,
+            'industry': company.industry,
+            'date': date.date,
+            'datetime': date.datetime.isoformat() if date.datetime else None,
+            'current_price': float(metric.current_price) if metric.current_price else None,
+            'change': float(metric.change) if metric.change else None,
+            'change_percentage': float(metric.change_percentage) if metric.change_percentage else None,
+            'volume': metric.volume,
+            'day_low': float(metric.day_low) if metric.day_low else None,
+            'day_high': float(metric.day_high) if metric.day_high else None,
+            'market_cap': float(metric.market_cap) if metric.market_cap else None
+        }
+        for metric, date, company in results
+    ]
+
+
+def core_projection(from_datetime, to_datetime):
+    """What /api/market does now: a narrow Core SELECT and a precompiled row converter."""
+    convert = row_converter(MARKET_FIELDS)
+    return [convert(row) for row in db.session.execute(market_query('US', from_datetime, to_datetime))]
+
+
+def measure(fn, repeat):
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        rows = len(fn(datetime(1900, 1, 1), datetime(2100, 1, 1)))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'rows': rows, 'best_seconds': round(best, 4), 'rows_per_second': round(rows / best) if best else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--dates', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-populate', action='store_true', help='Reuse data already in --database-url.')
+    args = parser.parse_args(argv)
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        if not args.skip_populate:
+            create_schema()
+            populate(args.companies, args.dates)
+        before = measure(orm_entities, args.repeat)
+        after = measure(core_projection, args.repeat)
+
+    report = {
+        'benchmark': 'market_projection',
+        'database': args.database_url.split('@')[-1],
+        'orm_entities': before,
+        'core_projection': after,
+        'speedup': round(before['best_seconds'] / after['best_seconds'], 2) if after['best_seconds'] else None,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Serialization time of a large /api/market response: dicts + jsonify versus RowEncoder.
+
+    python -m benchmarks.serialization --companies 500 --dates 2000
+
+The market rows are fetched once; only turning them into the response
+body is timed. The baseline is the previous handler body (row_converter
+dicts through Flask's default sort_keys JSON provider); the candidate is
+RowEncoder + rows_response on the configured JSON_ENCODER.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.data import create_app, create_schema, populate
+from models import db
+from queries import market_query, row_converter, MARKET_FIELDS
+from serialization import FastJSONProvider, RowEncoder, rows_response
+
+
+def dicts_jsonify(app, rows):
+    convert = row_converter(MARKET_FIELDS)
+    data = [convert(row) for row in rows]
+    return DefaultJSONProvider(app).response({'data': data, 'metadata': {'record_count': len(data)}}).get_data()
+
+
+def row_encoder(app, rows):
+    return rows_response(RowEncoder(MARKET_FIELDS).encode_array(rows), {
+        'metadata': {'record_count': len(rows)}
+    }).get_data()
+
+
+def measure(fn, app, rows, repeat):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(fn(app, rows))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'bytes': size, 'best_seconds': round(best, 4), 'rows_per_second': round(len(rows) / best) if best else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite://')
+    parser.add_argument('--companies', type=int, default=500)
+    parser.add_argument('--dates', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--encoder', default='auto', help='JSON_ENCODER for the candidate (auto, orjson, json).')
+    parser.add_argument('--skip-populate', action='store_true', help='Reuse data already in --database-url.')
+    args = parser.parse_args(argv)
+
+    app = create_app(args.database_url)
+    app.config['JSON_ENCODER'] = args.encoder
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        if not args.skip_populate:
+            create_schema()
+            populate(args.companies, args.dates)
+        rows = db.session.execute(market_query('US', datetime(1900, 1, 1), datetime(2100, 1, 1))).all()
+        # Both paths must produce the same document
+        assert json.loads(dicts_jsonify(app, rows[:1000])) == json.loads(row_encoder(app, rows[:1000]))
+        before = measure(dicts_jsonify, app, rows, args.repeat)
+        after = measure(row_encoder, app, rows, args.repeat)
+
+    report = {
+        'benchmark': 'market_serialization',
+        'database': args.database_url.split('@')[-1],
+        'rows': len(rows),
+        'encoder': args.encoder,
+        'dicts_jsonify': before,
+        'row_encoder': after,
+        'speedup': round(before['best_seconds'] / after['best_seconds'], 2) if after['best_seconds'] else None,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import Response, make_response, request
+from sqlalchemy.exc import SQLAlchemyError
+
+from extensions import AppExtension
+from watermark import fact_watermark
+from compression import response_compression
+from streaming import wants_ndjson
+
+# Query parameters that switch a route into a streamed/binary mode; those responses are never cached.
+UNCACHED_FORMATS = {'ndjson', 'arrow', 'parquet'}
+
+
+class MemoryCacheBackend:
+    """In-process LRU map with per-entry expiry, bounded to ``max_entries``."""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Redis (or any RESP-compatible server) backend.
+
+    Expiry uses native TTLs; size-bounded LRU eviction is delegated to the
+    server's ``maxmemory`` / ``allkeys-lru`` policy.
+    """
+
+    name = 'redis'
+    evictions = 0
+
+    def __init__(self, url, prefix='stockapi:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def acquire(self, key, ttl):
+        """Take the cross-worker fill lease on ``key``; False while another worker holds it."""
+        return bool(self.client.set(self.prefix + 'lock:' + key, b'1', nx=True, px=max(1, int(ttl * 1000))))
+
+    def locked(self, key):
+        return bool(self.client.exists(self.prefix + 'lock:' + key))
+
+    def release(self, key):
+        self.client.delete(self.prefix + 'lock:' + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            self.client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=500))
+
+
+class _Flight:
+    """One in-flight fill of a cache key; followers wait on ``done`` for its body."""
+
+    __slots__ = ('done', 'body')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+
+
+class ResponseCache:
+    """Caches JSON responses of read endpoints keyed on their normalised query parameters.
+
+    The fact-table watermark is part of every key, so entries written before
+    an ETL load can never be served after it; the in-process backend is also
+    flushed when the watermark moves.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 300
+        self.watermark_interval = 1.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.etags_enabled = True
+        self.not_modified = 0
+        self.single_flight = True
+        self.single_flight_timeout = 30.0
+        self.coalesced = 0
+        self._flights = {}
+        self._watermark = None
+        self._watermark_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('CACHE_TTL_SECONDS', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 512)
+        app.config.setdefault('CACHE_WATERMARK_INTERVAL_SECONDS', 1.0)
+        app.config.setdefault('ETAGS_ENABLED', True)
+        app.config.setdefault('CACHE_SINGLE_FLIGHT', True)
+        app.config.setdefault('CACHE_SINGLE_FLIGHT_TIMEOUT_SECONDS', 30)
+
+        self.ttl = float(app.config['CACHE_TTL_SECONDS'])
+        self.watermark_interval = float(app.config['CACHE_WATERMARK_INTERVAL_SECONDS'])
+        self.etags_enabled = bool(app.config['ETAGS_ENABLED'])
+        self.single_flight = bool(app.config['CACHE_SINGLE_FLIGHT'])
+        self.single_flight_timeout = float(app.config['CACHE_SINGLE_FLIGHT_TIMEOUT_SECONDS'])
+        backend = app.config['CACHE_BACKEND'].lower()
+
+        if backend == 'redis':
+            try:
+                self.backend = RedisCacheBackend(app.config['CACHE_REDIS_URL'])
+            except ImportError:
+                logging.error("CACHE_BACKEND=redis but the redis package is not installed, using the memory backend")
+                backend = 'memory'
+        if backend == 'memory':
+            self.backend = MemoryCacheBackend(int(app.config['CACHE_MAX_ENTRIES']))
+        elif backend != 'redis':
+            self.backend = None
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def current_watermark(self):
+        """Fact-table watermark, re-read from the database at most every ``watermark_interval`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._watermark is not None and now - self._watermark_checked_at < self.watermark_interval:
+                return self._watermark
+
+        watermark = fact_watermark()
+
+        with self._lock:
+            if self._watermark is not None and watermark != self._watermark:
+                self.invalidations += 1
+                if isinstance(self.backend, MemoryCacheBackend):
+                    self.backend.clear()
+            self._watermark = watermark
+            self._watermark_checked_at = now
+        return watermark
+
+    @staticmethod
+    def normalized_params(args):
+        """Sorted query parameters; relative windows are pinned to today's date."""
+        params = sorted((key.lower(), value) for key, value in args.items(multi=True))
+        if 'to' not in args:
+            params.append(('@today', date.today().isoformat()))
+        return '&'.join(f"{key}={value}" for key, value in params)
+
+    def key_for(self, endpoint, args, watermark):
+        return f"{endpoint}|{watermark}|{self.normalized_params(args)}"
+
+    def etag_for(self, endpoint, req, watermark):
+        """Strong ETag of a response: endpoint, normalised parameters, representation and watermark."""
+        representation = (req.args.get('format') or ('ndjson' if wants_ndjson(req) else 'json')).lower()
+        digest = hashlib.sha256(
+            f"{self.key_for(endpoint, req.args, watermark)}|{representation}".encode()
+        ).hexdigest()
+        return digest[:32]
+
+    def revalidate(self, endpoint, req):
+        """(etag, matched) for ``req``: its ETag, and the If-None-Match tag to answer 304 with.
+
+        Only the tags this request could be served with match: the plain one
+        (sent uncompressed, or below the compression minimum) and the one
+        for the encoding negotiated from its Accept-Encoding. ``etag`` is
+        None when ETags are off or the watermark cannot be read.
+        """
+        if not self.etags_enabled:
+            return None, None
+        try:
+            etag = self.etag_for(endpoint, req, self.current_watermark())
+        except SQLAlchemyError as e:
+            logging.warning(f"ETag skipped for {endpoint}: watermark lookup failed: {e}")
+            return None, None
+        candidates = [etag]
+        if response_compression.enabled:
+            encoding = response_compression.negotiate(req.accept_encodings)
+            if encoding is not None:
+                candidates.append(f"{etag}-{encoding}")
+        matched = next((tag for tag in candidates if req.if_none_match.contains(tag)), None)
+        if matched is not None:
+            self.not_modified += 1
+        return etag, matched
+
+    def conditional(self, endpoint):
+        """Decorator for a GET view: sets a strong ETag and answers a matching If-None-Match with 304.
+
+        The tag only depends on the request and the fact-table watermark, so
+        a revalidation that matches never reaches the view (or its query).
+        Compressed representations carry the same tag plus '-<encoding>'.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                etag, matched = self.revalidate(endpoint, request)
+                if etag is None:
+                    return view(*args, **kwargs)
+                if matched is not None:
+                    response = Response(status=304)
+                    response.set_etag(matched)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                response.vary.add('Accept-Encoding')
+                return response
+            return wrapper
+        return decorator
+
+    def _join(self, key):
+        """(flight, leader): the first caller for ``key`` leads, later ones get the same flight to wait on."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight, body):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.body = body
+        flight.done.set()
+
+    def _peer_body(self, key):
+        """(body, leased): body filled by another worker through the shared backend, or the fill lease.
+
+        Only backends shared between processes (Redis) take a lease; while
+        another worker holds it the backend is polled until the body lands
+        or the lease lapses.
+        """
+        acquire = getattr(self.backend, 'acquire', None)
+        if acquire is None:
+            return None, False
+        deadline = time.monotonic() + self.single_flight_timeout
+        while not acquire(key, self.single_flight_timeout):
+            body = self.backend.get(key)
+            if body is not None:
+                return body, False
+            if time.monotonic() > deadline:
+                return None, False
+            time.sleep(0.05)
+        return None, True
+
+    def _fill(self, key, view, args, kwargs):
+        """Run the view; returns (response, body), body being None when the response is not shareable."""
+        response = make_response(view(*args, **kwargs))
+        body = None
+        if response.status_code == 200 and not response.is_streamed and response.is_json:
+            body = response.get_data()
+            if self.enabled:
+                self.backend.set(key, body, self.ttl)
+        response.headers['X-Cache'] = 'MISS'
+        return response, body
+
+    def _coalesced_response(self, body):
+        self.coalesced += 1
+        response = Response(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'COALESCED'
+        return response
+
+    def cached(self, endpoint):
+        """Decorator for a view returning JSON; bypassed for streamed formats and when disabled.
+
+        With single-flight on, concurrent misses for the same key run the
+        view once: the first request fills, the others wait for its body
+        (across workers too when the backend is shared). Coalescing also
+        applies when the cache backend is ``none``.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (not (self.enabled or self.single_flight)
+                        or (request.args.get('format') or '').lower() in UNCACHED_FORMATS
+                        or request.accept_mimetypes.best == 'application/x-ndjson'):
+                    return view(*args, **kwargs)
+
+                try:
+                    key = self.key_for(endpoint, request.args, self.current_watermark())
+                except SQLAlchemyError as e:
+                    logging.warning(f"Cache bypassed for {endpoint}: watermark lookup failed: {e}")
+                    return view(*args, **kwargs)
+
+                if self.enabled:
+                    body = self.backend.get(key)
+                    if body is not None:
+                        self.hits += 1
+                        response = Response(body, mimetype='application/json')
+                        response.headers['X-Cache'] = 'HIT'
+                        return response
+                    self.misses += 1
+
+                if not self.single_flight:
+                    return self._fill(key, view, args, kwargs)[0]
+
+                flight, leader = self._join(key)
+                if not leader:
+                    if flight.done.wait(self.single_flight_timeout) and flight.body is not None:
+                        return self._coalesced_response(flight.body)
+                    # The leader failed, streamed or timed out; run the view here
+                    return self._fill(key, view, args, kwargs)[0]
+
+                body = None
+                try:
+                    body, leased = self._peer_body(key) if self.enabled else (None, False)
+                    if body is not None:
+                        return self._coalesced_response(body)
+                    try:
+                        response, body = self._fill(key, view, args, kwargs)
+                    finally:
+                        if leased:
+                            self.backend.release(key)
+                    return response
+                finally:
+                    self._land(key, flight, body)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend.name if self.backend is not None else None,
+            'entries': len(self.backend) if self.backend is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.backend.evictions if self.backend is not None else 0,
+            'invalidations': self.invalidations,
+            'not_modified': self.not_modified,
+            'coalesced': self.coalesced,
+            'watermark': self._watermark,
+            'ttl_seconds': self.ttl,
+        }
+
+
+response_cache = AppExtension('response_cache', ResponseCache)
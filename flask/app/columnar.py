@@ -0,0 +1,122 @@
+import io
+
+from flask import Response, stream_with_context
+from sqlalchemy import DateTime, Float, Integer, String
+
+from models import db, DimCompany
+from queries import FIELD_COLUMNS, MARKET_FIELDS
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+COLUMNAR_FORMATS = {'arrow': ARROW_MIMETYPE, 'parquet': PARQUET_MIMETYPE}
+
+# Rows per record batch (and per Parquet row group).
+COLUMNAR_BATCH_SIZE = 10000
+
+
+class ColumnarUnavailable(Exception):
+    """Raised when pyarrow is not installed."""
+
+
+def columnar_format(request):
+    """Return 'arrow' or 'parquet' when requested via ?format=, else None."""
+    requested = (request.args.get('format') or '').lower()
+    return requested if requested in COLUMNAR_FORMATS else None
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ColumnarUnavailable("pyarrow is required for format=arrow/parquet") from e
+    return pyarrow
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object collecting the bytes pyarrow emits so they can be yielded."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_type(pa, name):
+    """Arrow type for an output field; repeated company strings are dictionary-encoded."""
+    column = FIELD_COLUMNS[name]
+    if isinstance(column.type, String):
+        if getattr(column, 'table', None) is DimCompany.__table__:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    return pa.string()
+
+
+def _record_batch(pa, schema, rows):
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def columnar_response(statement, fmt, fields=MARKET_FIELDS, on_complete=None, batch_size=COLUMNAR_BATCH_SIZE):
+    """Stream a SELECT whose leading columns are ``fields`` as an Arrow IPC stream or a Parquet file.
+
+    Rows come off a server-side cursor and are turned straight into record
+    batches, dictionary-encoding the repeated company attributes; no per-row
+    dicts are built. Raises ColumnarUnavailable when pyarrow is missing.
+    """
+    pa = _import_pyarrow()
+    schema = pa.schema([pa.field(name, _arrow_type(pa, name)) for name in fields])
+
+    def generate():
+        sink = _ChunkSink()
+        out = pa.PythonFile(sink, mode='w')
+        if fmt == 'parquet':
+            writer = pa.parquet.ParquetWriter(out, schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_stream(out, schema)
+
+        record_count = 0
+        rows = []
+        for row in db.session.execute(statement.execution_options(yield_per=batch_size)):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                writer.write_batch(_record_batch(pa, schema, rows))
+                record_count += len(rows)
+                rows = []
+                yield sink.drain()
+        if rows:
+            writer.write_batch(_record_batch(pa, schema, rows))
+            record_count += len(rows)
+        elif record_count == 0 and fmt == 'parquet':
+            writer.write_table(schema.empty_table())
+        writer.close()
+        yield sink.drain()
+        if on_complete is not None:
+            on_complete(record_count)
+
+    response = Response(stream_with_context(generate()), mimetype=COLUMNAR_FORMATS[fmt])
+    extension = 'arrows' if fmt == 'arrow' else 'parquet'
+    response.headers['Content-Disposition'] = f'attachment; filename=market.{extension}'
+    return response
@@ -0,0 +1,144 @@
+import zlib
+
+from flask import request
+
+from extensions import AppExtension
+from columnar import ARROW_MIMETYPE
+from streaming import NDJSON_MIMETYPE
+
+# Bodies worth compressing; Parquet is already compressed column by column.
+COMPRESSIBLE_MIMETYPES = {'application/json', NDJSON_MIMETYPE, ARROW_MIMETYPE, 'text/plain', 'text/html', 'text/csv'}
+
+# Content-Encodings in server preference order (used when the client weighs them equally).
+CONTENT_ENCODINGS = ('zstd', 'gzip')
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+class _GzipStream:
+    encoding = 'gzip'
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emit everything compressed so far (a sync flush keeps the stream open)."""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _ZstdStream:
+    encoding = 'zstd'
+
+    def __init__(self, zstandard, level):
+        self._zstandard = zstandard
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(self._zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def _compress_chunks(chunks, stream):
+    """Compress a streamed body chunk by chunk, flushing after each so clients see rows as they come."""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = stream.compress(chunk) + stream.flush()
+            if data:
+                yield data
+        yield stream.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class ResponseCompression:
+    """Negotiated gzip/zstd Content-Encoding for JSON, NDJSON and Arrow responses.
+
+    Buffered bodies under ``min_bytes`` are sent as they are; streamed
+    bodies are always compressed, one flushed block per chunk. zstd is
+    offered only when the zstandard package is installed. A strong ETag
+    gets the encoding appended, so every representation keeps its own tag.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.min_bytes = 1024
+        self.gzip_level = 6
+        self.zstd_level = 3
+        self.zstandard = None
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESSION_ENABLED', True)
+        app.config.setdefault('COMPRESSION_MIN_BYTES', 1024)
+        app.config.setdefault('COMPRESSION_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESSION_ZSTD_LEVEL', 3)
+        self.enabled = bool(app.config['COMPRESSION_ENABLED'])
+        self.min_bytes = int(app.config['COMPRESSION_MIN_BYTES'])
+        self.gzip_level = int(app.config['COMPRESSION_GZIP_LEVEL'])
+        self.zstd_level = int(app.config['COMPRESSION_ZSTD_LEVEL'])
+        self.zstandard = _import_zstandard()
+        app.after_request(self._compress)
+
+    @property
+    def encodings(self):
+        return [encoding for encoding in CONTENT_ENCODINGS if encoding != 'zstd' or self.zstandard is not None]
+
+    def negotiate(self, accept_encodings):
+        """The Content-Encoding to use for a request's Accept-Encoding, or None."""
+        return accept_encodings.best_match(self.encodings)
+
+    def stream(self, encoding):
+        if encoding == 'zstd':
+            return _ZstdStream(self.zstandard, self.zstd_level)
+        return _GzipStream(self.gzip_level)
+
+    def _compress(self, response):
+        if (not self.enabled
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.status_code not in (200, 201)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_chunks(response.response, self.stream(encoding))
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_bytes:
+                return response
+            stream = self.stream(encoding)
+            response.set_data(stream.compress(body) + stream.finish())
+        response.headers['Content-Encoding'] = encoding
+
+        tag, weak = response.get_etag()
+        if tag and not weak:
+            response.set_etag(f"{tag}-{encoding}")
+        return response
+
+
+response_compression = AppExtension('response_compression', ResponseCompression)
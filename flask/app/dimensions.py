@@ -0,0 +1,221 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import func, select
+
+from extensions import AppExtension
+from models import db, DimDate, DimCompany, FactMarketMetrics
+from queries import FIELD_COLUMNS, STOCK_FIELDS, fact_window, row_converter
+from metrics import request_metrics
+
+# Above this many date keys an IN (...) list is not worth it; the dim_date join is used instead.
+MAX_DATE_KEYS_IN_LIST = 5000
+
+
+class CompanyRecord:
+    __slots__ = ('sk_company_id', 'symbol', 'company_name', 'sector', 'industry', 'country')
+
+    def __init__(self, sk_company_id, symbol, company_name, sector, industry, country):
+        self.sk_company_id = sk_company_id
+        self.symbol = symbol
+        self.company_name = company_name
+        self.sector = sector
+        self.industry = industry
+        self.country = country
+
+
+class DateRecord:
+    __slots__ = ('sk_date_id', 'datetime', 'date')
+
+    def __init__(self, sk_date_id, datetime, date):
+        self.sk_date_id = sk_date_id
+        self.datetime = datetime
+        self.date = date
+
+
+class _Snapshot:
+    """Immutable view of both dimensions; replaced wholesale on refresh."""
+
+    def __init__(self, version, companies, dates):
+        self.version = version
+        self.companies = {c.sk_company_id: c for c in companies}
+        self.symbols = {c.symbol: c.sk_company_id for c in companies}
+        self.dates = {d.sk_date_id: d for d in dates}
+
+        # Time axis for window lookups: datetimes sorted ascending with their keys alongside.
+        timed = sorted((d for d in dates if d.datetime is not None), key=lambda d: d.datetime)
+        self.datetimes = [d.datetime for d in timed]
+        self.date_keys = array('l', (d.sk_date_id for d in timed))
+
+
+def dimension_version():
+    """Row count and max key of each dimension; changes whenever rows are added or removed."""
+    company = db.session.query(func.count(DimCompany.sk_company_id), func.max(DimCompany.sk_company_id)).one()
+    date = db.session.query(func.count(DimDate.sk_date_id), func.max(DimDate.sk_date_id)).one()
+    return (tuple(company), tuple(date))
+
+
+class DimensionCache:
+    """Process-wide copy of dim_company and dim_date keyed by surrogate key.
+
+    The version is re-checked at most every ``check_interval`` seconds, and
+    on a symbol miss, so new companies show up without a restart.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.check_interval = 30.0
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('DIMENSION_CACHE_ENABLED', True)
+        app.config.setdefault('DIMENSION_CACHE_CHECK_SECONDS', 30)
+        self.enabled = bool(app.config['DIMENSION_CACHE_ENABLED'])
+        self.check_interval = float(app.config['DIMENSION_CACHE_CHECK_SECONDS'])
+
+    def _load(self, version):
+        companies = [
+            CompanyRecord(*row) for row in db.session.query(
+                DimCompany.sk_company_id, DimCompany.symbol, DimCompany.company_name,
+                DimCompany.sector, DimCompany.industry, DimCompany.country
+            )
+        ]
+        dates = [
+            DateRecord(*row) for row in db.session.query(DimDate.sk_date_id, DimDate.datetime, DimDate.date)
+        ]
+        return _Snapshot(version, companies, dates)
+
+    def snapshot(self, force=False):
+        """Current snapshot, reloading it if the dimension version changed."""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and not force and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            version = dimension_version()
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(version)
+            self._checked_at = now
+            return self._snapshot
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    def company_by_symbol(self, symbol):
+        snapshot = self.snapshot()
+        sk = snapshot.symbols.get(symbol)
+        if sk is None and time.monotonic() - self._checked_at > 1.0:
+            snapshot = self.snapshot(force=True)
+            sk = snapshot.symbols.get(symbol)
+        return snapshot.companies.get(sk) if sk is not None else None
+
+    def company(self, sk_company_id):
+        return self.snapshot().companies.get(sk_company_id)
+
+    def date(self, sk_date_id):
+        return self.snapshot().dates.get(sk_date_id)
+
+    def date_keys_between(self, from_datetime, to_datetime):
+        """Keys of the dim_date rows inside the window (inclusive) in time order,
+        plus whether the window covers every cached date."""
+        snapshot = self.snapshot()
+        if (not snapshot.datetimes or to_datetime > snapshot.datetimes[-1]) and time.monotonic() - self._checked_at > 1.0:
+            # The window reaches past the cached time axis: newer dates may have been loaded since
+            snapshot = self.snapshot(force=True)
+        lo = bisect_left(snapshot.datetimes, from_datetime)
+        hi = bisect_right(snapshot.datetimes, to_datetime)
+        return snapshot.date_keys[lo:hi], (lo == 0 and hi == len(snapshot.datetimes))
+
+
+dimension_cache = AppExtension('dimension_cache', DimensionCache)
+
+
+def _date_predicate(from_datetime, to_datetime):
+    """Filter on fk_date_id resolved from the cached time axis, or None when the join is cheaper."""
+    keys, covers_all = dimension_cache.date_keys_between(from_datetime, to_datetime)
+    if covers_all:
+        return True
+    if not keys:
+        return False
+    ordered = sorted(keys)
+    if ordered[-1] - ordered[0] + 1 == len(ordered):
+        return FactMarketMetrics.fk_date_id.between(ordered[0], ordered[-1])
+    if len(ordered) <= MAX_DATE_KEYS_IN_LIST:
+        return FactMarketMetrics.fk_date_id.in_(ordered)
+    return None
+
+
+def _field_source(name):
+    table = getattr(FIELD_COLUMNS[name], 'table', None)
+    if table is DimCompany.__table__:
+        return 'company'
+    if table is DimDate.__table__:
+        return 'date'
+    return 'fact'
+
+
+def cached_fact_rows(companies, from_datetime, to_datetime, fields=STOCK_FIELDS):
+    """Output dicts of ``fields`` for the given CompanyRecords, ordered by symbol and time.
+
+    Only the fact columns are selected from fact_market_metrics; date and
+    company attributes are attached from the dimension cache instead of joined.
+    """
+    if not companies:
+        return []
+    by_id = {c.sk_company_id: c for c in companies}
+    sources = [_field_source(name) for name in fields]
+    fact_fields = [name for name, source in zip(fields, sources) if source == 'fact']
+    # (source, attribute name or result column index) for each output field
+    getters = [
+        (source, 2 + fact_fields.index(name) if source == 'fact' else name)
+        for name, source in zip(fields, sources)
+    ]
+
+    query = select(
+        FactMarketMetrics.fk_company_id,
+        FactMarketMetrics.fk_date_id,
+        *[FIELD_COLUMNS[name].label(name) for name in fact_fields]
+    ).where(FactMarketMetrics.fk_company_id.in_(by_id))
+
+    predicate = _date_predicate(from_datetime, to_datetime)
+    if predicate is False:
+        return []
+    if predicate is None:
+        query = query.join(DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id).where(
+            DimDate.datetime.between(from_datetime, to_datetime)
+        )
+    elif predicate is not True:
+        query = query.where(predicate)
+    if predicate is not True:
+        query = query.where(fact_window(from_datetime, to_datetime))
+
+    results = request_metrics.fetch_rows(query)
+    snapshot = dimension_cache.snapshot()
+    if any(row[1] not in snapshot.dates for row in results):
+        # Facts reference a date loaded after the snapshot was taken
+        snapshot = dimension_cache.snapshot(force=True)
+
+    with request_metrics.stage('transform'):
+        matched = []
+        for row in results:
+            date = snapshot.dates.get(row[1])
+            if date is None or date.datetime is None or not from_datetime <= date.datetime <= to_datetime:
+                continue
+            matched.append((by_id[row[0]], date, row))
+        matched.sort(key=lambda item: (item[0].symbol, item[1].datetime))
+
+        convert = row_converter(fields)
+        output = []
+        for company, date, row in matched:
+            values = [
+                getattr(company, key) if source == 'company' else getattr(date, key) if source == 'date' else row[key]
+                for source, key in getters
+            ]
+            output.append(convert(values))
+    return output
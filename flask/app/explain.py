@@ -0,0 +1,96 @@
+from models import db
+from queries import (
+    parse_date_window, earliest_date, market_query, stock_query, stocks_query, decode_cursor, seek_after,
+    parse_fields, MARKET_FIELDS, STOCK_FIELDS
+)
+from rollups import rollup_query
+from latest import latest_query
+from indicators import INDICATOR_FIELDS
+
+# Endpoint path -> function(args) returning the ORM query that endpoint runs.
+EXPLAIN_BUILDERS = {}
+
+
+def explainable(endpoint):
+    """Register a query builder so /admin/explain can show the plan for ``endpoint``."""
+    def decorator(builder):
+        EXPLAIN_BUILDERS[endpoint] = builder
+        return builder
+    return decorator
+
+
+@explainable('/api/market')
+def _market(args):
+    return market_query(args.get('country', 'US'), *parse_date_window(args),
+                        fields=parse_fields(args.get('fields'), MARKET_FIELDS))
+
+
+@explainable('/api/ml-model')
+def _ml_model(args):
+    query = market_query(args.get('country', 'US'), *parse_date_window(args, earliest=earliest_date),
+                         fields=parse_fields(args.get('fields'), MARKET_FIELDS))
+    if args.get('cursor'):
+        query = seek_after(query, decode_cursor(args['cursor']))
+        return query.limit(args.get('limit', 100, type=int))
+    return query.limit(args.get('limit', 100, type=int)).offset(args.get('offset', 0, type=int))
+
+
+@explainable('/api/ml-model/stock')
+def _ml_model_stock(args):
+    return stock_query(args.get('ticker', ''), *parse_date_window(args, earliest=earliest_date),
+                       fields=parse_fields(args.get('fields'), STOCK_FIELDS))
+
+
+@explainable('/api/ml-model/stocks')
+def _ml_model_stocks(args):
+    tickers = [t.strip() for t in args.get('tickers', '').split(',') if t.strip()]
+    return stocks_query(tickers, *parse_date_window(args, earliest=earliest_date))
+
+
+@explainable('/api/ml-model/indicators')
+def _ml_model_indicators(args):
+    tickers = [t.strip() for t in args.get('tickers', args.get('ticker', '')).split(',') if t.strip()]
+    return stocks_query(tickers, *parse_date_window(args, earliest=earliest_date), fields=INDICATOR_FIELDS)
+
+
+@explainable('/api/market/rollup')
+def _market_rollup(args):
+    symbols = [s.strip() for s in args.get('symbols', '').split(',') if s.strip()]
+    return rollup_query(args.get('grain', 'day').lower(), symbols, args.get('country', 'US'),
+                        *parse_date_window(args, default_days='365'))
+
+
+@explainable('/api/market/latest')
+def _market_latest(args):
+    sectors = [s.strip() for s in args.get('sector', '').split(',') if s.strip()]
+    symbols = [s.strip() for s in args.get('symbols', '').split(',') if s.strip()]
+    return latest_query(args.get('country', 'US'), sectors, symbols)
+
+
+def explain_query(query, analyze=False):
+    """Run the dialect's EXPLAIN for ``query`` and return (sql, plan)."""
+    statement = getattr(query, 'statement', query)
+    dialect = db.engine.dialect
+    # Expand IN lists into one placeholder per value; exec_driver_sql cannot expand them
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    sql = str(compiled)
+
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    conn = db.session.connection()
+    if dialect.name == 'postgresql':
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+        plan = conn.exec_driver_sql(f"EXPLAIN ({options}) {sql}", params).scalar()
+    elif dialect.name == 'sqlite':
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+    else:
+        plan = [' '.join(str(value) for value in row) for row in conn.exec_driver_sql(f"EXPLAIN {sql}", params)]
+    return sql, plan
+
+
+def explain_endpoint(endpoint, args, analyze=False):
+    """Plan of the query ``endpoint`` would run for ``args``. Raises KeyError for unknown endpoints."""
+    return explain_query(EXPLAIN_BUILDERS[endpoint](args), analyze=analyze)
@@ -0,0 +1,263 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+
+from extensions import AppExtension
+from models import db
+from queries import parse_date_window, parse_fields, earliest_date, market_query, stock_query, MARKET_FIELDS, STOCK_FIELDS
+from serialization import RowEncoder
+from columnar import PARQUET_MIMETYPE, _import_pyarrow, _arrow_type, _record_batch
+from cache import response_cache
+from watermark import fact_watermark
+
+# Export format -> (file suffix, download mimetype). NDJSON is gzipped; Parquet compresses its column chunks.
+EXPORT_FORMATS = {
+    'ndjson': ('.ndjson.gz', 'application/gzip'),
+    'parquet': ('.parquet', PARQUET_MIMETYPE),
+}
+
+# Rows pulled per server-side cursor round-trip and written per chunk.
+EXPORT_BATCH_SIZE = 10000
+
+# Endpoint path -> function(args) returning (statement, fields) for the rows that endpoint would export.
+EXPORT_BUILDERS = {}
+
+
+class ExportError(ValueError):
+    """Raised for an export request that cannot be served (unknown endpoint or format)."""
+
+
+def exportable(endpoint):
+    """Register the statement builder used to export ``endpoint``."""
+    def decorator(builder):
+        EXPORT_BUILDERS[endpoint] = builder
+        return builder
+    return decorator
+
+
+@exportable('/api/market')
+def _market(args):
+    fields = parse_fields(args.get('fields'), MARKET_FIELDS)
+    return market_query(args.get('country', 'US'), *parse_date_window(args), fields=fields), fields
+
+
+@exportable('/api/ml-model')
+def _ml_model(args):
+    # Unbounded unless limit/offset are passed, like the streamed formats of the endpoint itself
+    fields = parse_fields(args.get('fields'), MARKET_FIELDS)
+    query = market_query(args.get('country', 'US'), *parse_date_window(args, earliest=earliest_date), fields=fields)
+    if 'limit' in args:
+        query = query.limit(args.get('limit', type=int))
+    if 'offset' in args:
+        query = query.offset(args.get('offset', type=int))
+    return query, fields
+
+
+@exportable('/api/ml-model/stock')
+def _ml_model_stock(args):
+    fields = parse_fields(args.get('fields'), STOCK_FIELDS)
+    return stock_query(args.get('ticker', ''), *parse_date_window(args, earliest=earliest_date), fields=fields), fields
+
+
+def _write_ndjson(path, statement, fields, progress):
+    encoder = RowEncoder(fields)
+    count = 0
+    with gzip.open(path, 'wb', compresslevel=6) as out:
+        result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for batch in result.partitions():
+            out.write(encoder.encode_lines(batch))
+            count += len(batch)
+            progress(count)
+    return count
+
+
+def _write_parquet(path, statement, fields, progress):
+    pa = _import_pyarrow()
+    schema = pa.schema([pa.field(name, _arrow_type(pa, name)) for name in fields])
+    count = 0
+    with pa.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for batch in result.partitions():
+            writer.write_batch(_record_batch(pa, schema, [row[:len(fields)] for row in batch]))
+            count += len(batch)
+            progress(count)
+        if count == 0:
+            writer.write_table(schema.empty_table())
+    return count
+
+
+class ExportJobs:
+    """Background exports of full result sets to files on local disk.
+
+    A job is identified by its endpoint, normalised parameters, format and
+    the fact-table watermark, so an identical request made before new facts
+    land reuses the running or finished job. Job state lives next to the
+    file as ``<id>.json``, which lets every worker process on the host see
+    it; the rows are written by a small thread pool per process, each job
+    on its own connection, never on a request thread.
+    """
+
+    def __init__(self):
+        self.directory = os.path.join(tempfile.gettempdir(), 'stockapi-exports')
+        self.workers = 2
+        self.ttl = 86400.0
+        self.stale_after = 600.0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('EXPORT_DIR', self.directory)
+        app.config.setdefault('EXPORT_WORKERS', 2)
+        app.config.setdefault('EXPORT_TTL_SECONDS', 86400)
+        self.directory = app.config['EXPORT_DIR']
+        self.workers = int(app.config['EXPORT_WORKERS'])
+        self.ttl = float(app.config['EXPORT_TTL_SECONDS'])
+
+    def _path(self, job_id, suffix='.json'):
+        return os.path.join(self.directory, job_id + suffix)
+
+    def file_path(self, job):
+        return self._path(job['id'], EXPORT_FORMATS[job['format']][0])
+
+    def _save(self, job):
+        """Write the job state atomically (readers never see a half-written file)."""
+        job['updated_at'] = datetime.now().isoformat()
+        temporary = self._path(job['id'], f".json.{os.getpid()}.{threading.get_ident()}")
+        with open(temporary, 'w') as f:
+            json.dump(job, f)
+        os.replace(temporary, self._path(job['id']))
+
+    def get(self, job_id):
+        """Job state for ``job_id``, or None when unknown or expired."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _submit(self, job):
+        with self._lock:
+            if self._executor is None:
+                # Created lazily so every forked worker process gets its own pool
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export')
+        self._executor.submit(self._run, current_app._get_current_object(), job)
+
+    def _reusable(self, job):
+        if job is None or job['status'] == 'failed':
+            return False
+        if job['status'] == 'done':
+            return os.path.exists(self.file_path(job))
+        updated_at = datetime.fromisoformat(job['updated_at'])
+        return (datetime.now() - updated_at).total_seconds() < self.stale_after
+
+    def submit(self, endpoint, args, fmt):
+        """Existing job for the same export, or a newly queued one. Raises ExportError for bad requests."""
+        if endpoint not in EXPORT_BUILDERS:
+            raise ExportError(f"endpoint must be one of: {', '.join(sorted(EXPORT_BUILDERS))}")
+        if fmt not in EXPORT_FORMATS:
+            raise ExportError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        if fmt == 'parquet':
+            _import_pyarrow()
+        args = MultiDict(args)
+        # Validate the filters now rather than in the background
+        try:
+            EXPORT_BUILDERS[endpoint](args)
+        except ValueError as e:
+            raise ExportError(str(e)) from e
+
+        watermark = fact_watermark()
+        job_id = hashlib.sha256(
+            f"{response_cache.normalized_params(args)}|{endpoint}|{fmt}|{watermark}".encode()
+        ).hexdigest()[:32]
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.sweep()
+        job = self.get(job_id)
+        if self._reusable(job):
+            return job
+
+        job = {
+            'id': job_id, 'status': 'queued', 'endpoint': endpoint, 'params': args.to_dict(flat=False),
+            'format': fmt, 'watermark': watermark, 'record_count': 0, 'bytes': None, 'error': None,
+            'created_at': datetime.now().isoformat(), 'started_at': None, 'finished_at': None,
+        }
+        try:
+            # O_EXCL: when two workers race for the same export only one of them queues it
+            fd = os.open(self._path(job_id, '.claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            claimed = self.get(job_id)
+            if self._reusable(claimed):
+                return claimed
+        else:
+            os.close(fd)
+        self._save(job)
+        self._submit(job)
+        return job
+
+    def _run(self, app, job):
+        path = self.file_path(job)
+        partial = path + '.part'
+        last_saved = [time.monotonic()]
+
+        def progress(count):
+            job['record_count'] = count
+            if time.monotonic() - last_saved[0] > 5:
+                self._save(job)
+                last_saved[0] = time.monotonic()
+
+        with app.app_context():
+            job['status'], job['started_at'] = 'running', datetime.now().isoformat()
+            self._save(job)
+            start_time = time.time()
+            try:
+                statement, fields = EXPORT_BUILDERS[job['endpoint']](MultiDict(job['params']))
+                writer = _write_parquet if job['format'] == 'parquet' else _write_ndjson
+                job['record_count'] = writer(partial, statement, fields, progress)
+                os.replace(partial, path)
+                job['status'], job['bytes'] = 'done', os.path.getsize(path)
+                logging.info(
+                    f"EXPORT: {job['id']} {job['endpoint']} | Records: {job['record_count']} | "
+                    f"Execution Time: {time.time() - start_time:.4f} seconds"
+                )
+            except Exception as e:
+                job['status'], job['error'] = 'failed', str(e)
+                logging.error(f"ERROR: export {job['id']} {job['endpoint']} | Exception: {e}")
+                if os.path.exists(partial):
+                    os.remove(partial)
+            finally:
+                db.session.remove()
+                job['finished_at'] = datetime.now().isoformat()
+                self._save(job)
+                claim = self._path(job['id'], '.claim')
+                if os.path.exists(claim):
+                    os.remove(claim)
+
+    def sweep(self):
+        """Delete export files and job states older than the TTL."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+export_jobs = AppExtension('export_jobs', ExportJobs)
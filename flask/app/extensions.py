@@ -0,0 +1,41 @@
+from inspect import getattr_static
+
+from flask import current_app, has_app_context
+
+_MISSING = object()
+
+
+class AppExtension:
+    """Module-level handle on an extension whose state is kept per app in ``app.extensions``.
+
+    ``init_app`` builds a new ``factory()`` instance for the app, stores it
+    under ``name`` and configures it there, so two apps from create_app
+    never share settings, backends or counters. Inside an app context the
+    handle forwards every attribute to the current app's instance. Outside
+    one (view decorators applied at import) it only hands out the class's
+    methods, bound to the handle, so the state they touch is still looked
+    up per request.
+    """
+
+    def __init__(self, name, factory):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_factory', factory)
+
+    def init_app(self, app):
+        instance = app.extensions[self._name] = self._factory()
+        instance.init_app(app)
+        return instance
+
+    def __getattr__(self, attribute):
+        if has_app_context():
+            return getattr(current_app.extensions[self._name], attribute)
+        static = getattr_static(self._factory, attribute, _MISSING)
+        if static is _MISSING or not hasattr(static, '__get__'):
+            raise RuntimeError(f"{self._name}.{attribute} needs an application context")
+        return static.__get__(self, self._factory)
+
+    def __setattr__(self, attribute, value):
+        setattr(current_app.extensions[self._name], attribute, value)
+
+    def __repr__(self):
+        return f"<AppExtension {self._name}>"
@@ -0,0 +1,34 @@
+"""Production launcher settings: ``gunicorn -c gunicorn.conf.py`` (serves ``wsgi:app``).
+
+The app is imported once in the master (``preload_app``), so startup
+provisioning runs once and workers fork with the code already loaded.
+Connections opened by the master must not be shared with the children,
+so every worker replaces its inherited connection pools right after the
+fork. Settings come from the environment:
+
+    GUNICORN_BIND      address to listen on (default 0.0.0.0:5000)
+    WEB_CONCURRENCY    worker processes (default 2 x CPU cores + 1)
+    GUNICORN_THREADS   threads per worker (default 4)
+    GUNICORN_TIMEOUT   seconds before a silent worker is restarted (default 120)
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = True
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Drop the master's pooled connections without closing them (they still belong to the master)
+    from wsgi import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,177 @@
+from itertools import groupby
+
+# Fields loaded per symbol to compute indicators, in select order.
+INDICATOR_FIELDS = ('symbol', 'datetime', 'current_price', 'volume', 'day_low', 'day_high')
+
+DEFAULT_INDICATORS = 'sma:20,ema:20,rsi:14,volatility:20,vwap:20,drawdown'
+MAX_INDICATOR_WINDOW = 10000
+
+# Samples folded per closed-form EMA block; keeps (1 - alpha) ** -n well inside float64 range.
+EMA_BLOCK_SIZE = 256
+
+
+class IndicatorsUnavailable(Exception):
+    """Raised when NumPy is not installed."""
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise IndicatorsUnavailable("numpy is required for /api/ml-model/indicators") from e
+    return numpy
+
+
+def _rolling_sum(np, values, window):
+    """Sum of each trailing ``window`` values (NaN until the window is full)."""
+    out = np.full(values.shape, np.nan)
+    if window <= len(values):
+        cumulative = np.concatenate(([0.0], np.cumsum(values)))
+        out[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return out
+
+
+def _ema(np, values, alpha):
+    """Exponential moving average seeded with the first value (``y[0] = x[0]``).
+
+    The recurrence y[t] = a*x[t] + (1-a)*y[t-1] is evaluated in closed form
+    per block of EMA_BLOCK_SIZE samples (a scaled cumulative sum), carrying
+    the last value into the next block, so there is no Python loop per sample.
+    """
+    out = np.empty(values.shape)
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    if decay == 0.0:
+        out[:] = values
+        return out
+    previous = values[0]
+    powers = decay ** np.arange(1, EMA_BLOCK_SIZE + 1)
+    for start in range(0, len(values), EMA_BLOCK_SIZE):
+        block = values[start:start + EMA_BLOCK_SIZE]
+        n = len(block)
+        scaled = np.cumsum(block / powers[:n])
+        out[start:start + n] = powers[:n] * (previous + alpha * scaled)
+        previous = out[start + n - 1]
+    return out
+
+
+def sma(np, series, window):
+    return _rolling_sum(np, series['close'], window) / window
+
+
+def ema(np, series, window):
+    return _ema(np, series['close'], 2.0 / (window + 1))
+
+
+def rsi(np, series, window):
+    """Relative strength index with Wilder smoothing (alpha = 1/window)."""
+    close = series['close']
+    out = np.full(close.shape, np.nan)
+    if len(close) <= window:
+        return out
+    change = np.diff(close)
+    gain = _ema(np, np.clip(change, 0, None), 1.0 / window)
+    loss = _ema(np, np.clip(-change, 0, None), 1.0 / window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 100.0 - 100.0 / (1.0 + gain / loss)
+    value[loss == 0] = 100.0
+    out[1:] = value
+    out[:window] = np.nan
+    return out
+
+
+def volatility(np, series, window):
+    """Rolling sample standard deviation of log returns."""
+    close = series['close']
+    out = np.full(close.shape, np.nan)
+    if len(close) <= window:
+        return out
+    returns = np.diff(np.log(close))
+    windows = np.lib.stride_tricks.sliding_window_view(returns, window)
+    out[window:] = windows.std(axis=-1, ddof=1)
+    return out
+
+
+def vwap(np, series, window):
+    """Rolling volume-weighted typical price ((high + low + close) / 3, or close when no range)."""
+    close, volume = series['close'], series['volume']
+    typical = (series['high'] + series['low'] + close) / 3.0
+    typical = np.where(np.isnan(typical), close, typical)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _rolling_sum(np, typical * volume, window) / _rolling_sum(np, volume, window)
+
+
+def drawdown(np, series, window=None):
+    """Fractional distance below the running maximum close."""
+    close = series['close']
+    return close / np.maximum.accumulate(close) - 1.0
+
+
+# name -> (kernel, takes a window)
+INDICATORS = {
+    'sma': (sma, True),
+    'ema': (ema, True),
+    'rsi': (rsi, True),
+    'volatility': (volatility, True),
+    'vwap': (vwap, True),
+    'drawdown': (drawdown, False),
+}
+
+
+def parse_indicators(spec):
+    """Parse 'sma:20,rsi:14,drawdown' into [(output name, indicator, window)]. Raises ValueError."""
+    parsed = []
+    for item in (part.strip() for part in (spec or DEFAULT_INDICATORS).split(',')):
+        if not item:
+            continue
+        name, _, window = item.partition(':')
+        name = name.lower()
+        if name not in INDICATORS:
+            raise ValueError(f"Unknown indicator '{name}'; available: {', '.join(INDICATORS)}")
+        if not INDICATORS[name][1]:
+            parsed.append((name, name, None))
+            continue
+        try:
+            window = int(window)
+        except ValueError:
+            raise ValueError(f"Indicator '{name}' needs a window, e.g. {name}:20") from None
+        if not 1 <= window <= MAX_INDICATOR_WINDOW:
+            raise ValueError(f"Window must be between 1 and {MAX_INDICATOR_WINDOW}")
+        parsed.append((f"{name}_{window}", name, window))
+    if not parsed:
+        raise ValueError("No indicators requested")
+    return parsed
+
+
+def _as_json(np, values):
+    """Round to 6 places and map NaN/inf to None."""
+    rounded = np.round(values, 6)
+    return [value if value == value and abs(value) != float('inf') else None for value in rounded.tolist()]
+
+
+def compute_indicators(rows, indicators):
+    """Columnar indicator series per symbol from INDICATOR_FIELDS rows ordered by symbol and time.
+
+    Rows without a price are skipped; each symbol's series is loaded into
+    float64 arrays once and every requested kernel runs on those arrays.
+    Returns {symbol: {'datetime': [...], '<indicator>_<window>': [...]}}.
+    """
+    np = _import_numpy()
+    output = {}
+    for symbol, symbol_rows in groupby(rows, key=lambda row: row[0]):
+        priced = [row for row in symbol_rows if row[2] is not None]
+        if not priced:
+            output[symbol] = {'datetime': []}
+            continue
+        _, datetimes, close, volume, low, high = zip(*priced)
+        series = {
+            'close': np.array(close, dtype=float),
+            'volume': np.array(volume, dtype=float),
+            'low': np.array(low, dtype=float),
+            'high': np.array(high, dtype=float),
+        }
+        entry = output[symbol] = {'datetime': [dt.isoformat() if dt else None for dt in datetimes]}
+        for output_name, name, window in indicators:
+            entry[output_name] = _as_json(np, INDICATORS[name][0](np, series, window))
+    return output
@@ -0,0 +1,368 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Integer, bindparam, func, insert, select, text
+
+from models import db, DimDate, FactMarketMetrics
+from dimensions import dimension_cache
+from watermark import bump_data_version, log_replacements
+
+INGEST_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FILE_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet'}
+
+# Rows written per transaction; each chunk is replaced atomically.
+INGEST_BATCH_SIZE = 50000
+
+# Values per IN list when looking up which keys of a chunk are already stored.
+KEY_LOOKUP_SIZE = 500
+
+# Rejected rows reported back in detail; the rest are only counted.
+MAX_REPORTED_ERRORS = 20
+
+# Columns derived from the record's keys rather than sent in it.
+DERIVED_COLUMNS = ('trade_datetime',)
+
+# Measures a record may carry besides symbol and datetime (every non-key fact column).
+FACT_COLUMNS = {
+    column.name: column for column in FactMarketMetrics.__table__.columns
+    if not column.primary_key and not column.foreign_keys and column.name not in DERIVED_COLUMNS
+}
+INTEGER_COLUMNS = {name for name, column in FACT_COLUMNS.items() if isinstance(column.type, (Integer, BigInteger))}
+FACT_KEYS = ('fk_company_id', 'fk_date_id')
+
+
+class IngestError(ValueError):
+    """Raised when a batch cannot be read at all (unknown format, unknown columns, bad file).
+
+    ``summary`` holds the counts of the chunks already committed when the
+    problem was found part-way through a batch, None when nothing was loaded.
+    """
+
+    def __init__(self, message, summary=None):
+        super().__init__(message)
+        self.summary = summary
+
+
+def ingest_format(content_type=None, filename=None, requested=None):
+    """Resolve the batch format from an explicit name, a file extension or a Content-Type."""
+    if requested:
+        if requested.lower() not in INGEST_FORMATS:
+            raise IngestError(f"format must be one of: {', '.join(INGEST_FORMATS)}")
+        return requested.lower()
+    if filename:
+        for extension, fmt in FILE_EXTENSIONS.items():
+            if filename.lower().endswith(extension):
+                return fmt
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    for fmt, known in INGEST_FORMATS.items():
+        if mimetype == known:
+            return fmt
+    if mimetype == 'application/json':
+        return 'ndjson'
+    raise IngestError(f"Cannot tell the batch format; pass ?format= ({', '.join(INGEST_FORMATS)})")
+
+
+def read_records(stream, fmt):
+    """Yield one dict per record from a binary stream in ``fmt``."""
+    if fmt == 'csv':
+        yield from csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise IngestError(f"Line {line_number}: invalid JSON ({e})") from e
+            if not isinstance(record, dict):
+                raise IngestError(f"Line {line_number}: expected a JSON object")
+            yield record
+    elif fmt == 'parquet':
+        from columnar import _import_pyarrow
+        pa = _import_pyarrow()
+        source = stream if stream.seekable() else io.BytesIO(stream.read())
+        for batch in pa.parquet.ParquetFile(source).iter_batches(batch_size=INGEST_BATCH_SIZE):
+            yield from batch.to_pylist()
+    else:
+        raise IngestError(f"Unsupported format: {fmt}")
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo else value
+    text_value = str(value).strip()
+    if text_value.endswith('Z'):
+        text_value = text_value[:-1]
+    parsed = datetime.fromisoformat(text_value)
+    return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def _coerce(column, value):
+    if value is None or value == '':
+        return None
+    if column.name in INTEGER_COLUMNS:
+        return int(float(value))
+    return float(value)
+
+
+_KNOWN_KEYS = set(FACT_COLUMNS) | {'symbol', 'datetime'}
+_checked_keysets = set()
+
+
+def validate_record(record):
+    """(symbol, datetime, measures) for a record; raises ValueError describing the first problem."""
+    if None in record:
+        # csv.DictReader files the values past the header under None
+        raise ValueError("row has more fields than header")
+    keys = frozenset(record)
+    if keys not in _checked_keysets:
+        unknown = keys - _KNOWN_KEYS
+        if unknown:
+            raise IngestError(f"Unknown columns: {', '.join(sorted(unknown))}")
+        _checked_keysets.add(keys)
+    symbol = record.get('symbol')
+    if symbol is not None and not isinstance(symbol, str):
+        raise IngestError(f"symbol must be a string, got {type(symbol).__name__}")
+    symbol = (symbol or '').strip()
+    if not symbol:
+        raise ValueError("symbol is required")
+    if not record.get('datetime'):
+        raise ValueError("datetime is required")
+    try:
+        dt = _parse_datetime(record['datetime'])
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid datetime: {record['datetime']!r}") from None
+    measures = {}
+    for name, value in record.items():
+        column = FACT_COLUMNS.get(name)
+        if column is not None:
+            try:
+                measures[name] = _coerce(column, value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} is not numeric: {value!r}") from None
+    return symbol, dt, measures
+
+
+def calendar_attributes(dt):
+    """DimDate columns derived from a timestamp."""
+    iso = dt.isocalendar()
+    return {
+        'datetime': dt,
+        'date': dt.strftime('%Y-%m-%d'),
+        'hour': dt.hour,
+        'day_of_week': dt.weekday(),
+        'day_name': dt.strftime('%A'),
+        'day_of_month': dt.day,
+        'day_of_year': dt.timetuple().tm_yday,
+        'week_of_year': iso[1],
+        'month': dt.month,
+        'month_name': dt.strftime('%B'),
+        'quarter': (dt.month - 1) // 3 + 1,
+        'year': dt.year,
+        'fiscal_year': dt.year,
+        'is_weekend': dt.weekday() >= 5,
+    }
+
+
+def resolve_dates(datetimes):
+    """Map each timestamp to its sk_date_id, inserting missing DimDate rows.
+
+    Known timestamps come from the dimension cache; the rest are looked up
+    and, if still absent, created under a lock so concurrent loads do not
+    insert the same date twice. Returns (mapping, number of dates created).
+    """
+    snapshot = dimension_cache.snapshot()
+    cached = {date.datetime: sk for sk, date in snapshot.dates.items() if date.datetime is not None}
+    mapping = {dt: cached[dt] for dt in datetimes if dt in cached}
+    missing = sorted(set(datetimes) - set(mapping))
+    if not missing:
+        return mapping, 0
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("LOCK TABLE dim_date IN SHARE ROW EXCLUSIVE MODE"))
+    existing = db.session.query(DimDate.datetime, func.min(DimDate.sk_date_id)).filter(
+        DimDate.datetime.between(missing[0], missing[-1])
+    ).group_by(DimDate.datetime).all()
+    wanted = set(missing)
+    mapping.update((dt, sk) for dt, sk in existing if dt in wanted)
+    to_create = [dt for dt in missing if dt not in mapping]
+    if to_create:
+        created = db.session.execute(
+            insert(DimDate).returning(DimDate.sk_date_id, DimDate.datetime),
+            [calendar_attributes(dt) for dt in to_create]
+        )
+        mapping.update((dt, sk) for sk, dt in created)
+    return mapping, len(to_create)
+
+
+def _copy_facts(rows, columns):
+    """PostgreSQL: COPY the chunk into a temp staging table, then delete+insert from it."""
+    staging = 'ingest_fact_staging'
+    column_list = ', '.join(columns)
+    # One staging shape per connection: every loadable column, whichever subset this chunk carries
+    db.session.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(FACT_KEYS + DERIVED_COLUMNS + tuple(FACT_COLUMNS))} FROM {FactMarketMetrics.__tablename__} WITH NO DATA"
+    ))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+    replaced = db.session.execute(text(
+        f"DELETE FROM {FactMarketMetrics.__tablename__} f USING {staging} s "
+        f"WHERE f.fk_company_id = s.fk_company_id AND f.fk_date_id = s.fk_date_id "
+        f"RETURNING f.fk_company_id, f.fk_date_id"
+    )).all()
+    db.session.execute(text(
+        f"INSERT INTO {FactMarketMetrics.__tablename__} ({column_list}) SELECT {column_list} FROM {staging}"
+    ))
+    return [tuple(key) for key in replaced]
+
+
+def _executemany(connection, statement, column_keys, rows):
+    """executemany straight on the DBAPI cursor, skipping per-row parameter processing."""
+    compiled = statement.compile(dialect=connection.dialect, column_keys=column_keys)
+    if compiled.positional:
+        order = compiled.positiontup
+        params = [tuple(row[key] for key in order) for row in rows]
+    else:
+        params = rows
+    return connection.exec_driver_sql(str(compiled), params).rowcount
+
+
+def _existing_keys(rows):
+    """The chunk's (company, date) keys that already have a fact, looked up by the shorter key list."""
+    table = FactMarketMetrics.__table__
+    wanted = {(row['fk_company_id'], row['fk_date_id']) for row in rows}
+    company_ids = sorted({company_id for company_id, _ in wanted})
+    date_ids = sorted({date_id for _, date_id in wanted})
+    column, values = (table.c.fk_date_id, date_ids) if len(date_ids) <= len(company_ids) else (table.c.fk_company_id, company_ids)
+    found = []
+    for start in range(0, len(values), KEY_LOOKUP_SIZE):
+        found += db.session.execute(
+            select(table.c.fk_company_id, table.c.fk_date_id).where(column.in_(values[start:start + KEY_LOOKUP_SIZE]))
+        ).all()
+    return [key for key in dict.fromkeys(map(tuple, found)) if key in wanted]
+
+
+def _executemany_facts(rows, columns):
+    """Portable path: executemany DELETE of the keys already stored, then one executemany INSERT."""
+    table = FactMarketMetrics.__table__
+    connection = db.session.connection()
+    existing = _existing_keys(rows)
+    if existing:
+        _executemany(connection, table.delete().where(
+            table.c.fk_company_id == bindparam('fk_company_id'), table.c.fk_date_id == bindparam('fk_date_id')
+        ), None, [{'fk_company_id': company_id, 'fk_date_id': date_id} for company_id, date_id in existing])
+    _executemany(connection, table.insert(), columns, rows)
+    return existing
+
+
+def _write_chunk(records):
+    """Resolve keys and replace one chunk of validated (symbol, datetime, measures) records."""
+    result = {'inserted': 0, 'replaced': 0, 'dates_created': 0, 'rejected': []}
+    companies = {}
+    for symbol in {symbol for symbol, _, _ in records}:
+        company = dimension_cache.company_by_symbol(symbol)
+        if company is not None:
+            companies[symbol] = company.sk_company_id
+
+    dates, result['dates_created'] = resolve_dates(
+        [dt for symbol, dt, _ in records if symbol in companies]
+    )
+
+    # Last record wins when the same (company, date) appears twice in a chunk
+    rows = {}
+    for symbol, dt, measures in records:
+        if symbol not in companies:
+            result['rejected'].append(f"unknown symbol: {symbol}")
+            continue
+        key = (companies[symbol], dates[dt])
+        rows[key] = {'fk_company_id': key[0], 'fk_date_id': key[1], 'trade_datetime': dt, **measures}
+    if not rows:
+        db.session.commit()
+        return result
+
+    columns = list(FACT_KEYS + DERIVED_COLUMNS) + sorted(
+        {name for row in rows.values() for name in row if name in FACT_COLUMNS}
+    )
+    rows = [{c: row.get(c) for c in columns} for row in rows.values()]
+    if db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2':
+        replaced = _copy_facts(rows, columns)
+    else:
+        replaced = _executemany_facts(rows, columns)
+    result['inserted'], result['replaced'] = len(rows), len(replaced)
+    # Replacements can leave the key range and row count unchanged; the counter always moves
+    bump_data_version()
+    datetimes = {date_id: dt for dt, date_id in dates.items()}
+    log_replacements([(company_id, datetimes.get(date_id)) for company_id, date_id in replaced])
+    db.session.commit()
+    return result
+
+
+def ingest_records(records, batch_size=INGEST_BATCH_SIZE):
+    """Validate and load an iterable of record dicts into fact_market_metrics.
+
+    Records are keyed by (symbol, datetime). Each chunk of ``batch_size``
+    records is written in one transaction: facts already stored for those
+    keys are deleted and the new rows inserted, so re-sending a batch is
+    idempotent. Unknown symbols are rejected; unknown timestamps get new
+    DimDate rows. Returns counts plus the first few rejection reasons.
+
+    A stream is not buffered, so an IngestError raised by a later record
+    (for instance a new set of columns with an unknown one) leaves the
+    earlier chunks committed; the error then carries their ``summary``,
+    including how many leading records ``committed_records`` covers.
+    """
+    summary = {'received': 0, 'inserted': 0, 'replaced': 0, 'rejected': 0, 'dates_created': 0, 'errors': []}
+
+    def reject(reason):
+        summary['rejected'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append(reason)
+
+    chunk = []
+    committed = 0  # records handled by committed chunks
+    try:
+        for record in records:
+            summary['received'] += 1
+            try:
+                chunk.append(validate_record(record))
+            except IngestError:
+                raise
+            except ValueError as e:
+                reject(f"record {summary['received']}: {e}")
+            if len(chunk) >= batch_size:
+                _merge_result(summary, _write_chunk(chunk), reject)
+                chunk, committed = [], summary['received']
+        if chunk:
+            _merge_result(summary, _write_chunk(chunk), reject)
+    except IngestError as e:
+        if committed:
+            # Records after ``committed_records`` were not loaded; resend from there
+            e.summary = {**summary, 'committed_records': committed}
+        raise
+    finally:
+        if summary['dates_created']:
+            dimension_cache.snapshot(force=True)
+    return summary
+
+
+def _merge_result(summary, result, reject):
+    for key in ('inserted', 'replaced', 'dates_created'):
+        summary[key] += result[key]
+    for reason in result['rejected']:
+        reject(reason)
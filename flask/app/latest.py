@@ -0,0 +1,204 @@
+from datetime import datetime
+
+from sqlalchemy import Float, select
+
+from models import db, DimDate, DimCompany, FactMarketMetrics, FactReplacement, AggLatestQuote
+from queries import FIELD_COLUMNS
+from refresh_state import (
+    REPLACEMENT_BATCH_SIZE, ensure_state_tables, facts_pending, locked_state, open_cursor,
+    prune_applied_replacements, read_new, read_through, replacement_cursor, replacements_pending, reset
+)
+from schema_cache import schema_cache
+from watermark import bump_data_version, last_replacement_id, replacement_rows
+
+STATE_NAME = 'agg_latest_quote'
+
+# Fact rows scanned per transaction.
+REFRESH_BATCH_SIZE = 50000
+
+# Fact measures copied into the snapshot.
+LATEST_MEASURES = (
+    'current_price', 'change', 'change_percentage', 'day_low', 'day_high', 'volume', 'market_cap',
+    'opening_price', 'previous_close'
+)
+
+LATEST_FIELDS = (
+    'symbol', 'company_name', 'sector', 'industry', 'country', 'datetime', 'current_price', 'change',
+    'change_percentage', 'volume', 'day_low', 'day_high', 'market_cap', 'opening_price', 'previous_close'
+)
+
+# Output field -> snapshot column (company attributes come from dim_company, as in FIELD_COLUMNS).
+LATEST_COLUMNS = {
+    **{name: FIELD_COLUMNS[name] for name in ('symbol', 'company_name', 'sector', 'industry', 'country')},
+    'datetime': AggLatestQuote.trade_datetime,
+    **{
+        name: getattr(AggLatestQuote, name) if name == 'volume' else getattr(AggLatestQuote, name).cast(Float)
+        for name in LATEST_MEASURES
+    },
+}
+
+_table_ready = False
+
+
+def ensure_latest_table():
+    global _table_ready
+    if not _table_ready:
+        ensure_state_tables()
+        AggLatestQuote.__table__.create(db.engine, checkfirst=True)
+        schema_cache.invalidate()
+        _table_ready = True
+
+
+def _assign(row, fact):
+    row.fk_market_metrics_id = fact.sk_market_metrics_id
+    row.trade_datetime = fact.datetime
+    for name in LATEST_MEASURES:
+        setattr(row, name, getattr(fact, name))
+
+
+def _merge(newest):
+    """Replace stored quotes by the fresher facts in ``newest`` ({company id: fact row})."""
+    existing = {
+        row.fk_company_id: row
+        for row in AggLatestQuote.query.filter(AggLatestQuote.fk_company_id.in_(newest))
+    }
+    for company_id, fact in newest.items():
+        row = existing.get(company_id)
+        if row is None:
+            row = AggLatestQuote(fk_company_id=company_id)
+            db.session.add(row)
+        elif fact.datetime < row.trade_datetime:
+            continue
+        _assign(row, fact)
+
+
+def _fact_rows(query_filter, limit=None, newest_first=False):
+    """Fact columns the snapshot copies, in surrogate-key order (newest timestamp first when asked)."""
+    query = db.session.query(
+        FactMarketMetrics.sk_market_metrics_id,
+        FactMarketMetrics.fk_company_id,
+        DimDate.datetime,
+        *[getattr(FactMarketMetrics, name) for name in LATEST_MEASURES]
+    ).join(
+        DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+    ).filter(
+        *query_filter
+    )
+    if newest_first:
+        query = query.order_by(DimDate.datetime.desc(), FactMarketMetrics.sk_market_metrics_id.desc())
+    else:
+        query = query.order_by(FactMarketMetrics.sk_market_metrics_id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def _recompute(replaced, folded):
+    """Re-pick the quote of companies whose newest stored fact may have been replaced.
+
+    A replaced fact older than the stored quote cannot change it. For the
+    others, the quote is chosen again among the facts matching ``folded``
+    (those already read); the others are folded later as usual.
+    """
+    newest = {}
+    for _, company_id, dt in replaced:
+        if company_id is not None and dt is not None and dt > newest.get(company_id, datetime.min):
+            newest[company_id] = dt
+    existing = {
+        row.fk_company_id: row
+        for row in AggLatestQuote.query.filter(AggLatestQuote.fk_company_id.in_(newest))
+    }
+    for company_id, dt in newest.items():
+        row = existing.get(company_id)
+        if row is not None and row.trade_datetime is not None and dt < row.trade_datetime:
+            continue
+        fact = _fact_rows((
+            FactMarketMetrics.fk_company_id == company_id,
+            folded,
+            DimDate.datetime.is_not(None)
+        ), limit=1, newest_first=True)
+        if not fact:
+            if row is not None:
+                db.session.delete(row)
+            continue
+        if row is None:
+            row = AggLatestQuote(fk_company_id=company_id)
+            db.session.add(row)
+        _assign(row, fact[0])
+
+
+def refresh_latest(rebuild=False, batch_size=REFRESH_BATCH_SIZE, max_batches=None):
+    """Fold fact rows loaded since the last refresh into the latest-quote snapshot.
+
+    Keeps one row per company: its fact with the latest timestamp, a later
+    load of the same timestamp replacing the earlier one. Facts are scanned
+    in surrogate-key order under the same locked state rows as the rollups
+    (see refresh_state), and quotes of companies in the fact_replacement
+    log are picked again first. ``max_batches`` caps the transactions run,
+    for refreshes made on a request path. Returns the number of fact rows
+    processed.
+    """
+    ensure_latest_table()
+    state, cursor, must_rebuild = open_cursor(STATE_NAME)
+    if rebuild or must_rebuild:
+        AggLatestQuote.query.delete()
+        reset(state)
+        reset(cursor, last_replacement_id())
+        bump_data_version()
+    db.session.commit()
+
+    processed = batches = 0
+    while max_batches is None or batches < max_batches:
+        state = locked_state(STATE_NAME)
+        cursor = replacement_cursor(STATE_NAME)
+        replaced = read_new(cursor, FactReplacement.id, replacement_rows, REPLACEMENT_BATCH_SIZE)
+        if replaced:
+            _recompute(replaced, read_through(state, FactMarketMetrics.sk_market_metrics_id))
+        rows = read_new(state, FactMarketMetrics.sk_market_metrics_id, _fact_rows, batch_size)
+        if not replaced and not rows:
+            db.session.commit()
+            break
+        if rows:
+            # Rows arrive in key order, so on equal timestamps the later load wins
+            newest = {}
+            for row in rows:
+                if row.fk_company_id is None or row.datetime is None:
+                    continue
+                current = newest.get(row.fk_company_id)
+                if current is None or row.datetime >= current.datetime:
+                    newest[row.fk_company_id] = row
+            if newest:
+                _merge(newest)
+            processed += len(rows)
+        bump_data_version()
+        db.session.commit()
+        batches += 1
+
+    prune_applied_replacements()
+    db.session.commit()
+    return processed
+
+
+def latest_stale():
+    """True when facts or replacements the last refresh has not read exist (or the snapshot was never built)."""
+    ensure_latest_table()
+    return facts_pending(STATE_NAME) or replacements_pending(STATE_NAME)
+
+
+def latest_query(country, sectors=(), symbols=(), fields=LATEST_FIELDS):
+    """Core SELECT of the snapshot, one row per company, ordered by symbol.
+
+    ``symbols`` takes precedence over ``country``; ``sectors`` narrows either.
+    """
+    query = select(
+        *[LATEST_COLUMNS[name].label(name) for name in fields]
+    ).select_from(
+        AggLatestQuote
+    ).join(
+        DimCompany, AggLatestQuote.fk_company_id == DimCompany.sk_company_id
+    )
+    if symbols:
+        query = query.where(DimCompany.symbol.in_(symbols))
+    else:
+        query = query.where(DimCompany.country == country)
+    if sectors:
+        query = query.where(DimCompany.sector.in_(sectors))
+    return query.order_by(DimCompany.symbol)
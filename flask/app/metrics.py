@@ -0,0 +1,214 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from extensions import AppExtension
+from models import db
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram bucket upper bounds (seconds, rows, bytes); +Inf is implicit.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+INF_LABEL = 'le="+Inf"'
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="%s"' % _format_number(bound)
+                yield f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {bucket_count}'
+            yield f'{self.name}_bucket{_format_labels(self.label_names, labels, INF_LABEL)} {count}'
+            yield f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_number(total)}'
+            yield f'{self.name}_count{_format_labels(self.label_names, labels)} {count}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, labels)} {_format_number(value)}'
+
+
+class RequestMetrics:
+    """Per-endpoint latency, stage, row and byte histograms for the serving process.
+
+    Figures are per process: with several gunicorn/uvicorn workers each one
+    exposes its own series and the scraper aggregates them.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.requests = Counter(
+            'stockapi_requests_total', 'Requests served, by endpoint, method and status.',
+            ('endpoint', 'method', 'status')
+        )
+        self.duration = Histogram(
+            'stockapi_request_duration_seconds', 'Time from request start until the response is returned.',
+            ('endpoint',), LATENCY_BUCKETS
+        )
+        self.stages = Histogram(
+            'stockapi_request_stage_seconds',
+            'Time spent per request stage (pool_wait, db_execute, fetch, transform, serialize).',
+            ('endpoint', 'stage'), LATENCY_BUCKETS
+        )
+        self.rows = Histogram(
+            'stockapi_response_rows', 'Rows fetched from the database per request.',
+            ('endpoint',), ROW_BUCKETS
+        )
+        self.bytes = Histogram(
+            'stockapi_response_bytes', 'Size of non-streamed response bodies.',
+            ('endpoint',), BYTE_BUCKETS
+        )
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        self.enabled = bool(app.config['METRICS_ENABLED'])
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @staticmethod
+    def endpoint():
+        """URL rule of the current request; unmatched paths share one label to bound cardinality."""
+        if not has_request_context():
+            return 'none'
+        rule = request.url_rule
+        return rule.rule if rule is not None else 'unmatched'
+
+    def _start(self):
+        g.metrics_started_at = time.perf_counter()
+
+    def _finish(self, response):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None:
+            return response
+        endpoint = self.endpoint()
+        if endpoint == '/metrics':
+            return response
+        self.duration.observe((endpoint,), time.perf_counter() - started_at)
+        self.requests.inc((endpoint, request.method, str(response.status_code)))
+        if not response.is_streamed:
+            self.bytes.observe((endpoint,), response.calculate_content_length() or 0)
+        return response
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as ``name`` for the current endpoint."""
+        if not self.enabled:
+            yield
+            return
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.observe((self.endpoint(), name), time.perf_counter() - started_at)
+
+    def observe_rows(self, count):
+        if self.enabled:
+            self.rows.observe((self.endpoint(),), count)
+
+    def fetch_rows(self, statement):
+        """Execute ``statement`` on the request session and return all rows, timing each stage.
+
+        ``pool_wait`` is the connection checkout (zero when the session
+        already holds one), ``db_execute`` runs the statement and ``fetch``
+        pulls the rows off the cursor.
+        """
+        with self.stage('pool_wait'):
+            db.session.connection()
+        with self.stage('db_execute'):
+            result = db.session.execute(statement)
+        with self.stage('fetch'):
+            rows = result.all()
+        self.observe_rows(len(rows))
+        return rows
+
+    def render(self):
+        """All series in the Prometheus text exposition format."""
+        lines = []
+        for metric in (self.requests, self.duration, self.stages, self.rows, self.bytes):
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        lines.extend(_pool_gauges())
+        return '\n'.join(lines) + '\n'
+
+
+def _pool_gauges():
+    pool = db.engine.pool
+    gauges = []
+    for name, help_text, attribute in (
+        ('stockapi_db_pool_size', 'Configured size of the connection pool.', 'size'),
+        ('stockapi_db_pool_checked_out', 'Connections currently checked out of the pool.', 'checkedout'),
+        ('stockapi_db_pool_overflow', 'Connections open beyond the pool size.', 'overflow'),
+    ):
+        getter = getattr(pool, attribute, None)
+        if getter is None:
+            continue
+        gauges += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {getter()}']
+    return gauges
+
+
+request_metrics = AppExtension('request_metrics', RequestMetrics)
@@ -4,6 +4,9 @@ db = SQLAlchemy()
 
 class DimDate(db.Model):
     __tablename__ = "dim_date"
+    __table_args__ = (
+        db.Index("ix_dim_date_datetime", "datetime"),
+    )
     sk_date_id = db.Column(db.Integer, primary_key=True)
     datetime = db.Column(db.DateTime)
     date = db.Column(db.String(10))
@@ -22,6 +25,9 @@ class DimDate(db.Model):
 
 class DimCompany(db.Model):
     __tablename__ = "dim_company"
+    __table_args__ = (
+        db.Index("ix_dim_company_country_symbol", "country", "symbol"),
+    )
     sk_company_id = db.Column(db.Integer, primary_key=True)
     symbol = db.Column(db.String(50), unique=True, nullable=False)
     beta = db.Column(db.Numeric)
@@ -52,9 +58,15 @@ class DimCompany(db.Model):
 
 class FactMarketMetrics(db.Model):
     __tablename__ = "fact_market_metrics"
+    __table_args__ = (
+        db.Index("ix_fact_market_metrics_company_date", "fk_company_id", "fk_date_id"),
+        db.Index("ix_fact_market_metrics_trade_datetime", "trade_datetime", "fk_company_id"),
+    )
     sk_market_metrics_id = db.Column(db.Integer, primary_key=True)
     fk_company_id = db.Column(db.Integer, db.ForeignKey("dim_company.sk_company_id"))
     fk_date_id = db.Column(db.Integer, db.ForeignKey("dim_date.sk_date_id"))
+    # Copy of DimDate.datetime so date filters (and partition pruning) apply to the fact table itself
+    trade_datetime = db.Column(db.DateTime)
     fk_exchange_id = db.Column(db.Integer, db.ForeignKey("dim_exchange.sk_exchange_id"))
     fk_commodity_id = db.Column(db.Integer, db.ForeignKey("dim_commodity.sk_commodity_id"))
     fk_index_id = db.Column(db.Integer, db.ForeignKey("dim_index.sk_index_id"))
@@ -77,3 +89,71 @@ class FactMarketMetrics(db.Model):
     eps = db.Column(db.Numeric)
     pe = db.Column(db.Numeric)
     shares_outstanding = db.Column(db.BigInteger)
+
+class DataVersion(db.Model):
+    __tablename__ = "data_version"
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+@db.event.listens_for(FactMarketMetrics, "before_insert")
+def fill_trade_datetime(mapper, connection, target):
+    if target.trade_datetime is None and target.fk_date_id is not None:
+        target.trade_datetime = connection.scalar(
+            db.select(DimDate.datetime).where(DimDate.sk_date_id == target.fk_date_id)
+        )
+
+class AggMarketRollup(db.Model):
+    __tablename__ = "agg_market_rollup"
+    grain = db.Column(db.String(10), primary_key=True)
+    fk_company_id = db.Column(db.Integer, db.ForeignKey("dim_company.sk_company_id"), primary_key=True)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    period = db.Column(db.String(10))
+    first_datetime = db.Column(db.DateTime)
+    last_datetime = db.Column(db.DateTime)
+    open_price = db.Column(db.Numeric)
+    close_price = db.Column(db.Numeric)
+    low_price = db.Column(db.Numeric)
+    high_price = db.Column(db.Numeric)
+    volume = db.Column(db.BigInteger)
+    market_cap_sum = db.Column(db.Numeric)
+    market_cap_count = db.Column(db.Integer)
+    record_count = db.Column(db.Integer)
+
+class FactReplacement(db.Model):
+    __tablename__ = "fact_replacement"
+    # Ids must never be reused once pruned: consumers keep their position in the log by id
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    fk_company_id = db.Column(db.Integer)
+    trade_datetime = db.Column(db.DateTime)
+
+class AggLatestQuote(db.Model):
+    __tablename__ = "agg_latest_quote"
+    fk_company_id = db.Column(db.Integer, db.ForeignKey("dim_company.sk_company_id"), primary_key=True)
+    fk_market_metrics_id = db.Column(db.Integer)
+    trade_datetime = db.Column(db.DateTime)
+    current_price = db.Column(db.Numeric)
+    change = db.Column(db.Numeric)
+    change_percentage = db.Column(db.Numeric)
+    day_low = db.Column(db.Numeric)
+    day_high = db.Column(db.Numeric)
+    volume = db.Column(db.BigInteger)
+    market_cap = db.Column(db.Numeric)
+    opening_price = db.Column(db.Numeric)
+    previous_close = db.Column(db.Numeric)
+
+class AggRollupState(db.Model):
+    __tablename__ = "agg_rollup_state"
+    name = db.Column(db.String(50), primary_key=True)
+    last_fact_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+class AggRefreshGap(db.Model):
+    __tablename__ = "agg_refresh_gap"
+    id = db.Column(db.Integer, primary_key=True)
+    # agg_rollup_state row whose read skipped these ids
+    name = db.Column(db.String(50))
+    low_id = db.Column(db.Integer, nullable=False)
+    high_id = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False)
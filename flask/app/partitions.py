@@ -0,0 +1,292 @@
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+
+from models import db, DimDate, FactMarketMetrics
+from provisioning import partitioned
+from schema_cache import schema_cache
+
+FACT_TABLE = FactMarketMetrics.__tablename__
+DEFAULT_PARTITION = f"{FACT_TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{FACT_TABLE}_(\d{{4}})(\d{{2}})$")
+
+# Rows back-filled per UPDATE by `flask trade-datetime-backfill`.
+BACKFILL_BATCH_SIZE = 50000
+
+FILL_TRIGGER = f"{FACT_TABLE}_trade_datetime"
+
+# Fills trade_datetime from dim_date for loaders that only write fk_date_id.
+TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {FILL_TRIGGER}() RETURNS trigger AS $$
+BEGIN
+    IF NEW.trade_datetime IS NULL THEN
+        SELECT datetime INTO NEW.trade_datetime FROM dim_date WHERE sk_date_id = NEW.fk_date_id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# SQLite triggers cannot assign NEW, so the row is updated right after its insert.
+SQLITE_TRIGGER_SQL = f"""
+CREATE TRIGGER IF NOT EXISTS {FILL_TRIGGER} AFTER INSERT ON {FACT_TABLE}
+WHEN NEW.trade_datetime IS NULL
+BEGIN
+    UPDATE {FACT_TABLE} SET trade_datetime = (SELECT datetime FROM dim_date WHERE sk_date_id = NEW.fk_date_id)
+    WHERE sk_market_metrics_id = NEW.sk_market_metrics_id;
+END
+"""
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{FACT_TABLE}_{month.year}{month.month:02d}"
+
+
+def ensure_trade_datetime():
+    """Add fact_market_metrics.trade_datetime and its fill-in trigger when they are missing.
+
+    The column is a copy of the fact's DimDate.datetime so date filters can
+    be applied to the fact table itself. A trigger keeps it filled for
+    loaders that only set fk_date_id, on SQLite and on an unpartitioned
+    PostgreSQL table; a partitioned table routes rows on it before any
+    trigger runs, so there fact_window() matches NULL rows through
+    dim_date instead. Only catalog lookups run once both exist. Rows
+    stored before the column was added keep NULL until
+    backfill_trade_datetime() (`flask trade-datetime-backfill`) runs.
+    Returns True when the column was added.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    if FACT_TABLE not in inspector.get_table_names():
+        return False
+    added = 'trade_datetime' not in {column['name'] for column in inspector.get_columns(FACT_TABLE)}
+    if added:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {FACT_TABLE} ADD COLUMN trade_datetime TIMESTAMP"))
+        schema_cache.invalidate()
+        logging.warning(f"Added {FACT_TABLE}.trade_datetime; run `flask trade-datetime-backfill` to fill existing rows")
+
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            if not has_fill_trigger(conn):
+                conn.execute(text(SQLITE_TRIGGER_SQL))
+        elif engine.dialect.name == 'postgresql' and not is_partitioned(conn) and not has_fill_trigger(conn):
+            conn.execute(text(TRIGGER_SQL))
+            conn.execute(text(
+                f"CREATE TRIGGER {FILL_TRIGGER} BEFORE INSERT ON {FACT_TABLE} "
+                f"FOR EACH ROW EXECUTE FUNCTION {FILL_TRIGGER}()"
+            ))
+            logging.info(f"Created trigger {FILL_TRIGGER}")
+    return added
+
+
+def has_fill_trigger(conn):
+    if conn.dialect.name == 'sqlite':
+        return conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+        ), {"name": FILL_TRIGGER}).first() is not None
+    return conn.execute(text(
+        "SELECT 1 FROM pg_trigger WHERE tgrelid = CAST(:table AS regclass) AND tgname = :name"
+    ), {"table": FACT_TABLE, "name": FILL_TRIGGER}).first() is not None
+
+
+def backfill_trade_datetime(batch_size=BACKFILL_BATCH_SIZE):
+    """Copy DimDate.datetime into facts whose trade_datetime is NULL, one key range per transaction.
+
+    On a partitioned table the update moves the rows out of the default
+    partition. Returns the rows back-filled.
+    """
+    fact = FactMarketMetrics.__table__
+    with db.engine.connect() as conn:
+        missing = select(fact.c.sk_market_metrics_id).where(fact.c.trade_datetime.is_(None)).limit(1)
+        if conn.execute(missing).first() is None:
+            return 0
+        low, high = conn.execute(
+            select(func.min(fact.c.sk_market_metrics_id), func.max(fact.c.sk_market_metrics_id))
+            .where(fact.c.trade_datetime.is_(None))
+        ).one()
+
+    updated = 0
+    trade_datetime = select(DimDate.datetime).where(DimDate.sk_date_id == fact.c.fk_date_id).scalar_subquery()
+    for start in range(low, high + 1, batch_size):
+        with db.engine.begin() as conn:
+            updated += conn.execute(fact.update().where(
+                fact.c.sk_market_metrics_id.between(start, start + batch_size - 1),
+                fact.c.trade_datetime.is_(None)
+            ).values(trade_datetime=trade_datetime)).rowcount
+    logging.info(f"Back-filled trade_datetime on {updated} fact rows")
+    return updated
+
+
+def is_partitioned(conn):
+    return conn.dialect.name == 'postgresql' and partitioned(conn, FACT_TABLE)
+
+
+def monthly_partitions(conn):
+    """{month start: partition name} of the attached monthly partitions."""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": FACT_TABLE}).scalars()
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def create_partition(conn, month):
+    """Create the partition for ``month``, moving any of its rows out of the default partition first."""
+    name = partition_name(month)
+    bounds = {"lower": month, "upper": add_months(month, 1)}
+    moved = conn.execute(text(
+        f"SELECT count(*) FROM {DEFAULT_PARTITION} WHERE trade_datetime >= :lower AND trade_datetime < :upper"
+    ), bounds).scalar()
+    if not moved:
+        conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {FACT_TABLE} "
+            f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+        ))
+        return name, 0
+
+    # The default partition already holds rows for this month: attach only once they have moved
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {FACT_TABLE} INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE trade_datetime >= :lower AND trade_datetime < :upper RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {FACT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+    ))
+    return name, moved
+
+
+def ensure_partitions(months_ahead=3, retention_months=None, now=None):
+    """Create monthly partitions through ``months_ahead`` months from now and detach expired ones.
+
+    Months that already have rows in the default partition (back-fills,
+    late data) get their own partition too. With ``retention_months`` set,
+    partitions ending before that many months ago are detached, not
+    dropped, so they can be archived. No-op unless the table is partitioned.
+    Returns {'created': [...], 'detached': [...], 'moved_rows': n}.
+    """
+    result = {'created': [], 'detached': [], 'moved_rows': 0}
+    current = month_start(now or datetime.now())
+    cutoff = add_months(current, -retention_months) if retention_months else None
+    with db.engine.begin() as conn:
+        if not is_partitioned(conn):
+            return result
+        existing = monthly_partitions(conn)
+        wanted = {add_months(current, offset) for offset in range(months_ahead + 1)}
+        wanted.update(month_start(dt) for dt in conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', trade_datetime) FROM {DEFAULT_PARTITION} "
+            f"WHERE trade_datetime IS NOT NULL"
+        )).scalars())
+        for month in sorted(wanted - set(existing)):
+            if cutoff is not None and add_months(month, 1) <= cutoff:
+                continue  # late rows for an expired month stay in the default partition
+            name, moved = create_partition(conn, month)
+            result['created'].append(name)
+            result['moved_rows'] += moved
+
+        if cutoff is not None:
+            for month, name in sorted(existing.items()):
+                if add_months(month, 1) <= cutoff:
+                    conn.execute(text(f"ALTER TABLE {FACT_TABLE} DETACH PARTITION {name}"))
+                    result['detached'].append(name)
+    if result['created'] or result['detached']:
+        schema_cache.invalidate()
+        logging.info(f"Partitions created: {result['created']}, detached: {result['detached']}")
+    return result
+
+
+def convert_to_partitioned(months_ahead=3):
+    """Rebuild fact_market_metrics as a table range-partitioned by month on trade_datetime (PostgreSQL).
+
+    The existing table is renamed to ``<table>_unpartitioned`` and kept;
+    its rows are copied into one partition per month (plus a default
+    partition for timestamps outside them, and for facts whose
+    trade_datetime is still NULL because their dim_date row is missing).
+    Indexes, foreign keys and the id sequence move to the new table; the
+    primary key becomes a unique (sk_market_metrics_id, trade_datetime)
+    constraint, since a primary key would forbid those NULL keys. Run it in a
+    maintenance window: the copy holds an exclusive lock on the facts.
+    Returns the partitions created.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        raise RuntimeError("Partitioning is only supported on PostgreSQL")
+    ensure_trade_datetime()
+    backfill_trade_datetime()
+    legacy = f"{FACT_TABLE}_unpartitioned"
+
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            raise RuntimeError(f"{FACT_TABLE} is already partitioned")
+        conn.execute(text(f"LOCK TABLE {FACT_TABLE} IN ACCESS EXCLUSIVE MODE"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'sk_market_metrics_id')"),
+                                {"table": FACT_TABLE}).scalar()
+        foreign_keys = conn.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+        ), {"table": FACT_TABLE}).all()
+        bounds = conn.execute(text(f"SELECT min(trade_datetime), max(trade_datetime) FROM {FACT_TABLE}")).one()
+
+        # trade_datetime becomes the partition key, so inserts must set it; the fill-in trigger goes
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {FILL_TRIGGER} ON {FACT_TABLE}"))
+        conn.execute(text(f"ALTER TABLE {FACT_TABLE} RENAME TO {legacy}"))
+        for index in inspect(conn).get_indexes(legacy):
+            conn.execute(text(f"ALTER INDEX {index['name']} RENAME TO {index['name']}_unpartitioned"))
+        primary_key = conn.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"
+        ), {"table": legacy}).scalar()
+        if primary_key:
+            # Names the old table's key after the table, like its renamed indexes
+            conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {primary_key} TO {legacy}_pkey"))
+        conn.execute(text(
+            f"CREATE TABLE {FACT_TABLE} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (trade_datetime)"
+        ))
+        conn.execute(text(
+            f"ALTER TABLE {FACT_TABLE} ADD CONSTRAINT {FACT_TABLE}_id_key UNIQUE (sk_market_metrics_id, trade_datetime)"
+        ))
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {FACT_TABLE} DEFAULT"))
+
+        first = month_start(bounds[0]) if bounds[0] else month_start(datetime.now())
+        last = add_months(month_start(max(bounds[1] or datetime.now(), datetime.now())), months_ahead)
+        created = []
+        month = first
+        while month <= last:
+            name, _ = create_partition(conn, month)
+            created.append(name)
+            month = add_months(month, 1)
+
+        # NULL partition keys are routed to the default partition
+        conn.execute(text(f"INSERT INTO {FACT_TABLE} SELECT * FROM {legacy}"))
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {FACT_TABLE}.sk_market_metrics_id"))
+        for name, definition in foreign_keys:
+            conn.execute(text(f"ALTER TABLE {FACT_TABLE} ADD CONSTRAINT {name} {definition}"))
+        for index in FactMarketMetrics.__table__.indexes:
+            columns = ', '.join(column.name for column in index.columns)
+            conn.execute(text(f"CREATE INDEX {index.name} ON {FACT_TABLE} ({columns})"))
+        unmatched = conn.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION} WHERE trade_datetime IS NULL")).scalar()
+
+    if unmatched:
+        logging.warning(f"{unmatched} facts without a dim_date row were copied into {DEFAULT_PARTITION}")
+    schema_cache.invalidate()
+    logging.info(f"Partitioned {FACT_TABLE} into {len(created)} monthly partitions; old table kept as {legacy}")
+    return created
@@ -0,0 +1,55 @@
+import logging
+
+from sqlalchemy import inspect, text
+
+from models import db, DimDate, DimCompany, FactMarketMetrics
+from schema_cache import schema_cache
+
+# Tables whose declared indexes are created at startup when missing.
+PROVISIONED_MODELS = (FactMarketMetrics, DimDate, DimCompany)
+
+
+def partitioned(conn, table_name):
+    """True for a PostgreSQL partitioned table (whose indexes cannot be built CONCURRENTLY)."""
+    return bool(conn.execute(text(
+        "SELECT c.relkind = 'p' FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relname = :table"
+    ), {"table": table_name}).scalar())
+
+
+def ensure_indexes(engine=None):
+    """Create any index declared on the star-schema models that the database lacks.
+
+    Tables that do not exist yet are skipped. On PostgreSQL indexes are built
+    with CREATE INDEX CONCURRENTLY so the fact table stays writable (except
+    on a partitioned table, where the parent index is built per partition).
+    Returns the names of the indexes created.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    created = []
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for model in PROVISIONED_MODELS:
+            table = model.__table__
+            if table.name not in existing_tables:
+                continue
+            present = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name in present:
+                    continue
+                if engine.dialect.name == 'postgresql' and not partitioned(conn, table.name):
+                    columns = ', '.join(preparer.quote(column.name) for column in index.columns)
+                    conn.execute(text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {preparer.quote(index.name)} "
+                        f"ON {preparer.format_table(table)} ({columns})"
+                    ))
+                else:
+                    index.create(bind=conn, checkfirst=True)
+                logging.info(f"Created index {index.name} on {table.name}")
+                created.append(index.name)
+    if created:
+        schema_cache.invalidate()
+    return created
@@ -0,0 +1,279 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import Float, and_, func, or_, select, tuple_
+
+from models import db, DimDate, DimCompany, FactMarketMetrics
+
+
+def parse_date_window(args, earliest=None, default_days='60'):
+    """Resolve the days/from/to query parameters into a (from, to) datetime pair.
+
+    ``days=all`` starts the window at ``earliest()`` when a callable is given,
+    otherwise at 1900-01-01. Unparseable values fall back to a 60 day window.
+    """
+    days = args.get('days', default_days)
+    to_date = args.get('to', datetime.now().strftime('%Y-%m-%d'))
+    from_date = args.get('from', None)
+
+    try:
+        to_datetime = datetime.strptime(to_date, '%Y-%m-%d')
+    except ValueError:
+        to_datetime = datetime.now()
+
+    if from_date is None:
+        if days.lower() == 'all':
+            from_datetime = earliest() if earliest else datetime(1900, 1, 1)
+        else:
+            try:
+                from_datetime = to_datetime - timedelta(days=int(days))
+            except ValueError:
+                from_datetime = to_datetime - timedelta(days=60)
+    else:
+        try:
+            from_datetime = datetime.strptime(from_date, '%Y-%m-%d')
+        except ValueError:
+            from_datetime = to_datetime - timedelta(days=60)
+
+    return from_datetime, to_datetime
+
+
+def earliest_date():
+    oldest_record = DimDate.query.order_by(DimDate.datetime.asc()).first()
+    return oldest_record.datetime if oldest_record else datetime(1900, 1, 1)
+
+
+# Output field -> column expression. Numeric columns are cast to float in SQL,
+# so the driver returns floats and rows need no per-field conversion.
+FIELD_COLUMNS = {
+    'symbol': DimCompany.symbol,
+    'company_name': DimCompany.company_name,
+    'sector': DimCompany.sector,
+    'industry': DimCompany.industry,
+    'country': DimCompany.country,
+    'date': DimDate.date,
+    'datetime': DimDate.datetime,
+    'current_price': FactMarketMetrics.current_price.cast(Float),
+    'change': FactMarketMetrics.change.cast(Float),
+    'change_percentage': FactMarketMetrics.change_percentage.cast(Float),
+    'volume': FactMarketMetrics.volume,
+    'day_low': FactMarketMetrics.day_low.cast(Float),
+    'day_high': FactMarketMetrics.day_high.cast(Float),
+    'market_cap': FactMarketMetrics.market_cap.cast(Float),
+    'opening_price': FactMarketMetrics.opening_price.cast(Float),
+    'previous_close': FactMarketMetrics.previous_close.cast(Float),
+    'year_high': FactMarketMetrics.year_high.cast(Float),
+    'year_low': FactMarketMetrics.year_low.cast(Float),
+    'price_average_50': FactMarketMetrics.price_average_50.cast(Float),
+    'price_average_200': FactMarketMetrics.price_average_200.cast(Float),
+    'average_volume': FactMarketMetrics.average_volume,
+    'eps': FactMarketMetrics.eps.cast(Float),
+    'pe': FactMarketMetrics.pe.cast(Float),
+    'shares_outstanding': FactMarketMetrics.shares_outstanding,
+}
+
+# Fields whose database value is not already JSON-ready.
+FIELD_CONVERTERS = {
+    'datetime': datetime.isoformat,
+}
+
+MARKET_FIELDS = (
+    'symbol', 'company_name', 'sector', 'industry', 'date', 'datetime', 'current_price',
+    'change', 'change_percentage', 'volume', 'day_low', 'day_high', 'market_cap'
+)
+STOCK_FIELDS = MARKET_FIELDS[:4] + ('country',) + MARKET_FIELDS[4:]
+COMPANY_FIELDS = ('company_name', 'sector', 'industry', 'country')
+SERIES_FIELDS = MARKET_FIELDS[4:]
+
+
+def parse_fields(value, default):
+    """Validate a comma-separated ``fields`` parameter against FIELD_COLUMNS.
+
+    Returns ``default`` when the parameter is absent or empty, otherwise the
+    requested names in order without duplicates. Raises ValueError naming
+    the first unknown field.
+    """
+    fields = tuple(dict.fromkeys(name.strip() for name in (value or '').split(',') if name.strip()))
+    for name in fields:
+        if name not in FIELD_COLUMNS:
+            raise ValueError(f"Unknown field '{name}'; fields must be among: {', '.join(FIELD_COLUMNS)}")
+    return fields or default
+
+
+def _uses(fields, model):
+    """Whether any of ``fields`` is a column of ``model``'s table (and so needs it joined)."""
+    return any(getattr(FIELD_COLUMNS[name], 'table', None) is model.__table__ for name in fields)
+
+
+def row_converter(fields):
+    """Build a function turning a result row (in ``fields`` order) into an output dict.
+
+    Conversions are resolved once per field list rather than per value; any
+    extra trailing columns in the row (e.g. keyset keys) are ignored.
+    """
+    names = tuple(fields)
+    converters = tuple((i, FIELD_CONVERTERS[name]) for i, name in enumerate(names) if name in FIELD_CONVERTERS)
+
+    if not converters:
+        def convert(row):
+            return dict(zip(names, row))
+        return convert
+
+    def convert(row):
+        values = list(row)
+        for i, converter in converters:
+            value = values[i]
+            if value is not None:
+                values[i] = converter(value)
+        return dict(zip(names, values))
+    return convert
+
+
+# A fact's time for ordering and keyset seeks: trade_datetime, or its dim_date row's while that is
+# still NULL. The dim_date lookup only runs for those rows, so a back-filled table never joins it.
+FACT_DATETIME = func.coalesce(
+    FactMarketMetrics.trade_datetime,
+    select(DimDate.datetime).where(DimDate.sk_date_id == FactMarketMetrics.fk_date_id)
+    .correlate(FactMarketMetrics).scalar_subquery()
+)
+
+
+def fact_window(from_datetime, to_datetime):
+    """Date predicate on the fact table's own trade_datetime, which lets PostgreSQL prune partitions.
+
+    Facts whose trade_datetime is still NULL (stored before the column was
+    back-filled, or loaded into a partitioned table without it) are matched
+    through their dim_date row instead, and FACT_DATETIME keeps them in
+    time order until `flask trade-datetime-backfill` runs.
+    """
+    return or_(
+        FactMarketMetrics.trade_datetime.between(from_datetime, to_datetime),
+        and_(
+            FactMarketMetrics.trade_datetime.is_(None),
+            FactMarketMetrics.fk_date_id.in_(
+                select(DimDate.sk_date_id).where(DimDate.datetime.between(from_datetime, to_datetime))
+            )
+        )
+    )
+
+
+def _select_fields(fields):
+    return [FIELD_COLUMNS[name].label(name) for name in fields]
+
+
+def market_query(country, from_datetime, to_datetime, fields=MARKET_FIELDS):
+    """Core SELECT of ``fields`` for one country, ordered by symbol and time.
+
+    The statement also selects the keyset columns (symbol, datetime, fact id)
+    after the requested fields; the fact surrogate key breaks ties so the
+    order is total, which keyset pagination relies on. Time is the fact's
+    FACT_DATETIME, so dim_date is joined only when ``fields`` include date
+    columns; dim_company is always joined for the country and symbol.
+    """
+    query = select(
+        *_select_fields(fields),
+        DimCompany.symbol.label('_symbol'),
+        FACT_DATETIME.label('_datetime'),
+        FactMarketMetrics.sk_market_metrics_id.label('_sk')
+    ).select_from(
+        FactMarketMetrics
+    ).join(
+        DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
+    ).where(
+        DimCompany.country == country,
+        fact_window(from_datetime, to_datetime)
+    )
+    if _uses(fields, DimDate):
+        query = query.join(
+            DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+        ).where(
+            DimDate.datetime.between(from_datetime, to_datetime)
+        )
+    return query.order_by(
+        DimCompany.symbol, FACT_DATETIME, FactMarketMetrics.sk_market_metrics_id
+    )
+
+
+def encode_cursor(row):
+    """Opaque token for the (symbol, datetime, fact id) position of a market_query row."""
+    key = [row._symbol, row._datetime.isoformat() if row._datetime else None, row._sk]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor. Raises ValueError for malformed tokens."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        symbol, dt, sk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(symbol), datetime.fromisoformat(dt), int(sk)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
+
+def seek_after(query, cursor):
+    """Restrict a market_query to rows strictly after the decoded cursor position."""
+    symbol, dt, sk = cursor
+    return query.where(
+        tuple_(DimCompany.symbol, FACT_DATETIME, FactMarketMetrics.sk_market_metrics_id) > tuple_(symbol, dt, sk)
+    )
+
+
+def stock_query(ticker, from_datetime, to_datetime, fields=STOCK_FIELDS):
+    """Core SELECT of ``fields`` for one ticker, ordered by time.
+
+    Each dimension is joined only when ``fields`` include its columns; a
+    fact-only projection resolves the ticker in a subquery and filters on
+    trade_datetime, reading fact_market_metrics alone.
+    """
+    query = select(
+        *_select_fields(fields)
+    ).select_from(
+        FactMarketMetrics
+    ).where(
+        fact_window(from_datetime, to_datetime)
+    )
+    if _uses(fields, DimCompany):
+        query = query.join(
+            DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
+        ).where(DimCompany.symbol == ticker)
+    else:
+        query = query.where(FactMarketMetrics.fk_company_id.in_(
+            select(DimCompany.sk_company_id).where(DimCompany.symbol == ticker)
+        ))
+    if _uses(fields, DimDate):
+        query = query.join(
+            DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+        ).where(DimDate.datetime.between(from_datetime, to_datetime))
+    return query.order_by(FACT_DATETIME, FactMarketMetrics.sk_market_metrics_id)
+
+
+def stocks_query(tickers, from_datetime, to_datetime, fields=STOCK_FIELDS):
+    """Core SELECT of ``fields`` for many tickers in one round-trip, ordered by symbol and time."""
+    return select(
+        *_select_fields(fields)
+    ).select_from(
+        FactMarketMetrics
+    ).join(
+        DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+    ).join(
+        DimCompany, FactMarketMetrics.fk_company_id == DimCompany.sk_company_id
+    ).where(
+        DimCompany.symbol.in_(tickers),
+        fact_window(from_datetime, to_datetime),
+        DimDate.datetime.between(from_datetime, to_datetime)
+    ).order_by(
+        DimCompany.symbol, DimDate.datetime
+    )
+
+
+def group_by_symbol(rows):
+    """Group STOCK_FIELDS dicts into {symbol: {company attributes..., 'data': [series rows]}}."""
+    grouped = {}
+    for row in rows:
+        entry = grouped.get(row['symbol'])
+        if entry is None:
+            entry = grouped[row['symbol']] = {name: row[name] for name in COMPANY_FIELDS}
+            entry['data'] = []
+        entry['data'].append({name: row[name] for name in SERIES_FIELDS})
+    return grouped
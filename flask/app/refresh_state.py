@@ -0,0 +1,195 @@
+"""Positions of the derived tables (rollups, latest quotes, series store) in the facts and the replacement log.
+
+Each consumer keeps, in agg_rollup_state, the highest fact id it has read
+and, under ``<name>.replaced``, its position in the fact_replacement log.
+Both ids come from sequences, which hand them out when a row is inserted,
+not when its transaction commits: with concurrent PostgreSQL loaders a
+lower id can become visible after a higher one was read. Ids a read
+skipped are therefore kept in agg_refresh_gap and read again until their
+rows show up, or until they are older than REFRESH_LATE_COMMIT_SECONDS,
+the longest a loader transaction is expected to stay open (rolled-back
+loads and facts deleted before the read leave gaps that never fill).
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, not_, or_, select
+
+from models import db, AggRefreshGap, AggRollupState
+from schema_cache import schema_cache
+from watermark import PRUNED_NAME, data_version, last_replacement_id, prune_replacements
+
+# Suffix of the agg_rollup_state rows holding each consumer's position in the fact_replacement log.
+CURSOR_SUFFIX = '.replaced'
+
+# fact_replacement rows applied per transaction.
+REPLACEMENT_BATCH_SIZE = 1000
+# Gap ranges per OR'ed id predicate when gaps are read again.
+GAP_QUERY_SIZE = 500
+
+_tables_ready = False
+
+
+def ensure_state_tables():
+    global _tables_ready
+    if not _tables_ready:
+        for model in (AggRollupState, AggRefreshGap):
+            model.__table__.create(db.engine, checkfirst=True)
+        schema_cache.invalidate()
+        _tables_ready = True
+
+
+def locked_state(name, start=0):
+    """``name``'s state row, locked for the transaction (created at position ``start``)."""
+    ensure_state_tables()
+    state = db.session.query(AggRollupState).filter_by(name=name).with_for_update().first()
+    if state is None:
+        state = AggRollupState(name=name, last_fact_id=start)
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+
+def replacement_cursor(name, start=0):
+    """Locked state row of ``name``'s fact_replacement position, created at ``start``."""
+    return locked_state(f"{name}{CURSOR_SUFFIX}", start)
+
+
+def open_cursor(name):
+    """Lock ``name``'s state and replacement cursor; returns (state, cursor, must_rebuild).
+
+    A table that has not folded any fact yet starts at the end of the log,
+    since its first pass reads the corrected facts anyway. One whose
+    position was pruned away has missed corrections and must be rebuilt.
+    """
+    state = locked_state(name)
+    cursor = replacement_cursor(name, 0 if state.last_fact_id else last_replacement_id())
+    return state, cursor, cursor.last_fact_id < data_version(PRUNED_NAME)
+
+
+def reset(state, position=0):
+    """Move ``state`` to ``position`` and forget its gaps, for a rebuild."""
+    db.session.execute(delete(AggRefreshGap).where(AggRefreshGap.name == state.name))
+    state.last_fact_id = position
+    state.updated_at = datetime.now()
+
+
+def late_commit_seconds():
+    return current_app.config['REFRESH_LATE_COMMIT_SECONDS']
+
+
+def open_gaps(name, now=None):
+    """``name``'s (low id, high id, recorded_at) gaps not yet given up on, lowest first."""
+    ensure_state_tables()
+    since = (now or datetime.now()) - timedelta(seconds=late_commit_seconds())
+    return [tuple(gap) for gap in db.session.query(
+        AggRefreshGap.low_id, AggRefreshGap.high_id, AggRefreshGap.recorded_at
+    ).filter(
+        AggRefreshGap.name == name, AggRefreshGap.recorded_at >= since
+    ).order_by(AggRefreshGap.low_id)]
+
+
+def in_gaps(column, gaps):
+    return or_(*[column.between(low, high) for low, high, _ in gaps])
+
+
+def skipped_ranges(after_id, ids):
+    """(first, last) id ranges missing between ``after_id`` and the sorted ``ids``."""
+    ranges, previous = [], after_id
+    for i in ids:
+        if i > previous + 1:
+            ranges.append((previous + 1, i - 1))
+        previous = max(previous, i)
+    return ranges
+
+
+def advance_gaps(gaps, after_id, found, now):
+    """Gaps left after a read that found the sorted ids ``found``.
+
+    Ids found inside ``gaps`` split them, keeping their recorded_at; ids
+    skipped between ``after_id`` and the last id found past it open new
+    gaps recorded at ``now``.
+    """
+    remaining = []
+    for low, high, recorded_at in gaps:
+        inside = [i for i in found if low <= i <= high]
+        remaining += [(first, last, recorded_at) for first, last in skipped_ranges(low - 1, inside + [high + 1])]
+    remaining += [(first, last, now) for first, last in skipped_ranges(after_id, [i for i in found if i > after_id])]
+    return sorted(remaining)
+
+
+def read_new(state, column, fetch, limit=None):
+    """Rows past ``state``'s position, plus rows that have since appeared in its gaps, by id.
+
+    ``fetch(criteria, limit)`` returns rows whose first value is ``column``.
+    Moves the position to the last row read and updates the gaps, in the
+    caller's transaction (which must hold ``state`` locked).
+    """
+    now = datetime.now()
+    gaps = open_gaps(state.name, now)
+    late = []
+    for start in range(0, len(gaps), GAP_QUERY_SIZE):
+        late += fetch((in_gaps(column, gaps[start:start + GAP_QUERY_SIZE]),), None)
+    rows = fetch((column > state.last_fact_id,), limit)
+    if not late and not rows and not gaps:
+        return []
+
+    found = sorted(row[0] for row in late + rows)
+    db.session.execute(delete(AggRefreshGap).where(AggRefreshGap.name == state.name))
+    db.session.add_all([
+        AggRefreshGap(name=state.name, low_id=low, high_id=high, recorded_at=recorded_at)
+        for low, high, recorded_at in advance_gaps(gaps, state.last_fact_id, found, now)
+    ])
+    if rows:
+        state.last_fact_id = rows[-1][0]
+    if late or rows:
+        state.updated_at = now
+    return late + rows
+
+
+def read_through(state, column):
+    """Criterion for the ids ``state`` has read: up to its position and outside its open gaps."""
+    gaps = open_gaps(state.name)
+    return and_(column <= state.last_fact_id, *[not_(column.between(low, high)) for low, high, _ in gaps])
+
+
+def has_late_rows(name, column):
+    """True when rows have appeared in ``name``'s open gaps."""
+    gaps = open_gaps(name)
+    for start in range(0, len(gaps), GAP_QUERY_SIZE):
+        if db.session.execute(select(column).where(in_gaps(column, gaps[start:start + GAP_QUERY_SIZE])).limit(1)).first():
+            return True
+    return False
+
+
+def prune_applied_replacements():
+    """Delete fact_replacement rows that every consumer with a cursor has applied.
+
+    A consumer has applied the log up to its position, except for ids still
+    open in its gaps.
+    """
+    applied = None
+    for cursor in db.session.query(AggRollupState).filter(AggRollupState.name.like(f"%{CURSOR_SUFFIX}")):
+        gaps = open_gaps(cursor.name)
+        position = min(cursor.last_fact_id, gaps[0][0] - 1) if gaps else cursor.last_fact_id
+        applied = position if applied is None else min(applied, position)
+    if applied:
+        prune_replacements(applied)
+
+
+def replacements_pending(name):
+    """True when fact_replacement holds rows past ``name``'s cursor or in its gaps (or it has none yet)."""
+    from models import FactReplacement
+
+    cursor = db.session.get(AggRollupState, f"{name}{CURSOR_SUFFIX}")
+    return (cursor is None or last_replacement_id() > cursor.last_fact_id
+            or has_late_rows(cursor.name, FactReplacement.id))
+
+
+def facts_pending(name):
+    """True when facts past ``name``'s position or in its gaps exist (or it has never read any)."""
+    from models import FactMarketMetrics
+
+    state = db.session.get(AggRollupState, name)
+    max_id = db.session.query(func.max(FactMarketMetrics.sk_market_metrics_id)).scalar() or 0
+    return state is None or max_id > state.last_fact_id or has_late_rows(name, FactMarketMetrics.sk_market_metrics_id)
@@ -0,0 +1,330 @@
+from datetime import datetime, timedelta
+
+from models import db, DimDate, DimCompany, FactMarketMetrics, FactReplacement, AggMarketRollup
+from refresh_state import (
+    REPLACEMENT_BATCH_SIZE, ensure_state_tables, facts_pending, locked_state, open_cursor,
+    prune_applied_replacements, read_new, read_through, replacement_cursor, replacements_pending, reset
+)
+from schema_cache import schema_cache
+from watermark import bump_data_version, last_replacement_id, replacement_rows
+
+GRAINS = ('day', 'week', 'month', 'quarter')
+STATE_NAME = 'agg_market_rollup'
+
+# Fact rows folded into the rollups per transaction.
+REFRESH_BATCH_SIZE = 50000
+
+
+def period_bucket(grain, dt):
+    """Return (period_start, label) of the ``grain`` bucket containing ``dt``.
+
+    Weeks are ISO weeks (Monday start) so a week spanning New Year stays one bucket.
+    """
+    day = datetime(dt.year, dt.month, dt.day)
+    if grain == 'day':
+        return day, day.strftime('%Y-%m-%d')
+    if grain == 'week':
+        iso = dt.isocalendar()
+        return day - timedelta(days=iso[2] - 1), f"{iso[0]}-W{iso[1]:02d}"
+    if grain == 'month':
+        return datetime(dt.year, dt.month, 1), f"{dt.year}-{dt.month:02d}"
+    if grain == 'quarter':
+        quarter = (dt.month - 1) // 3 + 1
+        return datetime(dt.year, 3 * quarter - 2, 1), f"{dt.year}-Q{quarter}"
+    raise ValueError(f"Unknown grain: {grain}")
+
+
+def period_end(grain, period_start):
+    """Start of the ``grain`` bucket following the one starting at ``period_start``."""
+    if grain == 'day':
+        return period_start + timedelta(days=1)
+    if grain == 'week':
+        return period_start + timedelta(days=7)
+    months = 1 if grain == 'month' else 3
+    month = period_start.month - 1 + months
+    return datetime(period_start.year + month // 12, month % 12 + 1, 1)
+
+
+class _Bucket:
+    __slots__ = ('period', 'first_datetime', 'last_datetime', 'open_price', 'close_price', 'low_price',
+                 'high_price', 'volume', 'market_cap_sum', 'market_cap_count', 'record_count')
+
+    def __init__(self, period):
+        self.period = period
+        self.first_datetime = None
+        self.last_datetime = None
+        self.open_price = None
+        self.close_price = None
+        self.low_price = None
+        self.high_price = None
+        self.volume = 0
+        self.market_cap_sum = 0
+        self.market_cap_count = 0
+        self.record_count = 0
+
+    def add(self, dt, open_price, close_price, low, high, volume, market_cap):
+        if self.first_datetime is None or dt < self.first_datetime:
+            self.first_datetime, self.open_price = dt, open_price
+        if self.last_datetime is None or dt >= self.last_datetime:
+            self.last_datetime, self.close_price = dt, close_price
+        self.low_price = _min(self.low_price, low)
+        self.high_price = _max(self.high_price, high)
+        self.volume += volume or 0
+        if market_cap is not None:
+            self.market_cap_sum += market_cap
+            self.market_cap_count += 1
+        self.record_count += 1
+
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+_tables_ready = False
+
+
+def ensure_rollup_tables():
+    global _tables_ready
+    if not _tables_ready:
+        ensure_state_tables()
+        AggMarketRollup.__table__.create(db.engine, checkfirst=True)
+        schema_cache.invalidate()
+        _tables_ready = True
+
+
+def _fact_rows(query_filter, limit=None):
+    """Fact columns the rollups aggregate, in surrogate-key order."""
+    query = db.session.query(
+        FactMarketMetrics.sk_market_metrics_id,
+        FactMarketMetrics.fk_company_id,
+        DimDate.datetime,
+        FactMarketMetrics.opening_price,
+        FactMarketMetrics.current_price,
+        FactMarketMetrics.day_low,
+        FactMarketMetrics.day_high,
+        FactMarketMetrics.volume,
+        FactMarketMetrics.market_cap
+    ).join(
+        DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+    ).filter(
+        *query_filter
+    ).order_by(
+        FactMarketMetrics.sk_market_metrics_id
+    )
+    return query.limit(limit).all() if limit else query.all()
+
+
+def _aggregate(rows, buckets, only=None):
+    """Fold fact rows into ``buckets`` for every grain, skipping keys outside ``only`` when given."""
+    for _, company_id, dt, opening_price, current_price, low, high, volume, market_cap in rows:
+        if company_id is None or dt is None:
+            continue
+        open_price = opening_price if opening_price is not None else current_price
+        for grain in GRAINS:
+            period_start, period = period_bucket(grain, dt)
+            key = (grain, company_id, period_start)
+            if only is not None and key not in only:
+                continue
+            agg = buckets.get(key)
+            if agg is None:
+                agg = buckets[key] = _Bucket(period)
+            agg.add(dt, open_price, current_price, low, high, volume, market_cap)
+
+
+def _recompute(replaced, folded):
+    """Rebuild the buckets holding replaced facts from the facts matching ``folded``.
+
+    Those buckets may count the deleted fact (or, when SQLite reused its
+    key, miss the new one), so their rows are overwritten with a fresh
+    aggregate rather than merged. ``folded`` selects the facts already
+    read (see refresh_state.read_through); the others are folded later as
+    usual. Returns the number of fact rows read.
+    """
+    keys = set()
+    windows = {}  # (company id, quarter start) -> time range covering its buckets
+    for _, company_id, dt in replaced:
+        if company_id is None or dt is None:
+            continue
+        quarter = period_bucket('quarter', dt)[0]
+        low, high = windows.get((company_id, quarter), (quarter, period_end('quarter', quarter)))
+        for grain in GRAINS:
+            period_start, _ = period_bucket(grain, dt)
+            keys.add((grain, company_id, period_start))
+            # An ISO week can straddle the quarter
+            low, high = min(low, period_start), max(high, period_end(grain, period_start))
+        windows[(company_id, quarter)] = (low, high)
+
+    buckets, seen = {}, set()
+    for (company_id, _), (low, high) in windows.items():
+        rows = _fact_rows((
+            FactMarketMetrics.fk_company_id == company_id,
+            DimDate.datetime >= low,
+            DimDate.datetime < high,
+            folded
+        ))
+        # Windows of neighbouring quarters overlap on a straddling week
+        rows = [row for row in rows if row[0] not in seen]
+        seen.update(row[0] for row in rows)
+        _aggregate(rows, buckets, only=keys)
+
+    starts = {}
+    for grain, company_id, period_start in keys:
+        starts.setdefault((grain, company_id), []).append(period_start)
+    for (grain, company_id), periods in starts.items():
+        existing = {
+            row.period_start: row
+            for row in AggMarketRollup.query.filter(
+                AggMarketRollup.grain == grain,
+                AggMarketRollup.fk_company_id == company_id,
+                AggMarketRollup.period_start.in_(periods)
+            )
+        }
+        for period_start in periods:
+            agg = buckets.get((grain, company_id, period_start))
+            row = existing.get(period_start)
+            if agg is None:
+                if row is not None:
+                    db.session.delete(row)
+                continue
+            if row is None:
+                row = AggMarketRollup(grain=grain, fk_company_id=company_id, period_start=period_start)
+                db.session.add(row)
+            row.period = agg.period
+            row.first_datetime, row.open_price = agg.first_datetime, agg.open_price
+            row.last_datetime, row.close_price = agg.last_datetime, agg.close_price
+            row.low_price, row.high_price, row.volume = agg.low_price, agg.high_price, agg.volume
+            row.market_cap_sum, row.market_cap_count = agg.market_cap_sum, agg.market_cap_count
+            row.record_count = agg.record_count
+    return len(seen)
+
+
+def _merge(buckets):
+    """Fold freshly aggregated buckets into the stored rollup rows."""
+    by_grain = {}
+    for (grain, company_id, period_start), agg in buckets.items():
+        by_grain.setdefault(grain, {})[(company_id, period_start)] = agg
+
+    for grain, aggs in by_grain.items():
+        company_ids = {company_id for company_id, _ in aggs}
+        starts = [period_start for _, period_start in aggs]
+        existing = {
+            (row.fk_company_id, row.period_start): row
+            for row in AggMarketRollup.query.filter(
+                AggMarketRollup.grain == grain,
+                AggMarketRollup.fk_company_id.in_(company_ids),
+                AggMarketRollup.period_start.between(min(starts), max(starts))
+            )
+        }
+        for (company_id, period_start), agg in aggs.items():
+            row = existing.get((company_id, period_start))
+            if row is None:
+                db.session.add(AggMarketRollup(
+                    grain=grain, fk_company_id=company_id, period_start=period_start, period=agg.period,
+                    first_datetime=agg.first_datetime, last_datetime=agg.last_datetime,
+                    open_price=agg.open_price, close_price=agg.close_price,
+                    low_price=agg.low_price, high_price=agg.high_price, volume=agg.volume,
+                    market_cap_sum=agg.market_cap_sum, market_cap_count=agg.market_cap_count,
+                    record_count=agg.record_count
+                ))
+                continue
+            if agg.first_datetime < row.first_datetime:
+                row.first_datetime, row.open_price = agg.first_datetime, agg.open_price
+            if agg.last_datetime >= row.last_datetime:
+                row.last_datetime, row.close_price = agg.last_datetime, agg.close_price
+            row.low_price = _min(row.low_price, agg.low_price)
+            row.high_price = _max(row.high_price, agg.high_price)
+            row.volume = (row.volume or 0) + agg.volume
+            row.market_cap_sum = (row.market_cap_sum or 0) + agg.market_cap_sum
+            row.market_cap_count = (row.market_cap_count or 0) + agg.market_cap_count
+            row.record_count = (row.record_count or 0) + agg.record_count
+
+
+def refresh_rollups(rebuild=False, batch_size=REFRESH_BATCH_SIZE, max_batches=None):
+    """Fold fact rows loaded since the last refresh into every grain.
+
+    Facts are processed in surrogate-key order, one locked batch per
+    transaction, so concurrent refreshes never count a row twice; ids
+    skipped because their load had not committed yet are picked up once
+    it does (see refresh_state). In the same transactions, buckets holding
+    facts listed in the fact_replacement log are recomputed before new
+    facts are folded; log rows every consumer has applied are pruned at
+    the end. ``max_batches`` caps the transactions run, for refreshes made
+    on a request path. Returns the number of fact rows processed.
+    """
+    ensure_rollup_tables()
+    state, cursor, must_rebuild = open_cursor(STATE_NAME)
+    if rebuild or must_rebuild:
+        AggMarketRollup.query.delete()
+        reset(state)
+        reset(cursor, last_replacement_id())
+        bump_data_version()
+    db.session.commit()
+
+    processed = batches = 0
+    while max_batches is None or batches < max_batches:
+        state = locked_state(STATE_NAME)
+        cursor = replacement_cursor(STATE_NAME)
+        replaced = read_new(cursor, FactReplacement.id, replacement_rows, REPLACEMENT_BATCH_SIZE)
+        if replaced:
+            processed += _recompute(replaced, read_through(state, FactMarketMetrics.sk_market_metrics_id))
+        rows = read_new(state, FactMarketMetrics.sk_market_metrics_id, _fact_rows, batch_size)
+        if not replaced and not rows:
+            db.session.commit()
+            break
+        if rows:
+            buckets = {}
+            _aggregate(rows, buckets)
+            _merge(buckets)
+            processed += len(rows)
+        bump_data_version()
+        db.session.commit()
+        batches += 1
+
+    prune_applied_replacements()
+    db.session.commit()
+    return processed
+
+
+def rollups_stale():
+    """True when facts or replacements the last refresh has not read exist (or the rollups were never built)."""
+    ensure_rollup_tables()
+    return facts_pending(STATE_NAME) or replacements_pending(STATE_NAME)
+
+
+def rollup_query(grain, symbols, country, from_datetime, to_datetime):
+    """Rollup rows of one grain whose bucket overlaps the window, ordered by symbol and period."""
+    query = db.session.query(
+        AggMarketRollup, DimCompany.symbol
+    ).join(
+        DimCompany, AggMarketRollup.fk_company_id == DimCompany.sk_company_id
+    ).filter(
+        AggMarketRollup.grain == grain,
+        AggMarketRollup.period_start.between(period_bucket(grain, from_datetime)[0], to_datetime)
+    )
+    if symbols:
+        query = query.filter(DimCompany.symbol.in_(symbols))
+    else:
+        query = query.filter(DimCompany.country == country)
+    return query.order_by(DimCompany.symbol, AggMarketRollup.period_start)
+
+
+def format_rollup_row(rollup, symbol):
+    return {
+        'symbol': symbol,
+        'grain': rollup.grain,
+        'period': rollup.period,
+        'period_start': rollup.period_start.isoformat(),
+        'first_datetime': rollup.first_datetime.isoformat() if rollup.first_datetime else None,
+        'last_datetime': rollup.last_datetime.isoformat() if rollup.last_datetime else None,
+        'open': float(rollup.open_price) if rollup.open_price is not None else None,
+        'close': float(rollup.close_price) if rollup.close_price is not None else None,
+        'low': float(rollup.low_price) if rollup.low_price is not None else None,
+        'high': float(rollup.high_price) if rollup.high_price is not None else None,
+        'volume': rollup.volume,
+        'avg_market_cap': float(rollup.market_cap_sum / rollup.market_cap_count) if rollup.market_cap_count else None,
+        'record_count': rollup.record_count
+    }
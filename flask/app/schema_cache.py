@@ -0,0 +1,125 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from extensions import AppExtension
+from models import db
+
+
+def schema_version(conn):
+    """Migration stamp of the database: the Alembic revision, or the table list when unmanaged."""
+    try:
+        revisions = [row[0] for row in conn.execute(text("SELECT version_num FROM alembic_version"))]
+        return 'alembic:' + ','.join(sorted(revisions))
+    except SQLAlchemyError:
+        conn.rollback()
+    return 'tables:' + ','.join(sorted(inspect(conn).get_table_names()))
+
+
+def row_estimates(conn):
+    """Approximate row count per table from planner statistics (never a COUNT(*))."""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        rows = conn.execute(text(
+            "SELECT c.relname, c.reltuples::bigint FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')"
+        ))
+        return {name: (count if count >= 0 else None) for name, count in rows}
+    if dialect == 'sqlite':
+        try:
+            rows = conn.execute(text("SELECT tbl, stat FROM sqlite_stat1 WHERE idx IS NULL OR idx = tbl"))
+            return {name: int(stat.split()[0]) for name, stat in rows}
+        except SQLAlchemyError:
+            # No ANALYZE has run yet
+            conn.rollback()
+    return {}
+
+
+class _Snapshot:
+    def __init__(self, version, tables, columns, indexes):
+        self.version = version
+        self.tables = tables
+        self.columns = columns
+        self.indexes = indexes
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+
+
+class SchemaCache:
+    """Reflected table/column/index catalog, rebuilt only when the migration stamp changes.
+
+    The stamp is re-read at most every ``check_interval`` seconds; row
+    estimates are refreshed on the same schedule since they drift with loads.
+    """
+
+    def __init__(self):
+        self.check_interval = 60.0
+        self._snapshot = None
+        self._estimates = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SCHEMA_CACHE_CHECK_SECONDS', 60)
+        self.check_interval = float(app.config['SCHEMA_CACHE_CHECK_SECONDS'])
+
+    def _load(self, conn, version):
+        inspector = inspect(conn)
+        tables = sorted(inspector.get_table_names())
+        columns = inspector.get_multi_columns()
+        primary_keys = inspector.get_multi_pk_constraint()
+        indexes = inspector.get_multi_indexes()
+
+        schema_columns = {}
+        schema_indexes = {}
+        for key, reflected in columns.items():
+            table = key[1]
+            pk = set((primary_keys.get(key) or {}).get('constrained_columns') or [])
+            schema_columns[table] = [
+                {"name": c['name'], "type": str(c['type']), "nullable": c['nullable'], "primary_key": c['name'] in pk}
+                for c in reflected
+            ]
+        for (_, table), reflected in indexes.items():
+            schema_indexes[table] = [
+                {"name": i['name'], "columns": i['column_names'], "unique": bool(i['unique'])}
+                for i in reflected
+            ]
+        return _Snapshot(version, tables, schema_columns, schema_indexes)
+
+    def snapshot(self, force=False):
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and not force and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock, db.engine.connect() as conn:
+            version = schema_version(conn)
+            if force or self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(conn, version)
+            self._estimates = row_estimates(conn)
+            self._checked_at = now
+            return self._snapshot
+
+    def invalidate(self):
+        """Drop the snapshot, e.g. after tables or indexes were created outside a migration."""
+        self._snapshot = None
+
+    def tables(self):
+        snapshot = self.snapshot()
+        return {"tables": snapshot.tables, "version": snapshot.version}
+
+    def schema(self):
+        snapshot = self.snapshot()
+        return {
+            "schema": snapshot.columns,
+            "indexes": snapshot.indexes,
+            "row_estimates": {table: self._estimates.get(table) for table in snapshot.tables},
+            "version": snapshot.version,
+            "loaded_at": snapshot.loaded_at,
+        }
+
+
+schema_cache = AppExtension('schema_cache', SchemaCache)
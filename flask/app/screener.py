@@ -0,0 +1,178 @@
+import threading
+import time
+
+from sqlalchemy import Float
+
+from extensions import AppExtension
+from models import db, DimCompany
+from dimensions import dimension_cache
+
+# Fundamentals that accept range filters and sorting.
+SCREEN_COLUMNS = (
+    'pe_ratio_ttm', 'price_to_book_ratio_ttm', 'debt_to_equity_ratio_ttm', 'peg_ratio_ttm',
+    'return_on_equity_ttm', 'mkt_cap', 'beta'
+)
+# Attributes filtered by exact match (comma-separated values in the query string).
+CATEGORY_COLUMNS = ('sector', 'industry', 'country')
+
+DEFAULT_SCREEN_LIMIT = 100
+MAX_SCREEN_LIMIT = 5000
+
+
+class ScreenerUnavailable(Exception):
+    """Raised when NumPy is not installed."""
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ScreenerUnavailable("numpy is required for /api/screener") from e
+    return numpy
+
+
+class _Frame:
+    """Column arrays of dim_company, one position per company; replaced wholesale on refresh."""
+
+    def __init__(self, np, version, rows):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.size = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * (2 + len(CATEGORY_COLUMNS) + len(SCREEN_COLUMNS))
+        self.symbols = np.array(columns[0], dtype=object)
+        self.names = np.array(columns[1], dtype=object)
+        # Categories as integer codes into a sorted vocabulary; None is kept as its own value
+        self.categories = {}
+        for name, values in zip(CATEGORY_COLUMNS, columns[2:2 + len(CATEGORY_COLUMNS)]):
+            labels = ['' if value is None else value for value in values]
+            vocabulary, codes = np.unique(np.array(labels, dtype=object), return_inverse=True)
+            self.categories[name] = ({label: code for code, label in enumerate(vocabulary)}, codes, values)
+        self.values = {
+            name: np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            for name, values in zip(SCREEN_COLUMNS, columns[2 + len(CATEGORY_COLUMNS):])
+        }
+
+
+def parse_screen(args):
+    """Validate screener query parameters into (categories, ranges, sort, descending, limit).
+
+    ``<column>_min`` / ``<column>_max`` bound a fundamental (inclusive),
+    ``sector``/``industry``/``country`` take comma-separated values and
+    ``sort`` names a fundamental, ``-`` prefixed for descending order.
+    Raises ValueError describing the first invalid parameter.
+    """
+    categories = {}
+    for name in CATEGORY_COLUMNS:
+        values = [v.strip() for v in args.get(name, '').split(',') if v.strip()]
+        if values:
+            categories[name] = values
+
+    ranges = {}
+    for key, value in args.items():
+        column, _, bound = key.rpartition('_')
+        if bound not in ('min', 'max') or column not in SCREEN_COLUMNS:
+            continue
+        try:
+            ranges.setdefault(column, [None, None])[bound == 'max'] = float(value)
+        except ValueError:
+            raise ValueError(f"{key} must be a number") from None
+
+    sort = args.get('sort', '-mkt_cap')
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-+')
+    if sort not in SCREEN_COLUMNS:
+        raise ValueError(f"sort must be one of: {', '.join(SCREEN_COLUMNS)} (prefix - for descending)")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_SCREEN_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if not 1 <= limit <= MAX_SCREEN_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SCREEN_LIMIT}")
+    return categories, ranges, sort, descending, limit
+
+
+class CompanyScreener:
+    """Cross-sectional screens over an in-memory NumPy copy of dim_company.
+
+    The copy is rebuilt when the dimension cache's version changes (companies
+    added or removed) and at least every ``refresh_interval`` seconds, which
+    picks up fundamentals updated in place. A screen is a boolean mask per
+    predicate followed by a partial sort of the survivors, so it never
+    touches the database.
+    """
+
+    def __init__(self):
+        self.refresh_interval = 300.0
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SCREENER_REFRESH_SECONDS', 300)
+        self.refresh_interval = float(app.config['SCREENER_REFRESH_SECONDS'])
+
+    def _load(self, np, version):
+        rows = db.session.query(
+            DimCompany.symbol, DimCompany.company_name,
+            *[getattr(DimCompany, name) for name in CATEGORY_COLUMNS],
+            *[getattr(DimCompany, name).cast(Float) for name in SCREEN_COLUMNS]
+        ).order_by(DimCompany.symbol).all()
+        return _Frame(np, version, rows)
+
+    def frame(self, force=False):
+        """Current column arrays, rebuilt if the dimension changed or they are older than the interval."""
+        np = _import_numpy()
+        version = dimension_cache.version
+        frame = self._frame
+        if (frame is not None and not force and frame.version == version
+                and time.monotonic() - frame.loaded_at < self.refresh_interval):
+            return frame
+
+        with self._lock:
+            if force or self._frame is frame:
+                self._frame = self._load(np, version)
+            return self._frame
+
+    def screen(self, categories, ranges, sort, descending, limit):
+        """Companies matching every predicate, best ``limit`` by ``sort``; returns (rows, matched, universe).
+
+        Companies without a value for a filtered or sorted fundamental are excluded.
+        """
+        np = _import_numpy()
+        frame = self.frame()
+        mask = np.ones(frame.size, dtype=bool)
+        for name, wanted in categories.items():
+            lookup, codes, _ = frame.categories[name]
+            mask &= np.isin(codes, [lookup[value] for value in wanted if value in lookup])
+        for name, (low, high) in ranges.items():
+            values = frame.values[name]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        key = frame.values[sort]
+        mask &= ~np.isnan(key)
+
+        positions = np.flatnonzero(mask)
+        matched = len(positions)
+        keys = -key[positions] if descending else key[positions]
+        if matched > limit:
+            # Top-k: partition around the k-th key, then sort only those k
+            top = np.argpartition(keys, limit - 1)[:limit]
+            positions, keys = positions[top], keys[top]
+        # Ties keep symbol order (the frame is sorted by symbol)
+        positions = positions[np.lexsort((positions, keys))]
+        return [self._row(frame, i) for i in positions.tolist()], matched, frame.size
+
+    @staticmethod
+    def _row(frame, i):
+        row = {'symbol': frame.symbols[i], 'company_name': frame.names[i]}
+        for name in CATEGORY_COLUMNS:
+            row[name] = frame.categories[name][2][i]
+        for name in SCREEN_COLUMNS:
+            value = frame.values[name][i]
+            row[name] = None if value != value else float(value)
+        return row
+
+
+company_screener = AppExtension('company_screener', CompanyScreener)
@@ -0,0 +1,170 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain, groupby, repeat
+from operator import itemgetter
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+from queries import FIELD_COLUMNS
+from models import DimCompany
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only where orjson is absent
+    orjson = None
+
+JSON_ENCODERS = ('auto', 'orjson', 'json')
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_dumps(value):
+    return json.dumps(value, default=_default, separators=(',', ':')).encode()
+
+
+def _orjson_dumps(value):
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _orjson_dumps_str_keys(value):
+    return orjson.dumps(value, default=_default)
+
+
+def encoder(name='auto', str_keys=False):
+    """Return a ``dumps(value) -> bytes`` for ``name`` (auto = orjson when installed).
+
+    ``str_keys`` promises every dict key is a string, which lets orjson
+    stay on its fast path (RowEncoder keys are always field names).
+    """
+    if name not in JSON_ENCODERS:
+        raise ValueError(f"JSON_ENCODER must be one of: {', '.join(JSON_ENCODERS)}")
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ImportError("JSON_ENCODER=orjson but the orjson package is not installed")
+        return _orjson_dumps_str_keys if str_keys else _orjson_dumps
+    return _json_dumps
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by the configured encoder; every jsonify() goes through it."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.dumps_bytes = encoder(app.config.get('JSON_ENCODER', 'auto'))
+        self.dumps_rows = encoder(app.config.get('JSON_ENCODER', 'auto'), str_keys=True)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def _dumps(attribute='dumps_bytes'):
+    provider = current_app.json
+    return getattr(provider, attribute, None) or (lambda value: provider.dumps(value).encode())
+
+
+def _getter(positions):
+    """itemgetter that always returns a tuple, whatever the number of positions."""
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda row: (row[position],)
+    return itemgetter(*positions) if positions else (lambda row: ())
+
+
+class RowEncoder:
+    """Encodes result rows (in ``fields`` order) straight to JSON object bytes.
+
+    Company attributes repeat on every row of a symbol, so they are encoded
+    once per distinct company and the bytes are spliced into each row.
+    The fact and date values of a symbol's run of rows are encoded one
+    column at a time (one encoder call per column) and interleaved with
+    pre-encoded keys; values are written as the driver returns them, the
+    numeric columns being cast to float in SQL already.
+    """
+
+    def __init__(self, fields, dumps=None):
+        self.fields = tuple(fields)
+        self.dumps = dumps or _dumps('dumps_rows')
+        company_positions = [
+            i for i, name in enumerate(self.fields) if getattr(FIELD_COLUMNS[name], 'table', None) is DimCompany.__table__
+        ]
+        value_positions = [i for i in range(len(self.fields)) if i not in company_positions]
+        self.company_names = tuple(self.fields[i] for i in company_positions)
+        self.value_names = tuple(self.fields[i] for i in value_positions)
+        self.company_key = _getter(company_positions)
+        self.values = _getter(value_positions)
+        # Encoded '"name":' per value column
+        self.keys = tuple((json.dumps(name) + ':').encode() for name in self.value_names)
+        self._fragments = {}
+
+    def _company_fragment(self, key):
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = self._fragments[key] = self.dumps(dict(zip(self.company_names, key)))[1:-1]
+        return fragment
+
+    def encode(self, row):
+        """JSON object bytes for one row."""
+        fragment = self._company_fragment(self.company_key(row))
+        body = self.dumps(dict(zip(self.value_names, self.values(row))))
+        if not fragment:
+            return body
+        return b'{' + fragment + (b',' + body[1:] if len(body) > 2 else b'}')
+
+    def _encode_run(self, fragment, rows, separator=b','):
+        """``separator``-joined objects for rows sharing one company fragment."""
+        if not self.value_names:
+            return separator.join([b'{' + fragment + b'}'] * len(rows))
+        columns = []
+        for column in zip(*map(self.values, rows)):
+            encoded = self.dumps(column)[1:-1]
+            if encoded.count(b',') != len(rows) - 1:
+                # A value contains a comma of its own; encode object by object
+                return separator.join(map(self.encode, rows))
+            columns.append(encoded.split(b','))
+        # Each row is '<separator>{<fragment>,"k0":v0,"k1":v1,...}'; the leading separator is dropped at the end
+        prefixes = [b',' + key for key in self.keys]
+        prefixes[0] = separator + b'{' + (fragment + b',' if fragment else b'') + self.keys[0]
+        interleaved = []
+        for prefix, column in zip(prefixes, columns):
+            interleaved += (repeat(prefix), column)
+        return b''.join(chain.from_iterable(zip(*interleaved, repeat(b'}'))))[len(separator):]
+
+    def encode_array(self, rows):
+        """JSON array bytes for a sequence of rows."""
+        parts = [
+            self._encode_run(self._company_fragment(key), list(group))
+            for key, group in groupby(rows, self.company_key)
+        ]
+        return b''.join((b'[', b','.join(parts), b']'))
+
+    def encode_lines(self, rows):
+        """NDJSON bytes (one object per line, newline-terminated) for a sequence of rows."""
+        parts = [
+            self._encode_run(self._company_fragment(key), list(group), b'\n')
+            for key, group in groupby(rows, self.company_key)
+        ]
+        return b'\n'.join(parts) + b'\n' if parts else b''
+
+
+def rows_document(rows_json, envelope, dumps):
+    """``{"data": <rows_json>, **envelope}`` as bytes, around an already-encoded rows array."""
+    head = dumps(envelope or {})
+    return b''.join((b'{"data":', rows_json, b',' + head[1:] if len(head) > 2 else b'}'))
+
+
+def rows_response(rows_json, envelope=None, status=200):
+    """JSON response wrapping an already-encoded rows array (see rows_document)."""
+    body = rows_document(rows_json, envelope, _dumps())
+    return current_app.response_class(body, status=status, mimetype='application/json')
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import func, or_, select
+
+from extensions import AppExtension
+from models import db, DimDate, FactMarketMetrics, FactReplacement
+from dimensions import dimension_cache, cached_fact_rows
+from queries import FIELD_COLUMNS, STOCK_FIELDS
+from refresh_state import advance_gaps, ensure_state_tables, in_gaps, late_commit_seconds, replacement_cursor
+from watermark import PRUNED_NAME, data_version, last_replacement_id, replacement_rows
+
+# Fact measures kept per row after the timestamp, all as float64 (NaN for NULL).
+STORE_MEASURES = ('current_price', 'change', 'change_percentage', 'volume', 'day_low', 'day_high', 'market_cap')
+INTEGER_MEASURES = {'volume'}
+
+MANIFEST = 'index.json'
+# agg_rollup_state name under which the store's fact_replacement position is kept.
+STATE_NAME = 'series_store'
+LOCK_FILE = 'refresh.lock'
+
+
+class SeriesStoreUnavailable(Exception):
+    """Raised when NumPy is not installed."""
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise SeriesStoreUnavailable("numpy is required for the series store (SERIES_STORE_DIR)") from e
+    return numpy
+
+
+def _record_dtype(np):
+    return np.dtype([('datetime', 'M8[us]')] + [(name, 'f8') for name in STORE_MEASURES])
+
+
+def _midnight(now=None):
+    now = now or datetime.now()
+    return datetime(now.year, now.month, now.day)
+
+
+def _open_gaps(entries, now):
+    """Manifest [low, high, recorded_at] gaps as refresh_state tuples, minus those given up on."""
+    since = now - timedelta(seconds=late_commit_seconds())
+    gaps = [(low, high, datetime.fromisoformat(recorded_at)) for low, high, recorded_at in entries]
+    return [gap for gap in gaps if gap[2] >= since]
+
+
+def _saved_gaps(gaps):
+    return [[low, high, recorded_at.isoformat()] for low, high, recorded_at in gaps]
+
+
+def _new_ids(column, after_id, through_id, gaps):
+    """Sorted ids of ``column`` in (after_id, through_id] or in ``gaps``."""
+    return db.session.execute(select(column).where(
+        or_(column.between(after_id + 1, through_id), *([in_gaps(column, gaps)] if gaps else []))
+    ).order_by(column)).scalars().all()
+
+
+class _Mapped:
+    """Read-only memory map of one symbol's records; valid for the file identity it was opened on."""
+
+    __slots__ = ('identity', 'records')
+
+    def __init__(self, identity, records):
+        self.identity = identity
+        self.records = records
+
+
+class SeriesStore:
+    """Closed price history per symbol in memory-mapped files, shared by every worker on the host.
+
+    Each company has one file of fixed-width records (timestamp plus the
+    STORE_MEASURES), sorted by time, and ``index.json`` maps symbols to
+    their files. Only history before ``sealed_until`` (midnight of the
+    last refresh) is stored, so it never changes under a reader: new days
+    are appended, and the rare late or corrected fact rewrites one file
+    under a new inode. Reads binary-search the time axis of the mapping
+    and take the slice without copying; anything at or after
+    ``sealed_until`` still comes from the database.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self._manifest = None
+        self._manifest_identity = None
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SERIES_STORE_DIR', None)
+        self.directory = app.config['SERIES_STORE_DIR'] or None
+        self._manifest = None
+        self._maps = {}
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _identity(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def manifest(self):
+        """The current index.json, re-read only when the file was replaced."""
+        path = self._path(MANIFEST)
+        identity = self._identity(path)
+        if identity is None:
+            return None
+        with self._lock:
+            if identity != self._manifest_identity:
+                with open(path) as f:
+                    self._manifest = json.load(f)
+                self._manifest['sealed_until'] = datetime.fromisoformat(self._manifest['sealed_until'])
+                self._manifest_identity = identity
+            return self._manifest
+
+    def _records(self, np, company_id):
+        path = self._path(f"{company_id}.bin")
+        identity = self._identity(path)
+        if identity is None or identity[1] == 0:
+            return None
+        with self._lock:
+            mapped = self._maps.get(company_id)
+            if mapped is None or mapped.identity != identity:
+                mapped = self._maps[company_id] = _Mapped(
+                    identity, np.memmap(path, dtype=_record_dtype(np), mode='r')
+                )
+            return mapped.records
+
+    def read(self, manifest, company, from_datetime, to_datetime):
+        """Stored records of ``company`` inside [from, to] and before ``sealed_until``, or None.
+
+        The result is a zero-copy slice of the mapping. Rows appended after
+        ``manifest`` was written lie past its ``sealed_until`` and are ignored.
+        """
+        np = _import_numpy()
+        entry = manifest['symbols'].get(company.symbol)
+        if entry is None or from_datetime >= manifest['sealed_until']:
+            return None
+        records = self._records(np, entry['company_id'])
+        if records is None:
+            return None
+        times = records['datetime']
+        lo = np.searchsorted(times, np.datetime64(from_datetime, 'us'), side='left')
+        hi = min(
+            np.searchsorted(times, np.datetime64(to_datetime, 'us'), side='right'),
+            np.searchsorted(times, np.datetime64(manifest['sealed_until'], 'us'), side='left')
+        )
+        return records[lo:hi]
+
+    def fact_rows(self, companies, from_datetime, to_datetime):
+        """Same output as cached_fact_rows: stored history plus the open tail from the database.
+
+        Companies not materialised yet are read entirely from the database.
+        """
+        np = _import_numpy()
+        manifest = self.manifest()
+        if manifest is None:
+            return cached_fact_rows(companies, from_datetime, to_datetime)
+        sealed_until = manifest['sealed_until']
+
+        output = []
+        stored, unstored = [], []
+        for company in companies:
+            if company.symbol not in manifest['symbols']:
+                unstored.append(company)
+                continue
+            stored.append(company)
+            records = self.read(manifest, company, from_datetime, to_datetime)
+            if records is not None:
+                output.extend(self._rows(np, company, records))
+
+        tail_from = max(from_datetime, sealed_until)
+        if stored and tail_from <= to_datetime:
+            output.extend(cached_fact_rows(stored, tail_from, to_datetime))
+        if unstored:
+            output.extend(cached_fact_rows(unstored, from_datetime, to_datetime))
+        output.sort(key=lambda row: (row['symbol'], row['datetime']))
+        return output
+
+    @staticmethod
+    def _rows(np, company, records):
+        if not len(records):
+            return []
+        times = records['datetime']
+        if not (times.astype('i8') % 1000000).any():
+            stamps = np.datetime_as_string(times, unit='s').tolist()
+        else:
+            stamps = [value.isoformat() for value in times.tolist()]
+        columns = []
+        for name in STORE_MEASURES:
+            values = records[name]
+            missing = np.isnan(values)
+            if name in INTEGER_MEASURES:
+                values = np.where(missing, 0, values).astype('i8')
+            column = values.tolist()
+            if missing.any():
+                column = [None if gap else value for gap, value in zip(missing.tolist(), column)]
+            columns.append(column)
+        head = {name: getattr(company, name) for name in STOCK_FIELDS[:5]}
+        return [
+            {**head, 'date': stamp[:10], 'datetime': stamp, **dict(zip(STORE_MEASURES, values))}
+            for stamp, *values in zip(stamps, *columns)
+        ]
+
+    # --- Materialisation -------------------------------------------------
+
+    def refresh(self, rebuild=False, now=None):
+        """Append closed history loaded since the last refresh; returns the number of fact rows read.
+
+        Facts with a surrogate key above the last one seen, or dated on or
+        after the previous ``sealed_until``, are merged into their symbol's
+        file when they fall before today's midnight. A file only grows by
+        appending unless a fact lands before its last stored timestamp, in
+        which case it is rewritten. Symbols with facts in the replacement
+        log since the last refresh are rewritten whole from the database,
+        and a store whose log position was pruned away is rebuilt. Ids
+        skipped in either sequence are kept in the manifest and read again
+        until they commit, as refresh_state does for the tables. The log
+        position is also recorded in agg_rollup_state, which holds back
+        pruning; with one store per host, the last host to refresh sets it.
+        One process refreshes at a time (an exclusive lock on refresh.lock);
+        use ``rebuild=True`` after deletes made outside the API.
+        """
+        import fcntl
+
+        np = _import_numpy()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = None if rebuild else self.manifest()
+            if manifest is not None and manifest.get('last_replacement_id', 0) < data_version(PRUNED_NAME):
+                # Replacements this store never saw were pruned from the log
+                manifest = None
+            last_replaced = last_replacement_id()
+            started = datetime.now()
+            if manifest is None:
+                manifest = {'sealed_until': datetime(1900, 1, 1), 'last_fact_id': 0, 'symbols': {}}
+                for name in os.listdir(self.directory):
+                    if name.endswith('.bin'):
+                        os.remove(self._path(name))
+                rewrite, replacement_gaps = set(), []
+            else:
+                previous = manifest.get('last_replacement_id', 0)
+                replacement_gaps = _open_gaps(manifest.get('replacement_gaps', []), started)
+                replaced = _new_ids(FactReplacement.id, previous, last_replaced, replacement_gaps)
+                rewrite = {company_id for _, company_id, _ in replacement_rows((FactReplacement.id.in_(replaced),))} if replaced else set()
+                replacement_gaps = advance_gaps(replacement_gaps, previous, replaced, started)
+            sealed_until = _midnight(now)
+            max_id = db.session.query(func.max(FactMarketMetrics.sk_market_metrics_id)).scalar() or 0
+            # Ids below the last one read can still commit (see refresh_state), so skipped ones are read again
+            fact_gaps = _open_gaps(manifest.get('fact_gaps', []), started)
+            fact_ids = _new_ids(FactMarketMetrics.sk_market_metrics_id, manifest['last_fact_id'], max_id, fact_gaps)
+
+            rows = self._fact_rows(or_(
+                FactMarketMetrics.sk_market_metrics_id > manifest['last_fact_id'],
+                DimDate.datetime >= manifest['sealed_until'],
+                *([in_gaps(FactMarketMetrics.sk_market_metrics_id, fact_gaps)] if fact_gaps else [])
+            ), FactMarketMetrics.fk_company_id.not_in(rewrite), max_id=max_id, sealed_until=sealed_until)
+            fact_gaps = advance_gaps(fact_gaps, manifest['last_fact_id'], fact_ids, started)
+            if rewrite:
+                rows += self._fact_rows(FactMarketMetrics.fk_company_id.in_(rewrite), max_id=max_id, sealed_until=sealed_until)
+                for company_id in rewrite:
+                    path = self._path(f"{company_id}.bin")
+                    if os.path.exists(path):
+                        # Emptied under a new inode so open mappings keep the old records
+                        temporary = f"{path}.{os.getpid()}.tmp"
+                        open(temporary, 'wb').close()
+                        os.replace(temporary, path)
+
+            snapshot = dimension_cache.snapshot(force=True)
+            dtype = _record_dtype(np)
+            for company_id, company_rows in groupby(rows, key=lambda row: row[0]):
+                company = snapshot.companies.get(company_id)
+                if company is None:
+                    continue
+                records = np.array(
+                    [(dt, *(np.nan if value is None else value for value in values))
+                     for _, dt, *values in company_rows if dt is not None],
+                    dtype=dtype
+                )
+                if not len(records):
+                    continue
+                entry = manifest['symbols'].get(company.symbol)
+                self._write(np, company_id, records, entry)
+                stored = self._records(np, company_id)
+                manifest['symbols'][company.symbol] = {
+                    'company_id': company_id,
+                    'rows': len(stored),
+                    'first': str(stored['datetime'][0]),
+                    'last': str(stored['datetime'][-1]),
+                }
+
+            for symbol, entry in list(manifest['symbols'].items()):
+                if entry['company_id'] in rewrite and self._records(np, entry['company_id']) is None:
+                    # Nothing closed left after the rewrite: read it from the database again
+                    del manifest['symbols'][symbol]
+
+            manifest['sealed_until'] = sealed_until
+            if fact_ids:
+                manifest['last_fact_id'] = max(manifest['last_fact_id'], fact_ids[-1])
+            manifest['fact_gaps'] = _saved_gaps(fact_gaps)
+            manifest['last_replacement_id'] = last_replaced
+            manifest['replacement_gaps'] = _saved_gaps(replacement_gaps)
+            manifest['refreshed_at'] = datetime.now().isoformat()
+            self._save_manifest(manifest)
+            # Keeps the replacement log from being pruned past this store (or its open gaps)
+            ensure_state_tables()
+            replacement_cursor(STATE_NAME).last_fact_id = min(
+                [last_replaced] + [low - 1 for low, _, _ in replacement_gaps]
+            )
+            db.session.commit()
+            logging.info(f"SERIES STORE: {len(rows)} fact rows merged, sealed until {sealed_until.isoformat()}")
+            return len(rows)
+
+    @staticmethod
+    def _fact_rows(*criteria, max_id, sealed_until):
+        """Closed fact rows up to ``max_id`` matching ``criteria``, by company then time."""
+        return db.session.execute(select(
+            FactMarketMetrics.fk_company_id,
+            DimDate.datetime,
+            *[FIELD_COLUMNS[name] for name in STORE_MEASURES]
+        ).join(
+            DimDate, FactMarketMetrics.fk_date_id == DimDate.sk_date_id
+        ).where(
+            *criteria,
+            FactMarketMetrics.sk_market_metrics_id <= max_id,
+            DimDate.datetime < sealed_until
+        ).order_by(
+            FactMarketMetrics.fk_company_id, DimDate.datetime, FactMarketMetrics.sk_market_metrics_id
+        )).all()
+
+    def _write(self, np, company_id, records, entry):
+        """Append ``records`` (sorted by time) to a symbol's file, or rewrite it when they overlap."""
+        path = self._path(f"{company_id}.bin")
+        existing = self._records(np, company_id) if entry is not None else None
+        if existing is None or not len(existing) or records['datetime'][0] > existing['datetime'][-1]:
+            with open(path, 'ab' if existing is not None else 'wb') as f:
+                f.write(records.tobytes())
+            return
+        # Late or corrected facts: the newer value wins for a timestamp already stored
+        merged = np.concatenate([existing, records])
+        _, last = np.unique(merged['datetime'][::-1], return_index=True)
+        merged = merged[len(merged) - 1 - last]
+        temporary = f"{path}.{os.getpid()}.tmp"
+        merged.tofile(temporary)
+        os.replace(temporary, path)
+
+    def _save_manifest(self, manifest):
+        data = {**manifest, 'sealed_until': manifest['sealed_until'].isoformat()}
+        temporary = self._path(f"{MANIFEST}.{os.getpid()}.tmp")
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, self._path(MANIFEST))
+
+
+series_store = AppExtension('series_store', SeriesStore)
@@ -0,0 +1,42 @@
+import time
+
+from flask import Response, stream_with_context
+
+from models import db
+from serialization import RowEncoder
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Rows fetched per server-side cursor round-trip and written per response chunk.
+STREAM_BATCH_SIZE = 1000
+
+
+def wants_ndjson(request):
+    """True when the client asked for newline-delimited JSON via ?format= or Accept."""
+    requested = request.args.get('format')
+    if requested is not None:
+        return requested.lower() == 'ndjson'
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def ndjson_response(statement, fields, on_complete=None, batch_size=STREAM_BATCH_SIZE):
+    """Stream a SELECT as NDJSON without materialising the result set.
+
+    Rows are pulled through a server-side cursor (``yield_per``) and each
+    batch of ``batch_size`` rows (in ``fields`` order) is encoded by a
+    RowEncoder into one response chunk.
+    ``on_complete(record_count, seconds)`` is called once the last row has been sent.
+    """
+    encoder = RowEncoder(fields)
+
+    def generate():
+        start_time = time.time()
+        record_count = 0
+        result = db.session.execute(statement.execution_options(yield_per=batch_size))
+        for batch in result.partitions():
+            record_count += len(batch)
+            yield encoder.encode_lines(batch)
+        if on_complete is not None:
+            on_complete(record_count, time.time() - start_time)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
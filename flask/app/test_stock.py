@@ -1,18 +1,24 @@
 import pytest
 from flask import Flask
-from app import app, db
+from app import create_app, db
 from models import DimCompany, DimDate, FactMarketMetrics
+from dimensions import dimension_cache
+from benchmarks.data import create_schema
 from datetime import datetime, timedelta
 
+app = create_app({
+    "TESTING": True,
+    "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",  # Use in-memory DB for testing
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    "ADMIN_TOKEN": "secret",
+})
+ADMIN = {"Authorization": "Bearer secret"}
+
 @pytest.fixture(scope="module")
 def test_client():
     """Set up the test client and initialize the database."""
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"  # Use in-memory DB for testing
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
     with app.app_context():
-        db.create_all()
+        create_schema()  # stub tables for the dimensions models.py does not declare
         yield app.test_client()
         db.drop_all()
 
@@ -109,3 +115,692 @@ def test_api_performance(test_client):
     assert response.status_code == 200
     assert elapsed_time < 2  # Ensure response is under 2 seconds
 
+
+def test_market_data_ndjson_stream(test_client):
+    """Test market data can be streamed as newline-delimited JSON."""
+    import json
+    response = test_client.get("/api/market?format=ndjson&from=2000-01-01&to=2100-01-01")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines and lines[0]["symbol"] == "AAPL"
+
+def test_ml_model_ndjson_accept_header(test_client):
+    """Test the ML endpoint honours an NDJSON Accept header."""
+    response = test_client.get("/api/ml-model?from=2000-01-01&to=2100-01-01", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+def test_ml_model_arrow_export(test_client):
+    """Test the ML endpoint can return an Arrow IPC stream."""
+    pa = pytest.importorskip("pyarrow")
+    response = test_client.get("/api/ml-model?from=2000-01-01&to=2100-01-01&format=arrow")
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.get_data()).read_all()
+    assert table.column("symbol").to_pylist() == ["AAPL"]
+    assert table.column("current_price").to_pylist() == [150.0]
+
+def test_single_stock_parquet_export(test_client):
+    """Test single stock data can be exported as Parquet."""
+    pytest.importorskip("pyarrow")
+    import io
+    import pyarrow.parquet as pq
+    response = test_client.get("/api/ml-model/stock?ticker=AAPL&from=2000-01-01&to=2100-01-01&format=parquet")
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.column("country").to_pylist() == ["US"]
+
+def test_ml_model_keyset_pagination(test_client):
+    """Test a full page returns a cursor that seeks past the last row."""
+    response = test_client.get("/api/ml-model?from=2000-01-01&to=2100-01-01&limit=1")
+    data = response.get_json()
+    assert response.status_code == 200
+    next_cursor = data["metadata"]["next_cursor"]
+    assert next_cursor
+    response = test_client.get(f"/api/ml-model?from=2000-01-01&to=2100-01-01&limit=1&cursor={next_cursor}")
+    assert response.status_code == 404
+
+def test_ml_model_invalid_cursor(test_client):
+    """Test a malformed cursor is rejected."""
+    response = test_client.get("/api/ml-model?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+def test_market_data_cache_hit(test_client):
+    """Test repeated market requests are served from the response cache."""
+    first = test_client.get("/api/market?country=US&days=30")
+    second = test_client.get("/api/market?days=30&country=US")
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.get_json()["data"] == first.get_json()["data"]
+    stats = test_client.get("/api/cache/stats").get_json()
+    assert stats["hits"] >= 1
+    assert stats["misses"] >= 1
+
+def test_cache_invalidated_by_new_facts(test_client):
+    """Test a new fact row changes the watermark and bypasses stale entries."""
+    from cache import response_cache
+    url = "/api/ml-model/stock?ticker=AAPL&from=2000-01-01&to=2100-01-01"
+    assert len(test_client.get(url).get_json()["data"]) == 1
+    db.session.add(FactMarketMetrics(sk_market_metrics_id=2, fk_company_id=1, fk_date_id=1, current_price=151.0))
+    db.session.commit()
+    response_cache._watermark_checked_at = 0
+    response = test_client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(response.get_json()["data"]) == 2
+
+def test_cache_invalidated_by_data_version_bump(test_client):
+    """Test `flask data-version-bump` moves the watermark after an in-place update."""
+    from cache import response_cache
+    url = "/api/ml-model/stock?ticker=AAPL&from=2000-01-01&to=2100-01-01"
+    test_client.get(url)
+    FactMarketMetrics.query.filter_by(sk_market_metrics_id=2).update({"current_price": 160.0})
+    db.session.commit()
+    response_cache._watermark_checked_at = 0
+    assert test_client.get(url).headers["X-Cache"] == "HIT"  # same key range and row count
+    result = app.test_cli_runner().invoke(args=["data-version-bump"])
+    assert "data_version is now" in result.output
+    response_cache._watermark_checked_at = 0
+    response = test_client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert 160.0 in [row["current_price"] for row in response.get_json()["data"]]
+
+def test_cache_invalidated_by_replaced_facts(test_client):
+    """Test re-ingesting a key moves the watermark even when the surrogate keys and row count stay the same."""
+    from cache import response_cache
+    from watermark import fact_watermark
+    db.session.add(DimCompany(symbol="WMRK", company_name="Watermark Co", country="US"))
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    body = "symbol,datetime,current_price\nWMRK,2001-06-01T10:00:00,100\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    url = "/api/ml-model/stock?ticker=WMRK&from=2001-06-01&to=2001-06-02"
+    assert test_client.get(url).get_json()["data"][0]["current_price"] == 100
+    before = fact_watermark()
+    test_client.post("/api/ingest/market-metrics", data=body.replace("100", "555"), content_type="text/csv")
+    assert fact_watermark() != before
+    response_cache._watermark_checked_at = 0
+    response = test_client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.get_json()["data"][0]["current_price"] == 555
+
+def test_market_rollup(test_client):
+    """Test OHLCV rollups are built incrementally and served per grain."""
+    response = test_client.get("/api/market/rollup?grain=month&symbols=AAPL&from=2000-01-01&to=2100-01-01")
+    data = response.get_json()
+    assert response.status_code == 200
+    assert len(data["data"]) == 1
+    row = data["data"][0]
+    assert row["symbol"] == "AAPL"
+    assert row["record_count"] == 2
+    assert row["low"] is None and row["volume"] == 1000000
+
+def test_market_rollup_replaced_facts(test_client):
+    """Test a corrected fact is recomputed into its buckets instead of being counted twice."""
+    from cache import response_cache
+    db.session.add(DimCompany(symbol="RLUP", company_name="Rollup Co", sector="Energy", country="CA"))
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    url = "/api/market/rollup?grain=quarter&symbols=RLUP&from=2005-01-01&to=2005-12-31"
+    body = "symbol,datetime,current_price,volume\nRLUP,2005-02-01T10:00:00,5,10\nRLUP,2005-03-01T10:00:00,6,20\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    assert test_client.get(url).get_json()["data"][0]["volume"] == 30
+
+    body = "symbol,datetime,current_price,volume\nRLUP,2005-03-01T10:00:00,7,50\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    response_cache._watermark_checked_at = 0
+    row = test_client.get(url).get_json()["data"][0]
+    assert row["volume"] == 60 and row["record_count"] == 2 and row["close"] == 7
+
+def test_admin_explain_rollup_symbols(test_client):
+    """Test the rollup query with a symbols= IN list can be explained."""
+    response = test_client.get("/admin/explain?endpoint=/api/market/rollup&symbols=AAPL,MSFT&grain=week", headers=ADMIN)
+    assert response.status_code == 200
+    assert "dim_company.symbol IN" in response.get_json()["sql"]
+
+def test_market_rollup_invalid_grain(test_client):
+    """Test an unknown rollup grain is rejected."""
+    response = test_client.get("/api/market/rollup?grain=decade")
+    assert response.status_code == 400
+
+def test_admin_explain_market(test_client):
+    """Test the explain endpoint returns the SQL and plan for a market query."""
+    response = test_client.get("/admin/explain?endpoint=/api/market&country=US&days=30", headers=ADMIN)
+    data = response.get_json()
+    assert response.status_code == 200
+    assert "fact_market_metrics" in data["sql"]
+    assert data["plan"]
+
+def test_admin_explain_unknown_endpoint(test_client):
+    """Test explaining an unregistered endpoint is rejected."""
+    response = test_client.get("/admin/explain?endpoint=/nope", headers=ADMIN)
+    assert response.status_code == 400
+    assert "/api/market" in response.get_json()["endpoints"]
+
+def test_admin_explain_in_list_and_token_guard(test_client):
+    """Test IN-list statements can be explained and the endpoint is closed without ADMIN_TOKEN."""
+    response = test_client.get("/admin/explain?endpoint=/api/market/rollup&symbols=AAPL,MSFT&grain=week", headers=ADMIN)
+    assert response.status_code == 200
+    assert "dim_company.symbol IN" in response.get_json()["sql"]
+    assert "POSTCOMPILE" not in response.get_json()["sql"]
+
+    assert test_client.get("/admin/explain?endpoint=/api/market").status_code == 401
+    app.config["ADMIN_TOKEN"] = None
+    try:
+        assert test_client.get("/admin/explain?endpoint=/api/market", headers=ADMIN).status_code == 404
+        assert test_client.get("/admin/explain?endpoint=/api/market&analyze=true", headers=ADMIN).status_code == 404
+    finally:
+        app.config["ADMIN_TOKEN"] = "secret"
+
+def test_multi_stock_batch(test_client):
+    """Test several tickers are fetched in one request and grouped per symbol."""
+    response = test_client.post("/api/ml-model/stocks", json={
+        "tickers": ["AAPL", "MSFT"], "from": "2000-01-01", "to": "2100-01-01"
+    })
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data["data"]["AAPL"]["company_name"] == "Apple Inc."
+    assert len(data["data"]["AAPL"]["data"]) == 2
+    assert data["missing"] == ["MSFT"]
+
+def test_admin_explain_multi_stock(test_client):
+    """Test the batch endpoint's IN-list query can be explained."""
+    response = test_client.get("/admin/explain?endpoint=/api/ml-model/stocks&tickers=AAPL,MSFT&days=30", headers=ADMIN)
+    assert response.status_code == 200
+    assert "dim_company.symbol IN" in response.get_json()["sql"]
+
+def test_multi_stock_batch_requires_tickers(test_client):
+    """Test the batch endpoint rejects a body without tickers."""
+    response = test_client.post("/api/ml-model/stocks", json={"days": 30})
+    assert response.status_code == 400
+    assert test_client.post("/api/ml-model/stocks", json=["AAPL"]).status_code == 400
+
+def test_asgi_dispatch(test_client):
+    """Test the ASGI app keeps NDJSON streams for itself and hands JSON and other paths to Flask."""
+    pytest.importorskip("starlette")
+    pytest.importorskip("a2wsgi")
+    pytest.importorskip("aiosqlite")
+    from starlette.testclient import TestClient
+    from asgi import app as asgi_app, async_database_url, flask_app, wants_ndjson
+
+    assert async_database_url("postgresql://u:p@db/stocks") == "postgresql+asyncpg://u:p@db/stocks"
+    assert wants_ndjson({"query_string": b"days=30&format=ndjson", "headers": []})
+    assert wants_ndjson({"query_string": b"", "headers": [(b"accept", b"application/x-ndjson")]})
+    assert not wants_ndjson({"query_string": b"", "headers": [(b"accept", b"application/json")]})
+    with flask_app.app_context():
+        create_schema()
+        add_dummy_data()
+    try:
+        with TestClient(asgi_app) as client:
+            assert client.get("/api/ml-model/stock").status_code == 400
+            assert "tables" in client.get("/tables").json()
+
+            url = "/api/market?from=2000-01-01&to=2100-01-01"
+            client.get(url)
+            assert client.get(url).headers["X-Cache"] == "HIT"
+
+            stream = client.get(url + "&format=ndjson", headers={"Accept-Encoding": "identity"})
+            assert "Content-Encoding" not in stream.headers
+            assert stream.headers["content-type"].startswith("application/x-ndjson")
+            assert stream.headers["ETag"] != client.get(url).headers["ETag"]
+            revalidated = client.get(url + "&format=ndjson", headers={"If-None-Match": stream.headers["ETag"]})
+            assert revalidated.status_code == 304
+
+            gzipped = client.get(url + "&format=ndjson", headers={"Accept-Encoding": "gzip"})
+            assert gzipped.headers["Content-Encoding"] == "gzip"
+            assert gzipped.headers["ETag"] == stream.headers["ETag"][:-1] + '-gzip"'
+            assert gzipped.text == stream.text and '"symbol":"AAPL"' in stream.text
+            if flask_app.extensions["response_compression"].zstandard is not None:
+                zstd = client.get(url + "&format=ndjson", headers={"Accept-Encoding": "zstd, gzip"})
+                assert zstd.headers["Content-Encoding"] == "zstd"
+
+            assert client.get("/api/ml-model?format=ndjson&cursor=bad").status_code == 400
+            metrics = client.get("/metrics").text
+            assert 'stockapi_requests_total{endpoint="/api/ml-model",method="GET",status="400"}' in metrics
+            assert 'stockapi_requests_total{endpoint="/api/market",method="GET",status="304"} 1' in metrics
+    finally:
+        with flask_app.app_context():
+            db.drop_all()
+
+def test_metrics_endpoint(test_client):
+    """Test /metrics exposes per-stage histograms in Prometheus text format."""
+    test_client.get("/api/market?from=2000-01-01&to=2100-01-01")
+    response = test_client.get("/metrics")
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'stockapi_request_stage_seconds_count{endpoint="/api/market",stage="db_execute"}' in body
+    assert 'stockapi_requests_total{endpoint="/api/market",method="GET",status="200"}' in body
+    assert "# TYPE stockapi_response_bytes histogram" in body
+
+def test_benchmark_data_generator():
+    """Test the synthetic dataset has one fact per company and trading hour."""
+    from benchmarks.data import create_app, create_schema, populate, dataset_summary
+
+    with create_app("sqlite://").app_context():
+        create_schema()
+        assert populate(companies=3, dates=10) == 30
+        summary = dataset_summary()
+    assert summary["companies"] == 3 and summary["dates"] == 10
+    assert summary["first_datetime"] == "2020-01-01T09:00:00"
+
+def test_ingest_market_metrics_csv(test_client):
+    """Test a CSV batch is loaded idempotently and creates missing dates."""
+    body = (
+        "symbol,datetime,current_price,volume\n"
+        "AAPL,2023-06-01T10:00:00,180.5,1200\n"
+        "MSFT,2023-06-01T10:00:00,330.1,900\n"
+    )
+    first = test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv").get_json()
+    assert first["inserted"] == 1 and first["dates_created"] == 1
+    assert first["errors"] == ["unknown symbol: MSFT"]
+
+    second = test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv").get_json()
+    assert second["inserted"] == 1 and second["replaced"] == 1 and second["dates_created"] == 0
+
+def test_ingest_rejects_unknown_columns(test_client):
+    """Test a batch with columns the fact table does not have is refused."""
+    response = test_client.post(
+        "/api/ingest/market-metrics?format=ndjson", data='{"symbol": "AAPL", "price": 1}\n'
+    )
+    assert response.status_code == 400
+
+def test_ingest_rejects_malformed_records(test_client):
+    """Test a non-string symbol is refused and a CSV row longer than its header is rejected."""
+    response = test_client.post(
+        "/api/ingest/market-metrics?format=ndjson", data='{"symbol": 123, "datetime": "2001-02-03T10:00:00"}\n'
+    )
+    assert response.status_code == 400
+    body = "symbol,datetime,current_price\nAAPL,2001-02-03T10:00:00,1,2\n"
+    response = test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    assert response.status_code == 200
+    assert response.get_json()["errors"] == ["record 1: row has more fields than header"]
+
+def test_ingest_reports_partial_load(test_client):
+    """Test an error after a committed chunk returns the counts of what was loaded."""
+    batch_size = app.config["INGEST_BATCH_SIZE"]
+    app.config["INGEST_BATCH_SIZE"] = 1
+    try:
+        body = '{"symbol": "AAPL", "datetime": "2001-02-03T10:00:00", "current_price": 1}\n{"symbol": "AAPL", "price": 1}\n'
+        response = test_client.post("/api/ingest/market-metrics?format=ndjson", data=body)
+    finally:
+        app.config["INGEST_BATCH_SIZE"] = batch_size
+    assert response.status_code == 400
+    payload = response.get_json()
+    assert payload["partial"] is True and payload["committed_records"] == 1 and payload["inserted"] == 1
+
+def test_ml_model_indicators(test_client):
+    """Test indicator series are computed per symbol and unknown indicators are rejected."""
+    pytest.importorskip("numpy")
+    response = test_client.get(
+        "/api/ml-model/indicators?ticker=AAPL&indicators=sma:2,drawdown&from=2000-01-01&to=2100-01-01"
+    )
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data["indicators"] == ["sma_2", "drawdown"]
+    series = data["data"]["AAPL"]
+    assert len(series["sma_2"]) == len(series["datetime"])
+    assert series["sma_2"][0] is None and series["drawdown"][0] == 0.0
+
+    response = test_client.get("/api/ml-model/indicators?ticker=AAPL&indicators=macd:9")
+    assert response.status_code == 400
+
+def test_admin_explain_indicators(test_client):
+    """Test the indicators endpoint's IN-list query can be explained."""
+    response = test_client.get("/admin/explain?endpoint=/api/ml-model/indicators&tickers=AAPL,MSFT&days=30", headers=ADMIN)
+    assert response.status_code == 200
+    assert response.get_json()["plan"]
+
+def test_schema_cached_with_indexes(test_client):
+    """Test /schema reports columns, indexes and the version stamp it was cached under."""
+    response = test_client.get("/schema")
+    data = response.get_json()
+    assert response.status_code == 200
+    assert {"name": "symbol", "type": "VARCHAR(50)", "nullable": False, "primary_key": False} in data["schema"]["dim_company"]
+    index_names = [index["name"] for index in data["indexes"]["fact_market_metrics"]]
+    assert "ix_fact_market_metrics_company_date" in index_names
+    assert "fact_market_metrics" in data["row_estimates"]
+    assert test_client.get("/tables").get_json()["version"] == data["version"]
+
+def test_row_encoder_matches_dicts(test_client):
+    """Test RowEncoder output equals the per-row dicts, on both encoders and with commas in values."""
+    import json
+    from queries import MARKET_FIELDS, row_converter
+    from serialization import RowEncoder, encoder
+
+    rows = [
+        ("AAPL", "Apple, Inc.", "Tech", "Hardware", "2024-03-15", datetime(2024, 3, 15, 10), 150.5, None, 0.1, 100, 149.0, 151.0, 2.5e12),
+        ("AAPL", "Apple, Inc.", "Tech", "Hardware", "2024-03-15", datetime(2024, 3, 15, 11), 151.0, 0.5, None, 200, None, None, None),
+        ("MSFT", "Microsoft", "Tech", "Software", "2024-03-15", datetime(2024, 3, 15, 10), 400.0, 1.0, 0.25, 300, 399.0, 401.0, 3e12),
+    ]
+    expected = [row_converter(MARKET_FIELDS)(row) for row in rows]
+    for name in ("orjson", "json"):
+        assert json.loads(RowEncoder(MARKET_FIELDS, dumps=encoder(name)).encode_array(rows)) == expected
+    with app.test_request_context():
+        assert json.loads(RowEncoder(MARKET_FIELDS).encode(rows[2])) == expected[2]
+
+def test_market_etag_not_modified(test_client):
+    """Test a matching If-None-Match gets a 304 without a body, and a new fact changes the ETag."""
+    url = "/api/market?from=2000-01-01&to=2100-01-01"
+    first = test_client.get(url)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and not etag.startswith("W/")
+    second = test_client.get(url, headers={"If-None-Match": etag})
+    assert second.status_code == 304 and second.get_data() == b""
+    assert test_client.get(url + "&country=GB", headers={"If-None-Match": etag}).status_code == 200
+
+def test_market_gzip_compression(test_client):
+    """Test buffered JSON and streamed NDJSON are gzip-encoded when the client accepts it."""
+    import gzip
+    import json
+    from cache import response_cache
+    from compression import response_compression
+
+    response_cache._watermark_checked_at = 0
+    response_compression.min_bytes = 0
+    try:
+        url = "/api/market?from=2000-01-01&to=2100-01-01"
+        plain = test_client.get(url).get_json()
+        response = test_client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["ETag"].endswith('-gzip"')
+        assert json.loads(gzip.decompress(response.get_data()))["data"] == plain["data"]
+        gzip_tag = {"If-None-Match": response.headers["ETag"]}
+        assert test_client.get(url, headers={"Accept-Encoding": "gzip", **gzip_tag}).status_code == 304
+        # A client that no longer accepts gzip cannot reuse the gzip representation
+        assert test_client.get(url, headers={"Accept-Encoding": "identity", **gzip_tag}).status_code == 200
+        streamed = test_client.get(url + "&format=ndjson", headers={"Accept-Encoding": "gzip"})
+        assert streamed.headers["Content-Encoding"] == "gzip"
+        lines = gzip.decompress(streamed.get_data()).splitlines()
+        assert [json.loads(line) for line in lines] == plain["data"]
+    finally:
+        response_compression.min_bytes = 1024
+
+def test_fact_trade_datetime_filter(test_client):
+    """Test facts inserted through the ORM get trade_datetime, and the market query filters on it."""
+    from partitions import add_months, partition_name
+    from queries import market_query
+
+    fact = FactMarketMetrics.query.filter_by(fk_date_id=1).first()
+    assert fact.trade_datetime == db.session.get(DimDate, 1).datetime
+    assert "fact_market_metrics.trade_datetime BETWEEN" in str(market_query("US", datetime(2024, 1, 1), datetime(2024, 3, 1)))
+    assert partition_name(add_months(datetime(2024, 11, 1), 3)) == "fact_market_metrics_202502"
+
+def test_trade_datetime_outside_the_orm(test_client):
+    """Test loaders that skip trade_datetime get it from the trigger, and NULL rows still match by date."""
+    from sqlalchemy import text
+    from partitions import ensure_trade_datetime, backfill_trade_datetime
+    company = DimCompany(symbol="TDTM", company_name="Trade Co", country="CA")
+    date_entry = DimDate(datetime=datetime(2007, 5, 6, 10), date="2007-05-06", year=2007)
+    db.session.add_all([company, date_entry])
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    ensure_trade_datetime()
+    keys = {"company": company.sk_company_id, "date": date_entry.sk_date_id}
+    db.session.execute(text(
+        "INSERT INTO fact_market_metrics (fk_company_id, fk_date_id, current_price) VALUES (:company, :date, 7.5)"
+    ), keys)
+    db.session.commit()
+    fact = FactMarketMetrics.query.filter_by(fk_company_id=company.sk_company_id).one()
+    assert fact.trade_datetime == datetime(2007, 5, 6, 10)
+
+    later = DimDate(datetime=datetime(2007, 5, 7, 10), date="2007-05-07", year=2007)
+    db.session.add(later)
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    db.session.execute(text(
+        "INSERT INTO fact_market_metrics (fk_company_id, fk_date_id, current_price) VALUES (:company, :date, 8.5)"
+    ), {"company": company.sk_company_id, "date": later.sk_date_id})
+    db.session.commit()
+
+    db.session.execute(text("UPDATE fact_market_metrics SET trade_datetime = NULL WHERE fk_date_id = :date"), keys)
+    db.session.commit()
+    url = "/api/ml-model/stock?ticker=TDTM&from=2007-05-01&to=2007-05-31"
+    assert [row["current_price"] for row in test_client.get(url).get_json()["data"]] == [7.5, 8.5]
+
+    # The NULL row keeps its place in time order, and its cursor resumes the page after it
+    url = "/api/ml-model?country=CA&from=2007-05-01&to=2007-05-31&limit=1"
+    first = test_client.get(url).get_json()
+    assert first["data"][0]["current_price"] == 7.5
+    second = test_client.get(url + "&cursor=" + first["metadata"]["next_cursor"])
+    assert second.status_code == 200 and second.get_json()["data"][0]["current_price"] == 8.5
+    assert backfill_trade_datetime() == 1
+
+def test_market_latest(test_client):
+    """Test the latest-quote snapshot keeps each company's newest fact across ingests."""
+    body = "symbol,datetime,current_price,volume\nAAPL,2099-12-31T15:00:00,199.5,10\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    body = "symbol,datetime,current_price,volume\nAAPL,2001-01-02T10:00:00,1.5,10\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+
+    response = test_client.get("/api/market/latest?country=US&sector=Technology")
+    data = response.get_json()
+    assert response.status_code == 200
+    assert [row["symbol"] for row in data["data"]] == ["AAPL"]
+    assert data["data"][0]["current_price"] == 199.5
+    assert data["data"][0]["datetime"].startswith("2099-12-31T15:00:00")
+    assert test_client.get("/api/market/latest?sector=Energy").get_json()["data"] == []
+
+def test_market_latest_replaced_fact(test_client):
+    """Test correcting the newest fact updates the snapshot even when SQLite reuses its key."""
+    from cache import response_cache
+    db.session.add(DimCompany(symbol="LTST", company_name="Latest Co", sector="Energy", country="CA"))
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    body = "symbol,datetime,current_price,volume\nLTST,2006-01-02T10:00:00,1.5,10\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    assert test_client.get("/api/market/latest?symbols=LTST").get_json()["data"][0]["current_price"] == 1.5
+    test_client.post("/api/ingest/market-metrics", data=body.replace("1.5", "2.5"), content_type="text/csv")
+    response_cache._watermark_checked_at = 0
+    assert test_client.get("/api/market/latest?symbols=LTST").get_json()["data"][0]["current_price"] == 2.5
+
+def test_refresh_reads_late_committed_facts(test_client):
+    """Test a fact whose lower id commits after a refresh read past it still reaches rollups and snapshot."""
+    from sqlalchemy import func
+    from models import AggLatestQuote, AggMarketRollup
+    from rollups import refresh_rollups, rollups_stale
+    from latest import refresh_latest, latest_stale
+    company = DimCompany(symbol="LATE", company_name="Late Co", sector="Energy", country="CA")
+    january = DimDate(datetime=datetime(2008, 1, 2, 10), date="2008-01-02", year=2008)
+    february = DimDate(datetime=datetime(2008, 2, 1, 10), date="2008-02-01", year=2008)
+    db.session.add_all([company, january, february])
+    db.session.flush()
+    skipped = (db.session.query(func.max(FactMarketMetrics.sk_market_metrics_id)).scalar() or 0) + 1
+    db.session.add(FactMarketMetrics(
+        sk_market_metrics_id=skipped + 1, fk_company_id=company.sk_company_id, fk_date_id=january.sk_date_id,
+        current_price=4, volume=20
+    ))
+    db.session.commit()
+    refresh_rollups()
+    refresh_latest()
+    quarter = AggMarketRollup.query.filter_by(grain="quarter", fk_company_id=company.sk_company_id).one()
+    assert quarter.volume == 20
+    assert float(db.session.get(AggLatestQuote, company.sk_company_id).current_price) == 4
+
+    # The transaction holding the lower id commits only now
+    db.session.add(FactMarketMetrics(
+        sk_market_metrics_id=skipped, fk_company_id=company.sk_company_id, fk_date_id=february.sk_date_id,
+        current_price=5, volume=10
+    ))
+    db.session.commit()
+    assert rollups_stale() and latest_stale()
+    refresh_rollups()
+    refresh_latest()
+    quarter = AggMarketRollup.query.filter_by(grain="quarter", fk_company_id=company.sk_company_id).one()
+    assert quarter.volume == 30 and quarter.record_count == 2
+    assert float(db.session.get(AggLatestQuote, company.sk_company_id).current_price) == 5
+    assert not rollups_stale() and not latest_stale()
+
+def test_admin_explain_latest_symbols(test_client):
+    """Test the snapshot query with a symbols= IN list can be explained."""
+    response = test_client.get("/admin/explain?endpoint=/api/market/latest&symbols=AAPL,MSFT", headers=ADMIN)
+    assert response.status_code == 200
+    assert "dim_company.symbol IN" in response.get_json()["sql"]
+
+def test_screener(test_client):
+    """Test screens filter on fundamentals and sectors and keep the top of the sort."""
+    pytest.importorskip("numpy")
+    db.session.add_all([
+        DimCompany(symbol="SCRA", sector="Energy", country="US", pe_ratio_ttm=8, mkt_cap=5e9),
+        DimCompany(symbol="SCRB", sector="Energy", country="US", pe_ratio_ttm=12, mkt_cap=9e9),
+        DimCompany(symbol="SCRC", sector="Energy", country="US", pe_ratio_ttm=40, mkt_cap=7e9),
+    ])
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+
+    response = test_client.get("/api/screener?sector=Energy&pe_ratio_ttm_max=20&sort=-mkt_cap&limit=1")
+    data = response.get_json()
+    assert response.status_code == 200
+    assert [row["symbol"] for row in data["data"]] == ["SCRB"]
+    assert data["metadata"]["matched"] == 2
+    assert test_client.get("/api/screener?sort=volume").status_code == 400
+
+def test_create_app_factory():
+    """Test the factory builds an independent app with config overrides and every route."""
+    from app import create_app
+    second = create_app({"PROVISION_INDEXES_ON_STARTUP": False, "PARTITION_MAINTENANCE_ON_STARTUP": False, "LOG_FILE": ""})
+    assert second is not app
+    assert not second.config["PROVISION_INDEXES_ON_STARTUP"]
+    assert {rule.rule for rule in app.url_map.iter_rules()} == {rule.rule for rule in second.url_map.iter_rules()}
+    assert second.test_client().get("/").status_code == 200
+
+    # Extension settings and backends belong to each app; importing app.py builds none
+    import app as app_module
+    from cache import response_cache
+    third = create_app({"PROVISION_INDEXES_ON_STARTUP": False, "PARTITION_MAINTENANCE_ON_STARTUP": False,
+                        "LOG_FILE": "", "CACHE_TTL_SECONDS": 7, "CACHE_BACKEND": "none"})
+    with third.app_context():
+        assert response_cache.ttl == 7 and not response_cache.enabled
+    with app.app_context():
+        assert response_cache.ttl == app.config["CACHE_TTL_SECONDS"] and response_cache.enabled
+    assert third.extensions["response_cache"] is not app.extensions["response_cache"]
+    assert not hasattr(app_module, "app")
+
+def test_single_flight_coalesces_concurrent_misses():
+    """Test identical concurrent misses run the view once and share its body."""
+    import threading
+    import time
+    from flask import Flask, jsonify
+    from cache import response_cache
+
+    calls = []
+    probe = Flask("single_flight_probe")
+
+    @probe.route("/slow")
+    @response_cache.cached("/slow")
+    def slow():
+        calls.append(1)
+        time.sleep(0.3)
+        return jsonify({"calls": len(calls)})
+
+    backend, response_cache.backend = response_cache.backend, None
+    response_cache._watermark, response_cache._watermark_checked_at = "probe", time.monotonic() + 60
+    try:
+        results = []
+        barrier = threading.Barrier(6)
+
+        def fetch():
+            barrier.wait()
+            response = probe.test_client().get("/slow?country=US")
+            results.append((response.headers["X-Cache"], response.get_json()["calls"]))
+
+        threads = [threading.Thread(target=fetch) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        response_cache.backend = backend
+        response_cache._watermark_checked_at = 0
+
+    assert len(calls) == 1
+    assert sorted(cache for cache, _ in results) == ["COALESCED"] * 5 + ["MISS"]
+    assert {count for _, count in results} == {1}
+
+def test_export_job_download_with_range(test_client, tmp_path):
+    """Test an export job writes the market rows to gzipped NDJSON, is reused, and serves byte ranges."""
+    import gzip
+    import json
+    import time
+    from exports import export_jobs
+
+    export_jobs.directory = str(tmp_path)
+    response = test_client.post("/api/exports?endpoint=/api/market&country=US&days=all&format=ndjson")
+    assert response.status_code in (200, 202)
+    job = response.get_json()
+    for _ in range(100):
+        job = test_client.get(job["status_url"]).get_json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+
+    again = test_client.post("/api/exports", json={"endpoint": "/api/market", "country": "US", "days": "all"})
+    assert again.status_code == 200 and again.get_json()["id"] == job["id"]
+
+    full = test_client.get(job["download_url"])
+    assert full.status_code == 200 and full.headers.get("Content-Encoding") is None
+    rows = [json.loads(line) for line in gzip.decompress(full.data).splitlines()]
+    assert len(rows) == job["record_count"] and rows[0]["symbol"] == "AAPL"
+    partial = test_client.get(job["download_url"], headers={"Range": "bytes=0-9"})
+    assert partial.status_code == 206 and partial.data == full.data[:10]
+    assert test_client.post("/api/exports?endpoint=/api/dim_date").status_code == 400
+    assert test_client.post("/api/exports", json=[{"endpoint": "/api/market"}]).status_code == 400
+
+def test_series_store_matches_database(test_client, tmp_path):
+    """Test reads from the memory-mapped series store equal the database path, before and after appends."""
+    pytest.importorskip("numpy")
+    from series_store import series_store
+    db.session.add(DimCompany(symbol="SERA", company_name="Series A", sector="Energy", country="US"))
+    db.session.commit()
+    dimension_cache.snapshot(force=True)
+    body = "symbol,datetime,current_price,volume\nSERA,2002-03-04T10:00:00,2.5,20\nSERA,2002-03-05T10:00:00,2.75,\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+    url = "/api/ml-model/stock?ticker=SERA&days=all&to=2099-12-31"
+    expected = test_client.get(url).get_json()["data"]
+    assert len(expected) == 2
+
+    series_store.directory = str(tmp_path)
+    try:
+        series_store.refresh()
+        assert series_store.manifest()["symbols"]["SERA"]["rows"] == 2
+        assert test_client.get(url + "&v=1").get_json()["data"] == expected
+
+        # A late fact rewrites the file, a newer one is appended
+        body = "symbol,datetime,current_price,volume\nSERA,2002-03-04T12:00:00,2.6,5\nSERA,2003-01-02T10:00:00,3.0,7\n"
+        test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+        series_store.refresh()
+        assert series_store.manifest()["symbols"]["SERA"]["rows"] == 4
+        request = {"tickers": ["SERA"], "days": "all", "to": "2099-12-31"}
+        stored = test_client.post("/api/ml-model/stocks", json=request).get_json()["data"]
+        series_store.directory = None
+        assert stored == test_client.post("/api/ml-model/stocks", json=request).get_json()["data"]
+
+        # Correcting the newest fact reuses its key on SQLite; the replacement log still rewrites the symbol
+        series_store.directory = str(tmp_path)
+        body = "symbol,datetime,current_price,volume\nSERA,2003-01-02T10:00:00,9.5,3\n"
+        test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+        series_store.refresh()
+        stored = test_client.post("/api/ml-model/stocks", json=request).get_json()["data"]
+        assert [row["current_price"] for row in stored["SERA"]["data"]] == [2.5, 2.6, 2.75, 9.5]
+        series_store.directory = None
+        assert stored == test_client.post("/api/ml-model/stocks", json=request).get_json()["data"]
+    finally:
+        series_store.directory = None
+
+def test_fields_projection(test_client):
+    """Test fields= narrows the rows, skips unneeded joins and rejects unknown fields."""
+    from queries import market_query, stock_query
+    body = "symbol,datetime,current_price,volume,eps\nAAPL,2004-05-06T10:00:00,4.5,40,1.25\n"
+    test_client.post("/api/ingest/market-metrics", data=body, content_type="text/csv")
+
+    response = test_client.get("/api/ml-model/stock?ticker=AAPL&from=2004-05-06&to=2004-05-07&fields=symbol,current_price,eps")
+    assert response.status_code == 200
+    assert response.get_json()["data"] == [{"symbol": "AAPL", "current_price": 4.5, "eps": 1.25}]
+    rows = test_client.get("/api/market?from=2004-05-06&to=2004-05-07&fields=symbol,datetime,volume").get_json()["data"]
+    assert rows == [{"symbol": "AAPL", "datetime": "2004-05-06T10:00:00", "volume": 40}]
+
+    window = (datetime(2004, 1, 1), datetime(2005, 1, 1))
+    assert "JOIN" not in str(stock_query("AAPL", *window, fields=("current_price", "volume")))
+    assert "JOIN dim_date" not in str(market_query("US", *window, fields=("symbol", "current_price")))
+    assert test_client.get("/api/market?fields=symbol,password").status_code == 400
@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, text, update
+
+from models import db, DataVersion, FactMarketMetrics, FactReplacement
+from schema_cache import schema_cache
+
+# data_version row bumped by every write the API makes to the warehouse.
+VERSION_NAME = 'fact_market_metrics'
+# data_version row holding the highest fact_replacement id deleted by prune_replacements().
+PRUNED_NAME = 'fact_replacement_pruned'
+
+_table_ready = False
+
+
+def ensure_change_tables():
+    global _table_ready
+    if not _table_ready:
+        for model in (DataVersion, FactReplacement):
+            model.__table__.create(db.engine, checkfirst=True)
+        schema_cache.invalidate()
+        _table_ready = True
+
+
+def bump_data_version():
+    """Count a write to the facts or the tables derived from them, in the caller's transaction.
+
+    Writers call this so the watermark moves even when a delete+insert
+    leaves the key range and row count as they were (SQLite reuses freed
+    surrogate keys).
+    """
+    ensure_change_tables()
+    bumped = db.session.execute(
+        update(DataVersion).where(DataVersion.name == VERSION_NAME).values(
+            version=DataVersion.version + 1, updated_at=datetime.now()
+        )
+    ).rowcount
+    if not bumped:
+        db.session.add(DataVersion(name=VERSION_NAME, version=1, updated_at=datetime.now()))
+        db.session.flush()
+
+
+def data_version(name=VERSION_NAME):
+    ensure_change_tables()
+    return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
+
+
+def log_replacements(keys):
+    """Record the (fk_company_id, datetime) of replaced facts, in the caller's transaction.
+
+    Derived tables fold new facts by surrogate key, which cannot tell a
+    corrected fact from a new one (and SQLite may even reuse the deleted
+    key). Each of them reads this log from its own position and rebuilds
+    what the listed keys touch.
+    """
+    if keys:
+        ensure_change_tables()
+        db.session.execute(insert(FactReplacement), [
+            {'fk_company_id': company_id, 'trade_datetime': dt} for company_id, dt in keys
+        ])
+
+
+def last_replacement_id():
+    ensure_change_tables()
+    return db.session.query(func.max(FactReplacement.id)).scalar() or 0
+
+
+def replacement_rows(criteria, limit=None):
+    """Logged (id, fk_company_id, trade_datetime) rows matching ``criteria``, oldest first."""
+    ensure_change_tables()
+    query = db.session.query(
+        FactReplacement.id, FactReplacement.fk_company_id, FactReplacement.trade_datetime
+    ).filter(*criteria).order_by(FactReplacement.id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def replacements_after(after_id, through_id=None, limit=None):
+    """Logged rows with ``after_id`` < id <= ``through_id``, oldest first."""
+    criteria = [FactReplacement.id > after_id]
+    if through_id is not None:
+        criteria.append(FactReplacement.id <= through_id)
+    return replacement_rows(criteria, limit)
+
+
+def prune_replacements(through_id):
+    """Delete log rows every consumer has applied; readers behind ``through_id`` must rebuild."""
+    ensure_change_tables()
+    if through_id <= data_version(PRUNED_NAME):
+        return
+    db.session.execute(delete(FactReplacement).where(FactReplacement.id <= through_id))
+    pruned = db.session.execute(
+        update(DataVersion).where(DataVersion.name == PRUNED_NAME).values(version=through_id, updated_at=datetime.now())
+    ).rowcount
+    if not pruned:
+        db.session.add(DataVersion(name=PRUNED_NAME, version=through_id, updated_at=datetime.now()))
+        db.session.flush()
+
+
+def fact_watermark():
+    """Cheap fingerprint of fact_market_metrics.
+
+    Combines the highest surrogate key, a modification counter (the tuple
+    insert/update/delete statistics on PostgreSQL, of every partition once
+    the table is partitioned; the row count elsewhere) and the data_version
+    counter. On SQLite, a loader that replaces rows without changing the
+    key range or count is not seen until ``flask data-version-bump`` is run.
+    """
+    max_id = db.session.query(func.max(FactMarketMetrics.sk_market_metrics_id)).scalar() or 0
+
+    if db.engine.dialect.name == 'postgresql':
+        # Summed over pg_partition_tree: a partitioned table keeps its statistics on the partitions
+        changes = db.session.execute(text(
+            "SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) FROM pg_stat_user_tables "
+            "WHERE relid IN (SELECT relid FROM pg_partition_tree(CAST(:table AS regclass)))"
+        ), {"table": FactMarketMetrics.__tablename__}).scalar() or 0
+    else:
+        changes = db.session.query(func.count(FactMarketMetrics.sk_market_metrics_id)).scalar() or 0
+
+    return f"{max_id}.{changes}.{data_version()}"
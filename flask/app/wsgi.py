@@ -0,0 +1,4 @@
+"""WSGI entry point: ``gunicorn -c gunicorn.conf.py`` serves ``wsgi:app``, and ``flask`` finds it here."""
+from app import create_app
+
+app = create_app()